@@ -0,0 +1,200 @@
+# benchmark.py
+#
+# Solver benchmark over synthetic wards, using the same parse/build/solve path as the server.
+# Every case runs in its own process so its peak RSS belongs to that case only; the presolved
+# model size comes from the result's modelStats.
+#
+#   python benchmark.py --nurses 10,20,40,60,100 --days 28,31 --time-limit 30 --output bench.json --csv bench.csv
+#   python benchmark.py --nurses 20,40 --compare bench.json
+
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+
+RESULT_MARKER = 'BENCHMARK_RESULT '
+CSV_FIELDS = [
+    'caseId', 'numNurses', 'numDays', 'seed', 'timeLimit', 'solverStatus', 'penaltyValue', 'bestBound',
+    'modelBuildSeconds', 'warmStartSeconds', 'modelVariables', 'modelConstraints', 'presolveSeconds', 'presolvedVariables',
+    'presolvedConstraints', 'firstSolutionSeconds', 'bestSolutionSeconds', 'solutionCount', 'solveSeconds',
+    'totalSeconds', 'peakRssMb',
+]
+REGRESSION_METRICS = ['modelBuildSeconds', 'firstSolutionSeconds', 'penaltyValue', 'peakRssMb']
+
+
+def run_case_in_this_process():
+    import resource
+    from telemetry import configure_logging
+    from schedule_model import parse_schedule_request
+    from rolling_horizon import run_rolling_horizon_solve
+
+    configure_logging()
+
+    case = json.loads(sys.stdin.read())
+    solutions = []
+
+    def record_solution(solution):
+        # The greedy draft has no penalty yet; the solver reports the same roster as its first solution.
+        if solution.get('draft'):
+            return
+        solutions.append({
+            'elapsedSeconds': solution['elapsedSeconds'],
+            'penaltyValue': solution['penaltyValue'],
+            'bestBound': solution['bestBound'],
+        })
+
+    # Falls through to the greedy warm-started run_schedule_solve() unless the payload asks for rolling horizon.
+    result, status_code = run_rolling_horizon_solve(parse_schedule_request(case['payload']), on_solution=record_solution)
+    metrics = {
+        'httpStatus': status_code,
+        'solverStatus': result.get('solverStatus'),
+        'error': result.get('error'),
+        'penaltyValue': result.get('penaltyValue'),
+        'modelStats': result.get('modelStats', {}),
+        'timings': result.get('timings', {}),
+        'solutions': solutions,
+        'peakRssMb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    sys.stdout.flush()
+    print(RESULT_MARKER + json.dumps(metrics), flush=True)
+
+
+def run_case(case):
+    process = subprocess.run(
+        [sys.executable, __file__, '--run-case'],
+        input=json.dumps(case), capture_output=True, text=True,
+    )
+    metrics = None
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            metrics = json.loads(line[len(RESULT_MARKER):])
+    if metrics is None:
+        raise RuntimeError(f"Benchmark case {case['caseId']} produced no result (exit code {process.returncode}): {process.stderr[-2000:]}")
+
+    solutions = metrics['solutions']
+    model_stats = metrics['modelStats']
+    timings = metrics['timings']
+    return {
+        'caseId': case['caseId'],
+        'numNurses': case['numNurses'],
+        'numDays': case['numDays'],
+        'seed': case['seed'],
+        'timeLimit': case['payload']['solverTimeLimit'],
+        'solverStatus': metrics['solverStatus'] or f"HTTP {metrics['httpStatus']}",
+        'penaltyValue': metrics['penaltyValue'],
+        'bestBound': solutions[-1]['bestBound'] if solutions else None,
+        'modelBuildSeconds': timings.get('modelBuildSeconds'),
+        'warmStartSeconds': timings.get('warmStartSeconds'),
+        'modelVariables': model_stats.get('variables'),
+        'modelConstraints': model_stats.get('constraints'),
+        'presolveSeconds': timings.get('stages', {}).get('presolve'),
+        'presolvedVariables': model_stats.get('presolvedVariables'),
+        'presolvedConstraints': model_stats.get('presolvedConstraints'),
+        'firstSolutionSeconds': solutions[0]['elapsedSeconds'] if solutions else None,
+        'bestSolutionSeconds': solutions[-1]['elapsedSeconds'] if solutions else None,
+        'solutionCount': len(solutions),
+        'solveSeconds': timings.get('solveSeconds'),
+        'totalSeconds': timings.get('totalSeconds'),
+        'peakRssMb': metrics['peakRssMb'],
+        'error': metrics['error'],
+    }
+
+
+def build_cases(nurse_counts, day_counts, seeds, time_limit, year, month, rolling_horizon=False):
+    from synthetic_wards import generate_ward_payload
+
+    cases = []
+    for num_nurses in nurse_counts:
+        for num_days in day_counts:
+            for seed in seeds:
+                payload = generate_ward_payload(num_nurses, num_days=num_days, year=year, month=month,
+                                                seed=seed, solver_time_limit=time_limit)
+                payload['bypassCache'] = True
+                payload['rollingHorizon'] = rolling_horizon
+                cases.append({
+                    'caseId': f'n{num_nurses}-d{num_days}-s{seed}',
+                    'numNurses': num_nurses,
+                    'numDays': num_days,
+                    'seed': seed,
+                    'payload': payload,
+                })
+    return cases
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {row['caseId']: row for row in json.load(f)['results']}
+
+    regressions = []
+    for row in results:
+        base_row = baseline.get(row['caseId'])
+        if not base_row:
+            continue
+        for metric in REGRESSION_METRICS:
+            old_value, new_value = base_row.get(metric), row.get(metric)
+            if old_value is None or new_value is None:
+                continue
+            if new_value > old_value * (1 + tolerance) and new_value - old_value > 0.05:
+                regressions.append(f"{row['caseId']}: {metric} {old_value} -> {new_value}")
+        if base_row.get('solverStatus') == 'OPTIMAL' and row['solverStatus'] != 'OPTIMAL':
+            regressions.append(f"{row['caseId']}: solverStatus {base_row['solverStatus']} -> {row['solverStatus']}")
+    return regressions
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark schedule model build and solve performance on synthetic wards.")
+    parser.add_argument('--run-case', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--nurses', default='10,20,40', help="Comma separated nurse counts (default: 10,20,40)")
+    parser.add_argument('--days', default='28,31', help="Comma separated horizon lengths in days (default: 28,31)")
+    parser.add_argument('--seeds', default='1', help="Comma separated random seeds (default: 1)")
+    parser.add_argument('--time-limit', type=float, default=30.0, help="Solver time limit per case in seconds")
+    parser.add_argument('--year', type=int, default=2026)
+    parser.add_argument('--month', type=int, default=1, help="Month to schedule; must have at least max(--days) days")
+    parser.add_argument('--rolling-horizon', action='store_true', help="Solve in overlapping week windows followed by a polishing pass")
+    parser.add_argument('--label', default='', help="Free-form label stored with the results, e.g. a git revision")
+    parser.add_argument('--output', help="Write results as JSON to this path")
+    parser.add_argument('--csv', help="Write results as CSV to this path")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier run to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case_in_this_process()
+        return 0
+
+    cases = build_cases(parse_int_list(args.nurses), parse_int_list(args.days), parse_int_list(args.seeds),
+                        args.time_limit, args.year, args.month, args.rolling_horizon)
+    results = []
+    for case in cases:
+        print(f"Running {case['caseId']} ...", flush=True)
+        row = run_case(case)
+        results.append(row)
+        print(f"  {row['solverStatus']} penalty={row['penaltyValue']} build={row['modelBuildSeconds']}s "
+              f"first={row['firstSolutionSeconds']}s best={row['bestSolutionSeconds']}s rss={row['peakRssMb']}MB", flush=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'label': args.label, 'createdAt': time.time(), 'results': results}, f, indent=2, ensure_ascii=False)
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+
+    if args.compare:
+        regressions = compare_with_baseline(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# boundary_store.py
+
+from collections import OrderedDict
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from schedule_model import ScheduleInputError, get_schedule_boundary
+
+logger = logging.getLogger(__name__)
+
+
+def schedule_month(date_str):
+    # 'YYYY-MM' of an ISO date (or datetime) string.
+    return date_str.split('T')[0][:7]
+
+
+def month_before(date_str):
+    first_of_month = datetime.date.fromisoformat(date_str.split('T')[0]).replace(day=1)
+    return (first_of_month - datetime.timedelta(days=1)).isoformat()[:7]
+
+
+class MemoryBoundaryStore:
+    # End-of-month boundary states ({nurseId: {"lastDayShifts": [...], "consecutiveShifts": k}}) keyed by
+    # (ward, month). Boundaries are small and never go stale, so entries only leave when the store is full.
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ward_id, month):
+        with self._lock:
+            entry = self._entries.get((str(ward_id), month))
+            if entry is None:
+                return None
+            self._entries.move_to_end((str(ward_id), month))
+            return entry
+
+    def put(self, ward_id, month, boundary):
+        with self._lock:
+            self._entries[(str(ward_id), month)] = {'updatedAt': time.time(), 'boundary': boundary}
+            self._entries.move_to_end((str(ward_id), month))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteBoundaryStore:
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS schedule_boundary_states ("
+                " ward_id TEXT NOT NULL,"
+                " month TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " boundary TEXT NOT NULL,"
+                " PRIMARY KEY (ward_id, month))"
+            )
+
+    def get(self, ward_id, month):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at, boundary FROM schedule_boundary_states WHERE ward_id = ? AND month = ?", (str(ward_id), month)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'updatedAt': row[0], 'boundary': json.loads(row[1])}
+
+    def put(self, ward_id, month, boundary):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO schedule_boundary_states (ward_id, month, updated_at, boundary) VALUES (?, ?, ?, ?)",
+                (str(ward_id), month, now, json.dumps(boundary, ensure_ascii=False)),
+            )
+            self._conn.execute(
+                "DELETE FROM schedule_boundary_states WHERE rowid NOT IN ("
+                " SELECT rowid FROM schedule_boundary_states ORDER BY updated_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+
+def remember_schedule_boundary(store, ward_id, schedule):
+    # Stores the boundary at the end of a generated or accepted roster under the month of its last day.
+    days_iso = schedule.get('days') or []
+    if ward_id is None or not days_iso:
+        return None
+    month = schedule_month(days_iso[-1])
+    store.put(ward_id, month, get_schedule_boundary(schedule))
+    logger.debug("Stored boundary state for ward %s, month %s", ward_id, month)
+    return month
+
+
+def resolve_boundary_key(data, store):
+    # Replaces "previousMonthBoundaryKey": {"wardId": ..., "month": "YYYY-MM"} in a schedule payload with the stored
+    # previousMonthBoundary; month defaults to the month before the schedule's startDate.
+    if not isinstance(data, dict) or data.get('previousMonthBoundaryKey') is None:
+        return data
+    boundary_key = data['previousMonthBoundaryKey']
+    if not isinstance(boundary_key, dict) or boundary_key.get('wardId') is None:
+        raise ScheduleInputError("Invalid 'previousMonthBoundaryKey' format, expected an object with 'wardId'")
+    try:
+        month = boundary_key.get('month') or month_before(data['schedule']['startDate'])
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise ScheduleInputError(f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}")
+    entry = store.get(boundary_key['wardId'], month)
+    if entry is None:
+        raise ScheduleInputError(f"ไม่พบข้อมูลปลายเดือนก่อนหน้าของวอร์ด {boundary_key['wardId']} เดือน {month}", 404)
+    resolved = {key: value for key, value in data.items() if key != 'previousMonthBoundaryKey'}
+    resolved['previousMonthBoundary'] = entry['boundary']
+    return resolved
+
+
+def create_boundary_store(max_entries=1024, sqlite_path=None):
+    if sqlite_path:
+        logger.info("Using SQLite boundary state store at %s", sqlite_path)
+        return SqliteBoundaryStore(sqlite_path, max_entries=max_entries)
+    return MemoryBoundaryStore(max_entries=max_entries)
@@ -0,0 +1,69 @@
+# cpu_budget.py
+
+from contextlib import contextmanager
+import itertools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CpuBudget:
+    # Splits a fixed number of CP-SAT search workers between the solves that are running at the same time.
+    # A solve keeps the workers it was given until it finishes, so a new solve gets its priority-weighted
+    # share of the cores that are still free, clamped to [floor, ceiling]. Solve slots that are expected
+    # but not yet in use count as priority 1, so the first solve of a busy period does not take every core.
+    def __init__(self, total_workers, min_workers_per_solve=1, max_workers_per_solve=8, expected_concurrent_solves=1):
+        if total_workers < 1: raise ValueError("total_workers must be >= 1")
+        if min_workers_per_solve < 1: raise ValueError("min_workers_per_solve must be >= 1")
+        if max_workers_per_solve < min_workers_per_solve: raise ValueError("max_workers_per_solve must be >= min_workers_per_solve")
+        self.total_workers = total_workers
+        self.min_workers_per_solve = min_workers_per_solve
+        self.max_workers_per_solve = max_workers_per_solve
+        self.expected_concurrent_solves = max(expected_concurrent_solves, 1)
+        self._lock = threading.Lock()
+        self._active = {}
+        self._tokens = itertools.count(1)
+
+    def acquire(self, priority=1, min_workers=None, max_workers=None):
+        ceiling = min(self.max_workers_per_solve, max_workers or self.max_workers_per_solve)
+        floor = min(max(self.min_workers_per_solve, min_workers or 0), ceiling)
+        with self._lock:
+            used_workers = sum(workers for workers, _ in self._active.values())
+            free_workers = max(self.total_workers - used_workers, 0)
+            idle_slots = max(self.expected_concurrent_solves - len(self._active) - 1, 0)
+            total_priority = sum(active_priority for _, active_priority in self._active.values()) + priority + idle_slots
+            fair_share = max(1, self.total_workers * priority // total_priority)
+            workers = max(floor, min(ceiling, fair_share, free_workers))
+            token = next(self._tokens)
+            self._active[token] = (workers, priority)
+            allocation = {
+                'token': token,
+                'numWorkers': workers,
+                'priority': priority,
+                'concurrentSolves': len(self._active),
+                'totalWorkers': self.total_workers,
+            }
+        logger.info("CPU budget: granted %d solver workers (priority %d, %d active solves, %d of %d workers were free)",
+                    workers, priority, allocation['concurrentSolves'], free_workers, self.total_workers)
+        return allocation
+
+    def release(self, allocation):
+        with self._lock:
+            self._active.pop(allocation['token'], None)
+
+    @contextmanager
+    def allocate(self, priority=1, min_workers=None, max_workers=None):
+        allocation = self.acquire(priority, min_workers, max_workers)
+        try:
+            yield allocation
+        finally:
+            self.release(allocation)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'totalWorkers': self.total_workers,
+                'allocatedWorkers': sum(workers for workers, _ in self._active.values()),
+                'activeSolves': len(self._active),
+            }
@@ -0,0 +1,236 @@
+# greedy_roster.py
+
+import logging
+import random
+import time
+
+import numpy as np
+
+from schedule_model import (
+    MAX_CONSECUTIVE_OFF_DAYS, MAX_CONSECUTIVE_SAME_SHIFT, MIN_OFF_DAYS_IN_WINDOW, PERSONAL_CONSTRAINT_TYPES, SHIFT_AFTERNOON,
+    SHIFT_MORNING, SHIFT_NIGHT, SHIFTS, SYMMETRY_PREFIX_DAYS, WINDOW_SIZE_FOR_MIN_OFF, MaxNightsPerWeekConstraint,
+    NoNightAfternoonDoubleConstraint, build_assignments_result, get_day_calendar, get_interchangeable_nurse_classes,
+    run_schedule_solve,
+)
+from solve_cancellation import is_solve_cancelled
+
+logger = logging.getLogger(__name__)
+
+# Tries with different tie-breaking before giving up; one try takes a few milliseconds for a month.
+GREEDY_ROSTER_ATTEMPTS = 20
+# Nights first (an afternoon the day before rules them out), then mornings, which are never combined, then
+# afternoons, the only shift that can be doubled up with the night already assigned.
+GREEDY_FILL_ORDER = [SHIFT_NIGHT, SHIFT_MORNING, SHIFT_AFTERNOON]
+GREEDY_DOUBLE_PARTNER = {SHIFT_AFTERNOON: SHIFT_NIGHT, SHIFT_NIGHT: SHIFT_AFTERNOON}
+
+
+def get_greedy_rules(schedule_request, calendar):
+    # The hard personal constraints in a form a day-by-day pass can check: blocked shifts (nurses, days, 3), nurses
+    # who may not double N+A and weekly night limits, plus the shifts soft constraints would rather avoid.
+    # Returns None if a hard constraint cannot be checked one day at a time (paired nurses, custom types).
+    num_nurses = len(schedule_request['nurse_ids'])
+    rules = {
+        'blocked': np.zeros((num_nurses, calendar['num_days'], len(SHIFTS)), dtype=bool),
+        'avoid': np.zeros((num_nurses, calendar['num_days'], len(SHIFTS)), dtype=bool),
+        'no_double': np.zeros(num_nurses, dtype=bool),
+        'avoid_double': np.zeros(num_nurses, dtype=bool),
+        'max_week_nights': np.full(num_nurses, calendar['num_days']),
+    }
+    for n, nurse in enumerate(schedule_request['nurses']):
+        for constraint in nurse.get('constraints', []) or []:
+            handler = PERSONAL_CONSTRAINT_TYPES.get(constraint.get('type'))
+            strength = constraint.get('strength', 'hard')
+            if handler is None or strength not in ('hard', 'soft'):
+                continue
+            try:
+                value = handler.parse_value(constraint.get('value'))
+                mask = handler.blocked_shifts(calendar, value)
+            except (ValueError, TypeError):
+                # build_model() skips these as well.
+                continue
+            if strength == 'soft':
+                if isinstance(handler, NoNightAfternoonDoubleConstraint):
+                    rules['avoid_double'][n] = True
+                elif mask is not None:
+                    rules['avoid'][n] |= mask
+            elif isinstance(handler, NoNightAfternoonDoubleConstraint):
+                rules['no_double'][n] = True
+            elif isinstance(handler, MaxNightsPerWeekConstraint):
+                rules['max_week_nights'][n] = min(rules['max_week_nights'][n], value)
+            elif mask is not None:
+                rules['blocked'][n] |= mask
+            else:
+                logger.debug("Greedy roster: hard constraint '%s' of nurse %s cannot be checked day by day", constraint.get('type'), nurse['id'])
+                return None
+    for n, state in schedule_request['previous_states'].items():
+        if SHIFT_AFTERNOON in state['last_day_shifts']:
+            rules['blocked'][n, 0, SHIFT_NIGHT - 1] = True
+    return rules
+
+
+def construct_roster(schedule_request, calendar, rules, rng):
+    # One pass over the days. Each day, nurses who reached the consecutive days-off limit are placed first, then
+    # every shift is filled with the least-loaded nurses that every hard rule still allows. When the demand is more
+    # than everyone can work while keeping targetOffDays, the difference is covered by N+A doubles spread evenly
+    # over the month. Returns the assignments (nurses, days, 3) or None when a day cannot be covered.
+    num_nurses, num_days = len(schedule_request['nurse_ids']), calendar['num_days']
+    required = {s: schedule_request['required_nurses_by_shift'].get(s, 0) for s in SHIFTS}
+    max_consecutive_shifts = schedule_request['max_consecutive_shifts_worked']
+    blocked, avoid, no_double, max_week_nights = rules['blocked'], rules['avoid'], rules['no_double'], rules['max_week_nights']
+    working_day_budget = num_nurses * max(num_days - schedule_request['target_off_days'], 0)
+    planned_doubles = min(max(sum(required.values()) * num_days - working_day_budget, 0), min(required[SHIFT_AFTERNOON], required[SHIFT_NIGHT]) * num_days)
+    doubles_done = 0
+
+    assignments = np.zeros((num_nurses, num_days, len(SHIFTS)), dtype=np.int8)
+    consecutive_shifts = np.zeros(num_nurses, dtype=np.int64)
+    for n, state in schedule_request['previous_states'].items():
+        if not state['was_off_last_day']:
+            consecutive_shifts[n] = state['consecutive_shifts']
+    off_streak = np.zeros(num_nurses, dtype=np.int64)
+    same_shift_streak = np.zeros((num_nurses, len(SHIFTS)), dtype=np.int64)
+    shift_totals = np.zeros((num_nurses, len(SHIFTS)), dtype=np.int64)
+    week_nights = np.zeros(num_nurses, dtype=np.int64)
+    double_counts = np.zeros(num_nurses, dtype=np.int64)
+    tie_breaks = [rng.random() for _ in range(num_nurses)]
+
+    for d in range(num_days):
+        if d > 0 and calendar['week'][d] != calendar['week'][d - 1]:
+            week_nights[:] = 0
+        eligible = ~blocked[:, d]
+        if max_consecutive_shifts > 0:
+            eligible &= (consecutive_shifts < max_consecutive_shifts)[:, None]
+        if MAX_CONSECUTIVE_SAME_SHIFT > 0:
+            eligible &= same_shift_streak < MAX_CONSECUTIVE_SAME_SHIFT
+        if MIN_OFF_DAYS_IN_WINDOW > 0 and d >= WINDOW_SIZE_FOR_MIN_OFF - 1:
+            window_off_days = (assignments[:, d - WINDOW_SIZE_FOR_MIN_OFF + 1:d].sum(axis=2) == 0).sum(axis=1)
+            eligible &= (window_off_days >= MIN_OFF_DAYS_IN_WINDOW)[:, None]
+        eligible[:, SHIFT_NIGHT - 1] &= week_nights < max_week_nights
+        if d > 0:
+            eligible[:, SHIFT_NIGHT - 1] &= assignments[:, d - 1, SHIFT_AFTERNOON - 1] == 0
+
+        day = np.zeros((num_nurses, len(SHIFTS)), dtype=bool)
+        open_shifts = dict(required)
+        load = shift_totals.sum(axis=1)
+
+        def preference(n, s):
+            return (avoid[n, d, s - 1], load[n], shift_totals[n, s - 1], consecutive_shifts[n], tie_breaks[n])
+
+        if MAX_CONSECUTIVE_OFF_DAYS > 0 and num_days > MAX_CONSECUTIVE_OFF_DAYS:
+            must_work = [n for n in range(num_nurses) if off_streak[n] >= MAX_CONSECUTIVE_OFF_DAYS]
+            must_work.sort(key=lambda n: eligible[n].sum())
+            for n in must_work:
+                options = [s for s in GREEDY_FILL_ORDER if eligible[n, s - 1] and open_shifts[s] > 0]
+                if not options:
+                    return None
+                s = min(options, key=lambda s: preference(n, s))
+                day[n, s - 1] = True
+                open_shifts[s] -= 1
+
+        doubles_due = -(-planned_doubles * (d + 1) // num_days) - doubles_done
+        for s in GREEDY_FILL_ORDER:
+            if open_shifts[s] <= 0:
+                continue
+            doubles = []
+            if s in GREEDY_DOUBLE_PARTNER:
+                partner_col = GREEDY_DOUBLE_PARTNER[s] - 1
+                doubles = sorted(
+                    (n for n in range(num_nurses)
+                     if eligible[n, s - 1] and day[n, partner_col] and day[n].sum() == 1 and not no_double[n]
+                     and (max_consecutive_shifts <= 0 or consecutive_shifts[n] + 2 <= max_consecutive_shifts)),
+                    key=lambda n: (rules['avoid_double'][n], double_counts[n]) + preference(n, s))
+            chosen = doubles[:max(min(doubles_due, open_shifts[s]), 0)]
+            singles = sorted((n for n in range(num_nurses) if eligible[n, s - 1] and not day[n].any()), key=lambda n: preference(n, s))
+            chosen += singles[:open_shifts[s] - len(chosen)]
+            # Too few nurses left for single shifts: double up more than planned.
+            chosen += [n for n in doubles if n not in chosen][:open_shifts[s] - len(chosen)]
+            if len(chosen) < open_shifts[s]:
+                return None
+            for n in chosen:
+                day[n, s - 1] = True
+            open_shifts[s] = 0
+
+        day_doubles = day[:, SHIFT_AFTERNOON - 1] & day[:, SHIFT_NIGHT - 1]
+        double_counts += day_doubles
+        doubles_done += int(day_doubles.sum())
+        worked = day.any(axis=1)
+        consecutive_shifts = np.where(worked, consecutive_shifts + day.sum(axis=1), 0)
+        off_streak = np.where(worked, 0, off_streak + 1)
+        same_shift_streak = np.where(day, same_shift_streak + 1, 0)
+        shift_totals += day
+        week_nights += day[:, SHIFT_NIGHT - 1]
+        assignments[:, d] = day
+    return assignments
+
+
+def order_interchangeable_nurses(schedule_request, assignments):
+    # Permutes the rows of interchangeable nurses into the order the symmetry-breaking constraints expect (total
+    # shifts, then the first days' shifts, both descending), so the roster stays a valid hint.
+    prefix_days = min(SYMMETRY_PREFIX_DAYS, assignments.shape[1])
+    for members in get_interchangeable_nurse_classes(schedule_request):
+        ordered = sorted(members, key=lambda n: (int(assignments[n].sum()), assignments[n, :prefix_days].ravel().tolist()), reverse=True)
+        assignments[members] = assignments[ordered]
+    return assignments
+
+
+def build_greedy_roster(schedule_request, attempts=GREEDY_ROSTER_ATTEMPTS):
+    # Returns (assignments (nurses, days, 3) or None, stats). A roster returned satisfies every hard rule of
+    # build_model(); soft targets (off days, fairness) are only approximated by the least-loaded choice.
+    start_time = time.perf_counter()
+    calendar = get_day_calendar(schedule_request['days'])
+    rules = get_greedy_rules(schedule_request, calendar)
+    stats = {'found': False, 'attempts': 0}
+    assignments = None
+    if rules is None:
+        stats['reason'] = 'unsupported_constraints'
+    else:
+        for attempt in range(attempts):
+            stats['attempts'] = attempt + 1
+            assignments = construct_roster(schedule_request, calendar, rules, random.Random(attempt))
+            if assignments is not None:
+                stats['found'] = True
+                if schedule_request['symmetry_breaking']:
+                    order_interchangeable_nurses(schedule_request, assignments)
+                break
+        else:
+            stats['reason'] = 'dead_end'
+    stats['seconds'] = round(time.perf_counter() - start_time, 4)
+    logger.info("Greedy roster %s after %d attempts (%.1f ms)", 'found' if stats['found'] else 'not found', stats['attempts'], stats['seconds'] * 1000)
+    return assignments, stats
+
+
+def build_draft_result(schedule_request, assignments, greedy_stats):
+    draft = build_assignments_result(schedule_request, assignments)
+    draft.update({
+        'solverStatus': 'GREEDY',
+        'draft': True,
+        'solutionIndex': 0,
+        'penaltyValue': None,
+        'bestBound': None,
+        'elapsedSeconds': round(time.time() - schedule_request['received_at'], 3),
+        'greedyWarmStart': greedy_stats,
+    })
+    return draft
+
+
+def run_greedy_draft(schedule_request):
+    # Only the constructive pass, for an instant preview. Returns (result_dict, http_status).
+    assignments, greedy_stats = build_greedy_roster(schedule_request)
+    if assignments is None:
+        return {"error": "ไม่สามารถสร้างตารางเวรฉบับร่างแบบรวดเร็วได้ ลองสร้างตารางเวรด้วยการคำนวณแบบเต็ม",
+                "greedyWarmStart": greedy_stats}, 422
+    return build_draft_result(schedule_request, assignments, greedy_stats), 200
+
+
+def run_greedy_warm_start_solve(schedule_request, on_solution=None):
+    # Same contract as run_schedule_solve(). Unless the request brings its own hint schedule or sets
+    # "greedyWarmStart": false, a greedy roster is built first: it is streamed as a draft (solutionIndex 0) and
+    # becomes the full solution hint, so the solver starts from an incumbent instead of searching for one.
+    if not schedule_request['greedy_warm_start'] or schedule_request['hint_assignments'] or is_solve_cancelled(schedule_request['cancel_slot']):
+        return run_schedule_solve(schedule_request, on_solution=on_solution)
+    with schedule_request['stage_timer'].span('greedy'):
+        assignments, greedy_stats = build_greedy_roster(schedule_request)
+    if assignments is not None and on_solution is not None:
+        on_solution(build_draft_result(schedule_request, assignments, greedy_stats))
+    result, status_code = run_schedule_solve(schedule_request, on_solution=on_solution, warm_start=assignments)
+    result["greedyWarmStart"] = greedy_stats
+    return result, status_code
@@ -0,0 +1,170 @@
+# lns_improve.py
+
+import logging
+import math
+import random
+import time
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+from schedule_model import (
+    SHIFTS, ScheduleInputError, build_model, build_schedule_result, expand_schedule_input, extract_shift_assignments,
+    fix_shift_assignments, get_hint_assignments, get_model_size, parse_schedule_request, set_solution_hint, solve,
+)
+from solve_cancellation import build_cancelled_result, get_cancel_reason, get_stop_check
+
+NEIGHBORHOOD_TYPES = ['nurses', 'days', 'shift']
+LNS_STEP_TIME_LIMIT = 2.0
+LNS_DEFAULT_NURSE_FRACTION = 0.2
+LNS_DEFAULT_DAY_COUNT = 7
+
+logger = logging.getLogger(__name__)
+
+
+def parse_improve_request(data):
+    # An /improve-schedule payload is a /generate-schedule payload plus the roster to improve ("currentSchedule",
+    # shaped like a generate result) and optionally {"neighborhood": "nurses" | "days" | "shift" | "mixed",
+    # "neighborhoodNurses": k, "neighborhoodDays": k, "seed": s}. solverTimeLimit is the improvement budget.
+    schedule_request = parse_schedule_request(data)
+    try:
+        current_schedule = expand_schedule_input(data.get('currentSchedule'))
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ScheduleInputError(f"Invalid compact 'currentSchedule': {e}")
+    if not isinstance(current_schedule, dict) or not isinstance(current_schedule.get('nurseSchedules'), dict):
+        raise ScheduleInputError("Invalid 'currentSchedule' format, expected an object with 'nurseSchedules'")
+
+    nurse_id_to_index = {nurse_id: n for n, nurse_id in enumerate(schedule_request['nurse_ids'])}
+    current_assignments = get_hint_assignments(current_schedule, nurse_id_to_index, schedule_request['days'])
+    expected_assignments = len(schedule_request['nurse_ids']) * len(schedule_request['days']) * len(SHIFTS)
+    if len(current_assignments) != expected_assignments:
+        raise ScheduleInputError(f"'currentSchedule' must cover every nurse and day of the period ({len(current_assignments) // len(SHIFTS)} of {expected_assignments // len(SHIFTS)} nurse-days found)")
+
+    neighborhood = data.get('neighborhood', 'mixed')
+    if neighborhood != 'mixed' and neighborhood not in NEIGHBORHOOD_TYPES:
+        raise ScheduleInputError(f"Invalid 'neighborhood' '{neighborhood}', expected one of: mixed, {', '.join(NEIGHBORHOOD_TYPES)}")
+    try:
+        neighborhood_nurses = int(data.get('neighborhoodNurses') or max(2, math.ceil(len(schedule_request['nurse_ids']) * LNS_DEFAULT_NURSE_FRACTION)))
+        neighborhood_days = int(data.get('neighborhoodDays') or LNS_DEFAULT_DAY_COUNT)
+        seed = int(data.get('seed', 0))
+    except (TypeError, ValueError) as e:
+        raise ScheduleInputError(f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}")
+    if neighborhood_nurses < 1 or neighborhood_days < 1:
+        raise ScheduleInputError("neighborhoodNurses and neighborhoodDays must be >= 1")
+
+    current = np.zeros((len(schedule_request['nurse_ids']), len(schedule_request['days']), len(SHIFTS)), dtype=np.int8)
+    for (n, d, s), value in current_assignments.items():
+        current[n, d, s - 1] = value
+    # Every step pins most of the current roster, which need not follow the symmetry-breaking order.
+    schedule_request['symmetry_breaking'] = False
+    schedule_request['improve'] = {
+        'current_assignments': current,
+        'neighborhood': neighborhood,
+        'neighborhood_nurses': neighborhood_nurses,
+        'neighborhood_days': neighborhood_days,
+        'seed': seed,
+    }
+    return schedule_request
+
+
+def choose_neighborhood(rng, neighborhood, shape, num_nurses_free, num_days_free):
+    # Boolean mask (nurses, days, 3) of the shift literals that are freed for one step.
+    num_nurses, num_days, num_shifts = shape
+    neighborhood_type = rng.choice(NEIGHBORHOOD_TYPES) if neighborhood == 'mixed' else neighborhood
+    free_mask = np.zeros(shape, dtype=bool)
+    if neighborhood_type == 'nurses':
+        free_mask[rng.sample(range(num_nurses), min(num_nurses_free, num_nurses))] = True
+    elif neighborhood_type == 'days':
+        block = min(num_days_free, num_days)
+        first_day = rng.randrange(num_days - block + 1)
+        free_mask[:, first_day:first_day + block] = True
+    else:
+        free_mask[:, :, rng.randrange(num_shifts)] = True
+    return neighborhood_type, free_mask
+
+
+def run_improve_solve(schedule_request, on_solution=None):
+    # Large-neighbourhood search: the full model is built once, then each step pins every shift literal outside a
+    # small neighbourhood to the current roster, re-solves briefly and keeps the result if the penalty went down.
+    # Returns (result_dict, http_status) like run_schedule_solve(); on_solution(result) is called per improvement.
+    try:
+        start_time = time.time()
+        improve = schedule_request['improve']
+        current = improve['current_assignments'].copy()
+        rng = random.Random(improve['seed'])
+        num_workers = schedule_request['num_workers']
+        deadline = start_time + schedule_request['solver_time_limit']
+        cancel_slot = schedule_request['cancel_slot']
+        should_stop = get_stop_check(cancel_slot)
+
+        model, var_index = build_model(schedule_request)
+        model_stats = get_model_size(model)
+        model_build_seconds = time.time() - start_time
+
+        fix_shift_assignments(model, var_index, current, np.ones(current.shape, dtype=bool))
+        outcome = solve(model, var_index, max(deadline - time.time(), 1.0), num_workers=num_workers, log_search_progress=False,
+                        should_stop=should_stop)
+        if get_cancel_reason(cancel_slot):
+            return build_cancelled_result(get_cancel_reason(cancel_slot))
+        if outcome['status'] not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return {"error": f"ตารางเวรที่ส่งมาไม่ผ่านข้อจำกัดแบบ Hard (Solver Status: {outcome['status_name']}) จึงไม่สามารถปรับปรุงต่อได้",
+                    "solverStatus": outcome['status_name'], "modelStats": model_stats}, 400
+        initial_penalty = current_penalty = outcome['objective_value']
+        best_solution = outcome['solution']
+        logger.info("LNS improve: starting penalty %s", initial_penalty)
+
+        neighborhood_nurses = improve['neighborhood_nurses']
+        neighborhood_days = improve['neighborhood_days']
+        steps = []
+        while time.time() < deadline - 0.05 and not get_cancel_reason(cancel_slot):
+            neighborhood_type, free_mask = choose_neighborhood(rng, improve['neighborhood'], current.shape, neighborhood_nurses, neighborhood_days)
+            fix_shift_assignments(model, var_index, current, ~free_mask)
+            set_solution_hint(model, var_index, current)
+            outcome = solve(model, var_index, min(LNS_STEP_TIME_LIMIT, deadline - time.time()), num_workers=num_workers, log_search_progress=False,
+                            should_stop=should_stop)
+            improved = outcome['status'] in (cp_model.OPTIMAL, cp_model.FEASIBLE) and outcome['objective_value'] < current_penalty - 0.5
+            steps.append({'neighborhood': neighborhood_type, 'solverStatus': outcome['status_name'], 'improved': improved})
+            if improved:
+                current_penalty = outcome['objective_value']
+                best_solution = outcome['solution']
+                current = extract_shift_assignments(var_index, best_solution)
+                logger.debug("LNS improve: step %d (%s) lowered the penalty to %s", len(steps), neighborhood_type, current_penalty)
+                if on_solution is not None:
+                    step_result = build_schedule_result(schedule_request, var_index, best_solution)
+                    step_result.update({'solutionIndex': len(steps), 'penaltyValue': current_penalty, 'elapsedSeconds': round(time.time() - start_time, 3)})
+                    on_solution(step_result)
+            elif outcome['status'] == cp_model.OPTIMAL:
+                # The neighbourhood is already locally optimal, so look at a larger one next time.
+                neighborhood_nurses = min(neighborhood_nurses + 1, current.shape[0])
+                neighborhood_days = min(neighborhood_days + 1, current.shape[1])
+
+        stage_timer = schedule_request['stage_timer']
+        stage_timer.add('improve_search', time.time() - start_time - model_build_seconds)
+        with stage_timer.span('extract'):
+            schedule_result = build_schedule_result(schedule_request, var_index, best_solution)
+        schedule_result["solverStatus"] = 'FEASIBLE'
+        schedule_result["penaltyValue"] = current_penalty
+        schedule_result["modelStats"] = model_stats
+        schedule_result["timings"] = {
+            "modelBuildSeconds": round(model_build_seconds, 3),
+            "totalSeconds": round(time.time() - start_time, 3),
+            "stages": stage_timer.as_dict(),
+        }
+        if get_cancel_reason(cancel_slot):
+            schedule_result["cancelReason"] = get_cancel_reason(cancel_slot)
+        schedule_result["improve"] = {
+            "initialPenalty": initial_penalty,
+            "finalPenalty": current_penalty,
+            "steps": len(steps),
+            "improvements": sum(1 for step in steps if step['improved']),
+            "stepsByNeighborhood": {
+                neighborhood_type: sum(1 for step in steps if step['neighborhood'] == neighborhood_type)
+                for neighborhood_type in NEIGHBORHOOD_TYPES
+            },
+        }
+        logger.info("LNS improve: penalty %s -> %s in %d steps", initial_penalty, current_penalty, len(steps))
+        return schedule_result, 200
+
+    except Exception as e:
+        logger.exception("Unexpected error in run_improve_solve")
+        return {"error": f"เกิดข้อผิดพลาดที่ไม่คาดคิดใน Server: {e}"}, 500
@@ -0,0 +1,457 @@
+# load_test.py
+#
+# End-to-end load test of the /generate-schedule service. Clients post payloads shaped like the ones App.js
+# sends (with the whole previous month's roster as previousMonthSchedule) at a fixed concurrency, and the run
+# reports latency percentiles, throughput, error and timeout rates, the server's CPU use and the solver
+# statuses. With --start-server the server is started locally with the given environment and stopped afterwards,
+# so server configurations can be compared on the same load.
+#
+#   python load_test.py --start-server --concurrency 8 --requests 40 --nurses 20,30 --time-limit 20
+#   python load_test.py --start-server --server-env SOLVE_PROCESS_POOL_WORKERS=4 --server-env CPU_BUDGET_TOTAL_WORKERS=8 --output run.json
+#   python load_test.py --url http://localhost:5000 --server-pid 1234 --payloads captured/*.json --csv requests.csv
+
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import datetime
+import gzip
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# App.js waits solverTimeLimit + 30 seconds before it gives up on a request.
+CLIENT_TIMEOUT_MARGIN_SECONDS = 30
+SERVER_START_TIMEOUT_SECONDS = 60
+STATUS_CONNECTION_ERROR = 'CONNECTION_ERROR'
+STATUS_CLIENT_TIMEOUT = 'CLIENT_TIMEOUT'
+# The nurse fields App.js sends; the rest of the nurse document stays in the browser.
+APP_NURSE_FIELDS = ['id', 'prefix', 'firstName', 'lastName', 'constraints']
+CSV_FIELDS = [
+    'requestIndex', 'payloadId', 'startedAt', 'latencySeconds', 'httpStatus', 'solverStatus', 'timedOut',
+    'cacheHit', 'penaltyValue', 'serverTotalSeconds', 'numWorkers', 'responseBytes', 'error',
+]
+
+
+def previous_month_roster(payload, year, month):
+    # The previous month as App.js finds it in history: a whole generate result, here built by the greedy
+    # roster for the same nurses and staffing. None if the greedy roster finds no schedule.
+    from schedule_model import ScheduleInputError, build_assignments_result, parse_schedule_request
+    from greedy_roster import build_greedy_roster
+    from synthetic_wards import month_period
+
+    start_date, end_date = month_period(year, month)
+    previous_payload = dict(payload, previousMonthSchedule=None)
+    previous_payload['schedule'] = dict(payload['schedule'], startDate=start_date.isoformat(), endDate=end_date.isoformat())
+    try:
+        schedule_request = parse_schedule_request(previous_payload)
+    except ScheduleInputError:
+        return None
+    assignments, _ = build_greedy_roster(schedule_request)
+    if assignments is None:
+        return None
+    return build_assignments_result(schedule_request, assignments)
+
+
+def build_synthetic_payloads(num_wards, nurse_counts, time_limit, year, month, seed):
+    from synthetic_wards import generate_ward_payload, previous_month_schedule
+
+    previous_year, previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    payloads = []
+    for ward_index in range(num_wards):
+        num_nurses = nurse_counts[ward_index % len(nurse_counts)]
+        payload = generate_ward_payload(num_nurses, year=year, month=month, seed=seed + ward_index,
+                                        solver_time_limit=time_limit, with_previous_month=False)
+        payload['nurses'] = [{field: nurse[field] for field in APP_NURSE_FIELDS if field in nurse} for nurse in payload['nurses']]
+        previous_schedule = previous_month_roster(payload, previous_year, previous_month)
+        if previous_schedule is None:
+            # Falls back to the short synthetic history, which always continues feasibly.
+            start_date = datetime.date.fromisoformat(payload['schedule']['startDate'])
+            previous_schedule = previous_month_schedule(payload['nurses'], start_date)
+        payload['previousMonthSchedule'] = previous_schedule
+        payloads.append({'payloadId': f'ward{ward_index}-n{num_nurses}', 'payload': payload})
+    return payloads
+
+
+def load_payload_files(paths, time_limit):
+    payloads = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            payload = json.load(f)
+        if time_limit is not None:
+            payload['solverTimeLimit'] = time_limit
+        payloads.append({'payloadId': os.path.basename(path), 'payload': payload})
+    return payloads
+
+
+def post_schedule_request(url, body, timeout):
+    # Returns (http_status, response_json or None, response_bytes); raises socket.timeout / URLError.
+    http_request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json', 'Accept-Encoding': 'gzip',
+    })
+    try:
+        response = urllib.request.urlopen(http_request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        response = e
+    with response:
+        raw_body = response.read()
+        status = response.status if hasattr(response, 'status') else response.code
+        content_encoding = response.headers.get('Content-Encoding')
+    data = gzip.decompress(raw_body) if content_encoding == 'gzip' else raw_body
+    try:
+        return status, json.loads(data), len(raw_body)
+    except ValueError:
+        return status, None, len(raw_body)
+
+
+def run_request(url, request_index, payload_entry, body, timeout, started_at):
+    row = {
+        'requestIndex': request_index, 'payloadId': payload_entry['payloadId'], 'timedOut': False,
+        'httpStatus': None, 'solverStatus': None, 'cacheHit': None, 'penaltyValue': None,
+        'serverTotalSeconds': None, 'numWorkers': None, 'responseBytes': None, 'error': None,
+    }
+    request_start = time.perf_counter()
+    row['startedAt'] = round(time.time() - started_at, 3)
+    try:
+        status, result, response_bytes = post_schedule_request(url, body, timeout)
+        row['httpStatus'] = status
+        row['responseBytes'] = response_bytes
+        result = result or {}
+        row['solverStatus'] = result.get('solverStatus') or f"HTTP {status}"
+        row['cacheHit'] = result.get('cache', {}).get('hit')
+        row['penaltyValue'] = result.get('penaltyValue')
+        row['serverTotalSeconds'] = result.get('timings', {}).get('totalSeconds')
+        row['numWorkers'] = result.get('cpuBudget', {}).get('numWorkers')
+        if status >= 400:
+            row['error'] = result.get('error')
+    except (socket.timeout, TimeoutError):
+        row['timedOut'] = True
+        row['solverStatus'] = STATUS_CLIENT_TIMEOUT
+    except (urllib.error.URLError, ConnectionError) as e:
+        if isinstance(getattr(e, 'reason', None), (socket.timeout, TimeoutError)):
+            row['timedOut'] = True
+            row['solverStatus'] = STATUS_CLIENT_TIMEOUT
+        else:
+            row['solverStatus'] = STATUS_CONNECTION_ERROR
+            row['error'] = str(e)
+    row['latencySeconds'] = round(time.perf_counter() - request_start, 3)
+    return row
+
+
+def run_load(url, payloads, num_requests, concurrency, timeout=None, first_index=0):
+    # Closed loop: each of the concurrency clients sends its next request as soon as the previous one returns.
+    # Request i sends payload i round robin, so a measured run can continue where the warm-up stopped.
+    bodies = [json.dumps(entry['payload'], ensure_ascii=False).encode('utf-8') for entry in payloads]
+    started_at = time.time()
+    next_index = iter(range(first_index, first_index + num_requests))
+    index_lock = threading.Lock()
+    rows = []
+
+    def run_client():
+        while True:
+            with index_lock:
+                request_index = next(next_index, None)
+            if request_index is None:
+                return
+            payload_entry = payloads[request_index % len(payloads)]
+            client_timeout = timeout or payload_entry['payload'].get('solverTimeLimit', 60) + CLIENT_TIMEOUT_MARGIN_SECONDS
+            row = run_request(url, request_index, payload_entry, bodies[request_index % len(payloads)], client_timeout, started_at)
+            rows.append(row)
+            print(f"  #{request_index} {row['payloadId']}: {row['solverStatus']} HTTP {row['httpStatus']} in {row['latencySeconds']}s", flush=True)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load-client') as executor:
+        for _ in range(concurrency):
+            executor.submit(run_client)
+    rows.sort(key=lambda row: row['requestIndex'])
+    return rows
+
+
+def get_process_tree(root_pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    tree, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+def read_process_usage(pid):
+    # (CPU seconds, resident MB) of one process from /proc, or None if it has exited.
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu_seconds, resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class ServerCpuSampler:
+    # Samples CPU time and memory of the server process and its solver processes (Linux /proc) on a thread.
+    def __init__(self, server_pid, interval_seconds=1.0):
+        self.server_pid = server_pid
+        self.interval_seconds = interval_seconds
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cpu-sampler', daemon=True)
+
+    def start(self):
+        self._sample()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self._sample()
+
+    def _sample(self):
+        cpu_by_pid, rss_mb = {}, 0.0
+        for pid in get_process_tree(self.server_pid):
+            usage = read_process_usage(pid)
+            if usage is not None:
+                cpu_by_pid[pid] = usage[0]
+                rss_mb += usage[1]
+        self.samples.append((time.time(), cpu_by_pid, rss_mb, len(cpu_by_pid)))
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return None
+        cores = []
+        for (previous_time, previous_cpu, _, _), (sample_time, cpu_by_pid, _, _) in zip(self.samples, self.samples[1:]):
+            # Only processes seen in both samples; a solver process started in between counts from its next sample.
+            cpu_seconds = sum(seconds - previous_cpu[pid] for pid, seconds in cpu_by_pid.items() if pid in previous_cpu)
+            cores.append(cpu_seconds / max(sample_time - previous_time, 1e-6))
+        elapsed = self.samples[-1][0] - self.samples[0][0]
+        first_cpu, last_cpu = self.samples[0][1], self.samples[-1][1]
+        total_cpu_seconds = sum(seconds - first_cpu.get(pid, 0.0) for pid, seconds in last_cpu.items())
+        cpu_count = os.cpu_count() or 1
+        return {
+            'cpuCount': cpu_count,
+            'cpuSeconds': round(total_cpu_seconds, 2),
+            'averageCores': round(total_cpu_seconds / max(elapsed, 1e-6), 2),
+            'peakCores': round(max(cores), 2),
+            'averagePercent': round(100 * total_cpu_seconds / max(elapsed, 1e-6) / cpu_count, 1),
+            'peakRssMb': round(max(sample[2] for sample in self.samples), 1),
+            'maxProcesses': max(sample[3] for sample in self.samples),
+        }
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(rows, duration_seconds, cpu):
+    completed = [row for row in rows if not row['timedOut'] and row['solverStatus'] != STATUS_CONNECTION_ERROR]
+    latencies = sorted(row['latencySeconds'] for row in completed)
+    errors = [row for row in rows if row['solverStatus'] == STATUS_CONNECTION_ERROR or (row['httpStatus'] or 0) >= 400]
+    succeeded = sum(1 for row in rows if row['httpStatus'] == 200)
+    return {
+        'requests': len(rows),
+        'succeeded': succeeded,
+        'durationSeconds': round(duration_seconds, 3),
+        'throughputPerMinute': round(len(completed) * 60 / max(duration_seconds, 1e-6), 2),
+        'successfulPerMinute': round(succeeded * 60 / max(duration_seconds, 1e-6), 2),
+        'latencySeconds': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        },
+        'errorRate': round(len(errors) / max(len(rows), 1), 4),
+        'timeoutRate': round(sum(1 for row in rows if row['timedOut']) / max(len(rows), 1), 4),
+        'cacheHits': sum(1 for row in rows if row['cacheHit']),
+        'httpStatuses': dict(Counter(str(row['httpStatus']) for row in rows if row['httpStatus'] is not None)),
+        'solverStatuses': dict(Counter(row['solverStatus'] for row in rows)),
+        'cpu': cpu,
+    }
+
+
+def start_server(host, port, server_env, log_path):
+    # Runs the Flask app threaded and without the debug reloader, in its own process group so the solver
+    # processes it spawns are stopped with it.
+    env = dict(os.environ)
+    env.update(server_env)
+    log_file = open(log_path, 'w') if log_path else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, '-c', f"from server import app; app.run(host={host!r}, port={port}, threaded=True)"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=log_file, stderr=subprocess.STDOUT,
+        start_new_session=True,
+    )
+    deadline = time.time() + SERVER_START_TIMEOUT_SECONDS
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during start-up (exit code {process.returncode})" + (f", see {log_path}" if log_path else ""))
+        try:
+            urllib.request.urlopen(f'http://{host}:{port}/metrics', timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"Server did not answer on port {port} within {SERVER_START_TIMEOUT_SECONDS}s")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def parse_server_env(items):
+    server_env = {}
+    for item in items:
+        name, separator, value = item.partition('=')
+        if not separator or not name:
+            raise argparse.ArgumentTypeError(f"--server-env expects NAME=VALUE, got {item!r}")
+        server_env[name] = value
+    return server_env
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def format_seconds(value):
+    return 'n/a' if value is None else f'{value}s'
+
+
+def print_summary(summary):
+    latency = summary['latencySeconds']
+    print(f"\n{summary['requests']} requests in {summary['durationSeconds']}s: "
+          f"{summary['throughputPerMinute']} completed/min, {summary['successfulPerMinute']} successful/min")
+    print("latency " + " ".join(f"{name}={format_seconds(latency[name])}" for name in ('p50', 'p95', 'p99', 'max')))
+    print(f"error rate {summary['errorRate']:.1%}, timeout rate {summary['timeoutRate']:.1%}, cache hits {summary['cacheHits']}")
+    print(f"HTTP statuses: {summary['httpStatuses']}")
+    print(f"solver statuses: {summary['solverStatuses']}")
+    cpu = summary['cpu']
+    if cpu:
+        print(f"server CPU: {cpu['averageCores']} cores on average ({cpu['averagePercent']}% of {cpu['cpuCount']}), "
+              f"peak {cpu['peakCores']} cores, peak RSS {cpu['peakRssMb']}MB over {cpu['maxProcesses']} processes")
+    else:
+        print("server CPU: not measured (use --start-server or --server-pid on Linux)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the schedule service with App.js-shaped /generate-schedule requests.")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="Base URL of a running server (ignored with --start-server)")
+    parser.add_argument('--start-server', action='store_true', help="Start server.py locally for the run and stop it afterwards")
+    parser.add_argument('--port', type=int, default=5055, help="Port for --start-server")
+    parser.add_argument('--server-env', action='append', default=[], metavar='NAME=VALUE',
+                        help="Environment variable for the started server, e.g. SOLVE_PROCESS_POOL_WORKERS=4 (repeatable)")
+    parser.add_argument('--server-log', help="Write the started server's log to this path")
+    parser.add_argument('--server-pid', type=int, help="PID of an already running server, to measure its CPU use")
+    parser.add_argument('--concurrency', type=int, default=4, help="Clients sending requests at the same time")
+    parser.add_argument('--requests', type=int, default=20, help="Requests to measure")
+    parser.add_argument('--warmup', type=int, default=0, help="Requests sent first and left out of the results")
+    parser.add_argument('--payloads', nargs='+', help="Payload JSON files (e.g. captured from App.js) to replay instead of synthetic wards")
+    parser.add_argument('--wards', type=int, help="Distinct synthetic wards (default: one per request, so nothing is served from the result cache)")
+    parser.add_argument('--nurses', default='20,30', help="Comma separated nurse counts of the synthetic wards (default: 20,30)")
+    parser.add_argument('--time-limit', type=float, help="solverTimeLimit of every request (default: 60 for synthetic wards, as App.js)")
+    parser.add_argument('--timeout', type=float, help=f"Client timeout in seconds (default: solverTimeLimit + {CLIENT_TIMEOUT_MARGIN_SECONDS}, as App.js)")
+    parser.add_argument('--bypass-cache', action='store_true', help="Send bypassCache so repeated payloads are solved again")
+    parser.add_argument('--year', type=int, default=2026)
+    parser.add_argument('--month', type=int, default=2, help="Month to schedule; the previous month is the synthetic history")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cpu-interval', type=float, default=1.0, help="Seconds between server CPU samples")
+    parser.add_argument('--label', default='', help="Free-form label stored with the results, e.g. the server configuration")
+    parser.add_argument('--output', help="Write the summary and per-request rows as JSON to this path")
+    parser.add_argument('--csv', help="Write per-request rows as CSV to this path")
+    args = parser.parse_args()
+    if args.concurrency < 1 or args.requests < 1 or args.warmup < 0:
+        parser.error("--concurrency and --requests must be >= 1 and --warmup >= 0")
+    try:
+        server_env = parse_server_env(args.server_env)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    if args.payloads:
+        payloads = load_payload_files(args.payloads, args.time_limit)
+    else:
+        print("Building synthetic ward payloads ...", flush=True)
+        payloads = build_synthetic_payloads(args.wards or args.warmup + args.requests, parse_int_list(args.nurses),
+                                            args.time_limit or 60.0, args.year, args.month, args.seed)
+    if args.bypass_cache:
+        for entry in payloads:
+            entry['payload']['bypassCache'] = True
+
+    server_process = None
+    base_url = args.url.rstrip('/')
+    server_pid = args.server_pid
+    if args.start_server:
+        print(f"Starting server on port {args.port} with {server_env or 'default settings'} ...", flush=True)
+        server_process = start_server('127.0.0.1', args.port, server_env, args.server_log)
+        base_url = f'http://127.0.0.1:{args.port}'
+        server_pid = server_process.pid
+
+    cpu_sampler = ServerCpuSampler(server_pid, args.cpu_interval) if server_pid and os.path.isdir('/proc') else None
+    try:
+        print(f"Sending {args.warmup + args.requests} requests from {args.concurrency} clients to {base_url}/generate-schedule", flush=True)
+        if args.warmup:
+            print("Warm-up:", flush=True)
+            run_load(f'{base_url}/generate-schedule', payloads, args.warmup, args.concurrency, args.timeout)
+        if cpu_sampler:
+            cpu_sampler.start()
+        started_at = time.perf_counter()
+        rows = run_load(f'{base_url}/generate-schedule', payloads, args.requests, args.concurrency, args.timeout, first_index=args.warmup)
+        duration_seconds = time.perf_counter() - started_at
+        if cpu_sampler:
+            cpu_sampler.stop()
+    finally:
+        if server_process is not None:
+            stop_server(server_process)
+
+    summary = summarize(rows, duration_seconds, cpu_sampler.summary() if cpu_sampler else None)
+    print_summary(summary)
+
+    if args.output:
+        config = {
+            'concurrency': args.concurrency, 'requests': args.requests, 'warmup': args.warmup,
+            'payloads': [entry['payloadId'] for entry in payloads], 'serverEnv': server_env if args.start_server else None,
+            'bypassCache': args.bypass_cache, 'timeout': args.timeout,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'label': args.label, 'createdAt': time.time(), 'config': config, 'summary': summary, 'requests': rows},
+                      f, indent=2, ensure_ascii=False)
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# result_cache.py
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def request_cache_key(normalized_request):
+    canonical = json.dumps(normalized_request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class MemoryResultCache:
+    def __init__(self, max_entries=128, ttl_seconds=86400):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return created_at, value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteResultCache:
+    def __init__(self, path, max_entries=128, ttl_seconds=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS schedule_result_cache ("
+                " cache_key TEXT PRIMARY KEY,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " value TEXT NOT NULL)"
+            )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT created_at, value FROM schedule_result_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            created_at, value = row
+            if self.ttl_seconds > 0 and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM schedule_result_cache WHERE cache_key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE schedule_result_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+            return created_at, json.loads(value)
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO schedule_result_cache (cache_key, created_at, last_access, value) VALUES (?, ?, ?, ?)",
+                (key, now, now, json.dumps(value, ensure_ascii=False)),
+            )
+            if self.ttl_seconds > 0:
+                self._conn.execute("DELETE FROM schedule_result_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM schedule_result_cache WHERE cache_key NOT IN ("
+                " SELECT cache_key FROM schedule_result_cache ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+
+def create_result_cache(max_entries=128, ttl_seconds=86400, sqlite_path=None):
+    if sqlite_path:
+        logger.info("Using SQLite schedule result cache at %s", sqlite_path)
+        return SqliteResultCache(sqlite_path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+    return MemoryResultCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
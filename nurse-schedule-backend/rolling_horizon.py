@@ -0,0 +1,182 @@
+# rolling_horizon.py
+
+import logging
+import time
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+from schedule_model import (
+    MAX_CONSECUTIVE_SAME_SHIFT, MAX_CONSECUTIVE_OFF_DAYS, MIN_OFF_DAYS_IN_WINDOW, OBJECTIVE_MODE_WEIGHTED, WINDOW_SIZE_FOR_MIN_OFF, SHIFTS,
+    build_model, extract_shift_assignments, fix_shift_assignments, get_previous_states, precheck_schedule_request,
+    run_schedule_solve, solve,
+)
+from greedy_roster import run_greedy_warm_start_solve
+from solve_cancellation import get_stop_check, is_solve_cancelled
+
+logger = logging.getLogger(__name__)
+
+# Share of the solver time limit kept for the full-month polishing solve.
+ROLLING_HORIZON_POLISH_FRACTION = 0.4
+MIN_WINDOW_TIME_LIMIT = 1.0
+# Time a window needs per nurse-day to reliably find a first schedule (30 nurses x 12 days: about 4s on one core).
+MIN_WINDOW_SECONDS_PER_NURSE_DAY = 0.01
+
+
+def get_schedule_days_data(schedule_request, assignments, day_indices):
+    # The committed part of the schedule in the shape get_previous_month_state_shifts() reads.
+    days_iso = [schedule_request['days'][d].isoformat() for d in day_indices]
+    nurse_schedules = {}
+    for n, nurse_id in enumerate(schedule_request['nurse_ids']):
+        nurse_schedules[nurse_id] = {
+            'shifts': {day_iso: [SHIFTS[s] for s in np.nonzero(assignments[n, d])[0]] for day_iso, d in zip(days_iso, day_indices)}
+        }
+    return {'nurseSchedules': nurse_schedules, 'days': days_iso}
+
+
+def get_window_previous_states(schedule_request, assignments, first_day):
+    # Boundary state on the day before first_day, carried the same way as between months.
+    if first_day == 0:
+        return schedule_request['previous_states']
+    previous_states = get_previous_states(
+        schedule_request['nurse_ids'], get_schedule_days_data(schedule_request, assignments, range(first_day)),
+        schedule_request['max_consecutive_shifts_worked'])
+    for n, state in previous_states.items():
+        # A nurse who worked every day so far continues the run from the previous month.
+        month_state = schedule_request['previous_states'].get(n)
+        if month_state and not month_state['was_off_last_day'] and assignments[n, :first_day].any(axis=1).all():
+            state['consecutive_shifts'] += month_state['consecutive_shifts']
+    return previous_states
+
+
+def build_window_request(schedule_request, assignments, first_day, end_day):
+    days = schedule_request['days']
+    window_request = dict(schedule_request)
+    window_request['days'] = days[first_day:end_day]
+    window_request['previous_states'] = get_window_previous_states(schedule_request, assignments, first_day)
+    window_request['target_off_days'] = round(schedule_request['target_off_days'] * (end_day - first_day) / len(days))
+    window_request['hint_assignments'] = {
+        (n, d - first_day, s): value for (n, d, s), value in schedule_request['hint_assignments'].items() if first_day <= d < end_day
+    }
+    window_request['hint_objective'] = None
+    # Windows only seed the full-month polish, which runs the requested objective mode.
+    window_request['objective_mode'] = OBJECTIVE_MODE_WEIGHTED
+    # Days pinned from earlier windows may not follow the symmetry-breaking order.
+    window_request['symmetry_breaking'] = False
+    return window_request
+
+
+def get_rolling_windows(schedule_request):
+    # (first_day, commit_start, commit_end, end_day) of each window. Committed days are pinned into the next window
+    # as far back as sliding-window rules look, and to the Monday of the calendar week the window commits into,
+    # so per-week limits (max_nights_per_week) count the nights already committed that week.
+    days = schedule_request['days']
+    window_days = schedule_request['rolling_horizon']['window_days']
+    overlap_days = schedule_request['rolling_horizon']['overlap_days']
+    num_days = len(days)
+    look_back_days = max(MAX_CONSECUTIVE_SAME_SHIFT, MAX_CONSECUTIVE_OFF_DAYS, WINDOW_SIZE_FOR_MIN_OFF - 1 if MIN_OFF_DAYS_IN_WINDOW > 0 else 0)
+    window_starts = list(range(0, num_days, window_days))
+    windows = []
+    for window_number, commit_start in enumerate(window_starts):
+        first_day = max(min(commit_start - look_back_days, commit_start - days[commit_start].weekday()), 0)
+        commit_end = min(commit_start + window_days, num_days)
+        end_day = num_days if window_number == len(window_starts) - 1 else min(commit_end + overlap_days, num_days)
+        windows.append((first_day, commit_start, commit_end, end_day))
+    return windows
+
+
+def get_window_time_floor(schedule_request, first_day, end_day):
+    return max(MIN_WINDOW_SECONDS_PER_NURSE_DAY * len(schedule_request['nurse_ids']) * (end_day - first_day), MIN_WINDOW_TIME_LIMIT)
+
+
+def solve_rolling_windows(schedule_request, time_limit):
+    # Solves the windows of get_rolling_windows() in sequence and commits the days from commit_start to commit_end
+    # of each. The other hard rules hold per day, and the pinned look-back covers the sliding-window rules and
+    # calendar-week limits, so the stitched month is a feasible hint for the full model; month-wide terms (off-day
+    # targets, fairness) are soft and left to the polish. A hard personal constraint type spanning more than a
+    # calendar week would need its own look-back in get_rolling_windows(). Returns (assignments, stats);
+    # assignments is None if a window could not be solved.
+    num_days = len(schedule_request['days'])
+    windows = get_rolling_windows(schedule_request)
+    assignments = np.zeros((len(schedule_request['nurse_ids']), num_days, len(SHIFTS)), dtype=np.int8)
+    window_stats = []
+
+    rolling_start_time = time.time()
+    for window_number, (first_day, commit_start, commit_end, end_day) in enumerate(windows):
+        remaining_windows = len(windows) - window_number
+        window_time_limit = max((time_limit - (time.time() - rolling_start_time)) / remaining_windows,
+                                get_window_time_floor(schedule_request, first_day, end_day))
+
+        window_request = build_window_request(schedule_request, assignments, first_day, end_day)
+        model, var_index = build_model(window_request)
+        pinned_days = np.zeros(var_index['shifts'].shape, dtype=bool)
+        pinned_days[:, :commit_start - first_day] = True
+        fix_shift_assignments(model, var_index, assignments[:, first_day:end_day], pinned_days)
+        outcome = solve(model, var_index, window_time_limit, num_workers=schedule_request['num_workers'],
+                        should_stop=get_stop_check(schedule_request['cancel_slot']))
+        window_stats.append({
+            'firstDay': first_day, 'commitStart': commit_start, 'commitEnd': commit_end, 'endDay': end_day,
+            'solverStatus': outcome['status_name'],
+            'solveSeconds': round(outcome['solve_end_time'] - outcome['solve_start_time'], 3),
+        })
+        if is_solve_cancelled(schedule_request['cancel_slot']):
+            logger.info("Rolling horizon cancelled in window %d/%d", window_number + 1, len(windows))
+            return None, window_stats
+        if outcome['status'] not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            logger.info("Rolling horizon window %d/%d failed (%s)", window_number + 1, len(windows), outcome['status_name'])
+            return None, window_stats
+        window_assignments = extract_shift_assignments(var_index, outcome['solution'])
+        assignments[:, commit_start:commit_end] = window_assignments[:, commit_start - first_day:commit_end - first_day]
+        logger.info("Rolling horizon window %d/%d solved (%s, days %d-%d)", window_number + 1, len(windows), outcome['status_name'], commit_start + 1, commit_end)
+    return assignments, window_stats
+
+
+def run_rolling_horizon_solve(schedule_request, on_solution=None):
+    # Same contract as run_schedule_solve(). The windowed schedule becomes the hint of a full-month solve that
+    # polishes fairness and off days across the whole month with the rest of the time limit. Requests too short
+    # for windows, rejected by the pre-check or whose time limit cannot give every window its floor, and polishes
+    # without a window schedule, start from a greedy roster.
+    rolling_horizon = schedule_request['rolling_horizon']
+    num_days = len(schedule_request['days'])
+    if not rolling_horizon or num_days <= rolling_horizon['window_days'] + rolling_horizon['overlap_days']:
+        return run_greedy_warm_start_solve(schedule_request, on_solution=on_solution)
+    conflicts, _ = precheck_schedule_request(schedule_request)
+    if conflicts:
+        return run_greedy_warm_start_solve(schedule_request, on_solution=on_solution)
+
+    total_time_limit = schedule_request['solver_time_limit']
+    windows_time_limit = total_time_limit * (1 - ROLLING_HORIZON_POLISH_FRACTION)
+    windows_time_floor = sum(get_window_time_floor(schedule_request, first_day, end_day)
+                             for first_day, _, _, end_day in get_rolling_windows(schedule_request))
+    if windows_time_limit < windows_time_floor:
+        # Starved windows come back UNKNOWN and the month falls back anyway, after spending the time limit on them.
+        logger.info("Rolling horizon needs %.1fs for its windows, only %.1fs of the time limit is theirs; solving the full month",
+                    windows_time_floor, windows_time_limit)
+        return run_greedy_warm_start_solve(schedule_request, on_solution=on_solution)
+
+    rolling_start_time = time.time()
+    try:
+        assignments, window_stats = solve_rolling_windows(schedule_request, windows_time_limit)
+    except Exception:
+        logger.exception("Error in rolling horizon windows, falling back to a full solve")
+        assignments, window_stats = None, []
+    windows_seconds = time.time() - rolling_start_time
+    schedule_request['stage_timer'].add('rolling_windows', windows_seconds)
+
+    polish_request = dict(schedule_request)
+    polish_request['solver_time_limit'] = max(total_time_limit - windows_seconds, MIN_WINDOW_TIME_LIMIT)
+    if assignments is not None:
+        # The stitched window schedule is the hint; an ordering it does not follow would make it unusable.
+        polish_request['symmetry_breaking'] = False
+        result, status_code = run_schedule_solve(polish_request, on_solution=on_solution, warm_start=assignments)
+    else:
+        result, status_code = run_greedy_warm_start_solve(polish_request, on_solution=on_solution)
+    result["rollingHorizon"] = {
+        "windowDays": rolling_horizon['window_days'],
+        "overlapDays": rolling_horizon['overlap_days'],
+        "windows": window_stats,
+        "windowsSeconds": round(windows_seconds, 3),
+        "polishTimeLimit": round(polish_request['solver_time_limit'], 3),
+        "usedWindowSchedule": assignments is not None,
+    }
+    return result, status_code
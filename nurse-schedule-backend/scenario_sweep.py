@@ -0,0 +1,173 @@
+# scenario_sweep.py
+
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+import threading
+import time
+
+from schedule_model import (
+    SHIFT_AFTERNOON, SHIFT_MORNING, SHIFT_NIGHT, ScheduleInputError, describe_conflict, parse_schedule_request,
+    precheck_schedule_request,
+)
+from telemetry import StageTimer
+
+logger = logging.getLogger(__name__)
+
+MAX_SWEEP_VARIANTS = 48
+# Payload field -> (minimum value, how a variant request is changed).
+SWEEP_PARAMETERS = {
+    'requiredNursesMorning': (0, lambda request, value: request['required_nurses_by_shift'].__setitem__(SHIFT_MORNING, value)),
+    'requiredNursesAfternoon': (0, lambda request, value: request['required_nurses_by_shift'].__setitem__(SHIFT_AFTERNOON, value)),
+    'requiredNursesNight': (0, lambda request, value: request['required_nurses_by_shift'].__setitem__(SHIFT_NIGHT, value)),
+    'targetOffDays': (0, lambda request, value: request.__setitem__('target_off_days', value)),
+    'maxConsecutiveShiftsWorked': (1, lambda request, value: request.__setitem__('max_consecutive_shifts_worked', value)),
+}
+FAIRNESS_COLUMNS = [
+    'offDaysMin', 'offDaysMax', 'totalShiftsMin', 'totalShiftsMax', 'morningMin', 'morningMax',
+    'afternoonMin', 'afternoonMax', 'nightMin', 'nightMax', 'totalNADoubles',
+]
+SWEEP_COLUMNS = list(SWEEP_PARAMETERS) + ['solverStatus', 'httpStatus', 'penaltyValue'] + FAIRNESS_COLUMNS + ['solveSeconds', 'cutoff', 'note']
+
+
+def parse_scenario_sweep(data):
+    # A sweep is a /generate-schedule payload plus {"sweep": {"requiredNursesNight": [2, 3], "targetOffDays": [8, 9], ...}}
+    # with a list of values for any of SWEEP_PARAMETERS; every combination is one variant. "variantTimeLimit"
+    # overrides solverTimeLimit per variant. The base payload is parsed once and shared by all variants.
+    if not isinstance(data, dict) or not isinstance(data.get('sweep'), dict) or not data['sweep']:
+        raise ScheduleInputError("Invalid sweep payload, expected a 'sweep' object with lists of parameter values")
+    unknown = sorted(set(data['sweep']) - set(SWEEP_PARAMETERS))
+    if unknown:
+        raise ScheduleInputError(f"Unknown sweep parameters: {', '.join(unknown)} (expected: {', '.join(SWEEP_PARAMETERS)})")
+
+    grid = {}
+    try:
+        for name, values in data['sweep'].items():
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"'{name}' must be a non-empty list")
+            grid[name] = sorted({int(value) for value in values})
+            if grid[name][0] < SWEEP_PARAMETERS[name][0]:
+                raise ValueError(f"'{name}' values must be >= {SWEEP_PARAMETERS[name][0]}")
+        variant_time_limit = float(data['variantTimeLimit']) if data.get('variantTimeLimit') is not None else None
+        max_parallel_solves = int(data['maxParallelSolves']) if data.get('maxParallelSolves') is not None else None
+    except (TypeError, ValueError) as e:
+        raise ScheduleInputError(f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}")
+    num_variants = 1
+    for values in grid.values():
+        num_variants *= len(values)
+    if num_variants > MAX_SWEEP_VARIANTS:
+        raise ScheduleInputError(f"Sweep has {num_variants} variants, at most {MAX_SWEEP_VARIANTS} are allowed")
+    if variant_time_limit is not None and variant_time_limit <= 0:
+        raise ScheduleInputError("variantTimeLimit must be > 0")
+    if max_parallel_solves is not None and max_parallel_solves < 1:
+        raise ScheduleInputError("maxParallelSolves must be >= 1")
+
+    base_request = parse_schedule_request(data)
+    if variant_time_limit is not None:
+        base_request['solver_time_limit'] = variant_time_limit
+    base_values = {
+        'requiredNursesMorning': base_request['required_nurses_by_shift'][SHIFT_MORNING],
+        'requiredNursesAfternoon': base_request['required_nurses_by_shift'][SHIFT_AFTERNOON],
+        'requiredNursesNight': base_request['required_nurses_by_shift'][SHIFT_NIGHT],
+        'targetOffDays': base_request['target_off_days'],
+        'maxConsecutiveShiftsWorked': base_request['max_consecutive_shifts_worked'],
+    }
+    variants = []
+    for combination in itertools.product(*grid.values()):
+        parameters = dict(base_values)
+        parameters.update(zip(grid, combination))
+        variants.append(parameters)
+    return {'base_request': base_request, 'variants': variants, 'max_parallel_solves': max_parallel_solves}
+
+
+def build_variant_request(base_request, parameters):
+    # Shallow copy: nurses, days, previous-month states and hints are shared with the base request.
+    variant_request = dict(base_request)
+    variant_request['required_nurses_by_shift'] = dict(base_request['required_nurses_by_shift'])
+    variant_request['stage_timer'] = StageTimer()
+    variant_request['received_at'] = time.time()
+    # What-if variants must not replace the ward's stored boundary state, nor supersede each other or the
+    # ward's own solves; they are cancelled together through the sweep's group.
+    variant_request['ward_id'] = None
+    variant_request['solve_id'] = None
+    variant_request['supersede_key'] = None
+    for name, value in parameters.items():
+        SWEEP_PARAMETERS[name][1](variant_request, value)
+    return variant_request
+
+
+def is_dominated(parameters, infeasible_variants):
+    # Off-day targets are soft, and a lower consecutive-shift limit only removes schedules, so a variant is
+    # infeasible if one with the same staffing levels and a limit at least as high was proven infeasible.
+    required = tuple(parameters[name] for name in ('requiredNursesMorning', 'requiredNursesAfternoon', 'requiredNursesNight'))
+    return any(infeasible_required == required and infeasible_limit >= parameters['maxConsecutiveShiftsWorked']
+               for infeasible_required, infeasible_limit in infeasible_variants)
+
+
+def run_scenario_sweep(sweep, solve_fn, max_parallel_solves, on_variant_result=None):
+    # Solves the variants on a thread pool, loosest consecutive-shift limit first, and returns a compact table
+    # {"columns": [...], "rows": [[...], ...], "summary": {...}} in the order of the grid.
+    # solve_fn(schedule_request) must return (result_dict, http_status). on_variant_result({"index", "row"}) is
+    # called from the pool threads as each row is filled in, in completion order.
+    started_at = time.time()
+    variants = sweep['variants']
+    rows = [None] * len(variants)
+    infeasible_variants = set()
+    infeasible_lock = threading.Lock()
+
+    def make_row(parameters, status, http_status, result=None, cutoff=None, note=None):
+        result = result or {}
+        fairness = result.get('fairnessReport', {})
+        row = [parameters[name] for name in SWEEP_PARAMETERS]
+        row += [status, http_status, result.get('penaltyValue')]
+        row += [fairness.get(column) for column in FAIRNESS_COLUMNS]
+        row += [result.get('timings', {}).get('solveSeconds'), cutoff, note]
+        return row
+
+    def run_variant(variant_index):
+        solve_variant(variant_index)
+        if on_variant_result is not None:
+            on_variant_result({'index': variant_index, 'row': rows[variant_index]})
+
+    def solve_variant(variant_index):
+        parameters = variants[variant_index]
+        required = (parameters['requiredNursesMorning'], parameters['requiredNursesAfternoon'], parameters['requiredNursesNight'])
+        with infeasible_lock:
+            dominated = is_dominated(parameters, infeasible_variants)
+        if dominated:
+            rows[variant_index] = make_row(parameters, 'INFEASIBLE', 500, cutoff='dominated')
+            return
+        variant_request = build_variant_request(sweep['base_request'], parameters)
+        conflicts, _ = precheck_schedule_request(variant_request)
+        if conflicts:
+            rows[variant_index] = make_row(parameters, 'INFEASIBLE', 500, cutoff='precheck', note=describe_conflict(conflicts[0]))
+        else:
+            try:
+                result, status_code = solve_fn(variant_request)
+            except Exception as e:
+                logger.exception("Error in sweep variant %s", parameters)
+                result, status_code = {"error": f"เกิดข้อผิดพลาดที่ไม่คาดคิดใน Server: {e}"}, 500
+            rows[variant_index] = make_row(parameters, result.get('solverStatus', 'ERROR'), status_code, result,
+                                           note=result.get('error'))
+            if result.get('solverStatus') != 'INFEASIBLE':
+                return
+        with infeasible_lock:
+            infeasible_variants.add((required, parameters['maxConsecutiveShiftsWorked']))
+
+    order = sorted(range(len(variants)), key=lambda index: -variants[index]['maxConsecutiveShiftsWorked'])
+    workers = max(1, min(max_parallel_solves, len(variants)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='schedule-sweep') as executor:
+        list(executor.map(run_variant, order))
+
+    status_column = SWEEP_COLUMNS.index('solverStatus')
+    cutoff_column = SWEEP_COLUMNS.index('cutoff')
+    return {
+        'columns': SWEEP_COLUMNS,
+        'rows': rows,
+        'summary': {
+            'variants': len(rows),
+            'feasible': sum(1 for row in rows if row[status_column] in ('OPTIMAL', 'FEASIBLE')),
+            'cutOff': sum(1 for row in rows if row[cutoff_column]),
+            'elapsedSeconds': round(time.time() - started_at, 3),
+        },
+    }
@@ -0,0 +1,114 @@
+# schedule_batch.py
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+from schedule_model import ScheduleInputError, parse_schedule_request, get_previous_states
+
+logger = logging.getLogger(__name__)
+
+MIN_BATCH_SOLVE_SECONDS = 1.0
+
+
+def parse_schedule_batch(data, resolve_payload=None):
+    # A batch is {"wards": [...], "timeBudgetSeconds": ..., "maxParallelSolves": ...} or just the list of wards.
+    # Each ward is a /generate-schedule payload, or {"wardId": ..., "months": [payload, ...]} for a month chain
+    # where every month after the first is solved against the previous month's result. resolve_payload(payload),
+    # if given, rewrites each payload before it is parsed and may raise ScheduleInputError.
+    if isinstance(data, list):
+        data = {'wards': data}
+    if not isinstance(data, dict) or not isinstance(data.get('wards'), list) or not data['wards']:
+        raise ScheduleInputError("Invalid batch payload, expected a non-empty 'wards' list")
+    try:
+        time_budget_seconds = float(data['timeBudgetSeconds']) if data.get('timeBudgetSeconds') is not None else None
+        max_parallel_solves = int(data['maxParallelSolves']) if data.get('maxParallelSolves') is not None else None
+    except (TypeError, ValueError) as e:
+        raise ScheduleInputError(f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}")
+    if time_budget_seconds is not None and time_budget_seconds <= 0:
+        raise ScheduleInputError("timeBudgetSeconds must be > 0")
+    if max_parallel_solves is not None and max_parallel_solves < 1:
+        raise ScheduleInputError("maxParallelSolves must be >= 1")
+
+    chains = []
+    for ward_index, ward in enumerate(data['wards']):
+        if not isinstance(ward, dict):
+            raise ScheduleInputError(f"Invalid ward at index {ward_index}, expected an object")
+        payloads = ward['months'] if 'months' in ward else [ward]
+        if not isinstance(payloads, list) or not payloads:
+            raise ScheduleInputError(f"Invalid 'months' for ward at index {ward_index}, expected a non-empty list")
+        months = []
+        # Inputs are validated up front so a typo in one ward is reported before any solver time is spent.
+        for payload in payloads:
+            try:
+                schedule_request = parse_schedule_request(resolve_payload(payload) if resolve_payload else payload)
+                if schedule_request['ward_id'] is None:
+                    schedule_request['ward_id'] = ward.get('wardId')
+                # Months of one batch must not supersede each other; the batch is cancelled as a group.
+                schedule_request['solve_id'] = None
+                schedule_request['supersede_key'] = None
+                months.append({'schedule_request': schedule_request, 'error': None})
+            except ScheduleInputError as e:
+                months.append({'schedule_request': None, 'error': (e.message, e.status_code)})
+        chains.append({'wardIndex': ward_index, 'wardId': ward.get('wardId', ward_index), 'months': months})
+
+    return {
+        'chains': chains,
+        'time_budget_seconds': time_budget_seconds,
+        'max_parallel_solves': max_parallel_solves,
+    }
+
+
+def run_schedule_batch(batch, solve_fn, on_result, max_parallel_solves):
+    # Runs every chain on its own thread (months inside a chain run in order) and calls
+    # on_result(item) as each month finishes. solve_fn(schedule_request) must return (result_dict, http_status).
+    # With a time budget, each solve's time limit is capped at its share of what is left of the budget.
+    started_at = time.time()
+    deadline = started_at + batch['time_budget_seconds'] if batch['time_budget_seconds'] else None
+
+    def run_chain(chain):
+        num_months = len(chain['months'])
+        previous_result = None
+        succeeded = 0
+        for month_index, month in enumerate(chain['months']):
+            item = {'wardIndex': chain['wardIndex'], 'wardId': chain['wardId'], 'monthIndex': month_index}
+            schedule_request = month['schedule_request']
+            if month_index > 0 and previous_result is None:
+                result, status_code = {"error": "ไม่สามารถคำนวณเดือนนี้ได้ เนื่องจากการคำนวณเดือนก่อนหน้าไม่สำเร็จ"}, 424
+            elif schedule_request is None:
+                result, status_code = {"error": month['error'][0]}, month['error'][1]
+            else:
+                if previous_result is not None:
+                    schedule_request['previous_states'] = get_previous_states(
+                        schedule_request['nurse_ids'], previous_result, schedule_request['max_consecutive_shifts_worked'])
+                remaining_seconds = deadline - time.time() if deadline else None
+                if remaining_seconds is not None and remaining_seconds / (num_months - month_index) < MIN_BATCH_SOLVE_SECONDS:
+                    result, status_code = {"error": "หมดเวลาคำนวณของชุดคำขอนี้ก่อนเริ่มคำนวณตารางเวร"}, 504
+                else:
+                    if remaining_seconds is not None:
+                        schedule_request['solver_time_limit'] = min(schedule_request['solver_time_limit'],
+                                                                    remaining_seconds / (num_months - month_index))
+                    # Parsed with the whole batch; the month's own clock starts when its turn comes, not at parse time.
+                    schedule_request['received_at'] = time.time()
+                    try:
+                        result, status_code = solve_fn(schedule_request)
+                    except Exception as e:
+                        logger.exception("Error in batch solve (Ward: %s, Month: %d)", chain['wardId'], month_index)
+                        result, status_code = {"error": f"เกิดข้อผิดพลาดที่ไม่คาดคิดใน Server: {e}"}, 500
+            previous_result = result if status_code == 200 else None
+            succeeded += status_code == 200
+            item['httpStatus'] = status_code
+            item['result'] = result
+            on_result(item)
+        return succeeded, num_months
+
+    workers = max(1, min(max_parallel_solves, len(batch['chains'])))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='schedule-batch') as executor:
+        outcomes = list(executor.map(run_chain, batch['chains']))
+
+    return {
+        'wards': len(batch['chains']),
+        'solves': sum(total for _, total in outcomes),
+        'succeeded': sum(succeeded for succeeded, _ in outcomes),
+        'elapsedSeconds': round(time.time() - started_at, 3),
+    }
@@ -0,0 +1,1762 @@
+# schedule_model.py
+
+from ortools.sat.python import cp_model
+from collections import OrderedDict
+import datetime
+import logging
+import numpy as np
+import json
+import os
+import re
+import threading
+import time
+
+from telemetry import StageTimer
+from solve_cancellation import SearchStopper, build_cancelled_result, get_cancel_reason, get_stop_check
+
+logger = logging.getLogger(__name__)
+solver_logger = logging.getLogger('cp_sat')
+
+SHIFT_MORNING = 1
+SHIFT_AFTERNOON = 2
+SHIFT_NIGHT = 3
+SHIFTS = [SHIFT_MORNING, SHIFT_AFTERNOON, SHIFT_NIGHT]
+SHIFT_NAMES_TH = {SHIFT_MORNING: 'ช', SHIFT_AFTERNOON: 'บ', SHIFT_NIGHT: 'ด', 0: 'หยุด'}
+SHIFT_NAMES_EN = {SHIFT_MORNING: 'Morning', SHIFT_AFTERNOON: 'Afternoon', SHIFT_NIGHT: 'Night', 0: 'Off'}
+
+PENALTY_OFF_DAY_UNDER_TARGET = 20
+PENALTY_SOFT_CONSTRAINT_VIOLATION = 15
+PENALTY_TOTAL_SHIFT_IMBALANCE = 10
+PENALTY_OFF_DAY_IMBALANCE = 7
+PENALTY_SHIFT_TYPE_IMBALANCE = 5
+PENALTY_PER_NA_DOUBLE = 3
+PENALTY_NIGHT_TO_MORNING_TRANSITION = 1
+PENALTY_HINT_DEVIATION = 2
+
+# Request keys of "objectiveWeights" and the penalty each one overrides.
+OBJECTIVE_WEIGHT_DEFAULTS = {
+    'softConstraintViolation': PENALTY_SOFT_CONSTRAINT_VIOLATION,
+    'offDayUnderTarget': PENALTY_OFF_DAY_UNDER_TARGET,
+    'offDayImbalance': PENALTY_OFF_DAY_IMBALANCE,
+    'totalShiftImbalance': PENALTY_TOTAL_SHIFT_IMBALANCE,
+    'shiftTypeImbalance': PENALTY_SHIFT_TYPE_IMBALANCE,
+    'nightAfternoonDouble': PENALTY_PER_NA_DOUBLE,
+    'nightToMorningTransition': PENALTY_NIGHT_TO_MORNING_TRANSITION,
+}
+OBJECTIVE_MODE_WEIGHTED = 'weighted'
+OBJECTIVE_MODE_LEXICOGRAPHIC = 'lexicographic'
+OBJECTIVE_MODES = (OBJECTIVE_MODE_WEIGHTED, OBJECTIVE_MODE_LEXICOGRAPHIC)
+# Lexicographic mode minimizes these one after another; hint deviation counts as fairness.
+OBJECTIVE_STAGES = ['softConstraints', 'offDayShortfall', 'fairness']
+OBJECTIVE_STAGE_UPPER_BOUND = 1 << 30
+
+# Symmetry breaking orders interchangeable nurses by total shifts, then by their shifts on the first few days.
+SYMMETRY_PREFIX_DAYS = 6
+
+# Built model templates kept per process; 0 disables the cache.
+MODEL_TEMPLATE_CACHE_MAX_ENTRIES = int(os.environ.get('MODEL_TEMPLATE_CACHE_MAX_ENTRIES', 16))
+
+MAX_CONSECUTIVE_SAME_SHIFT = 2
+MAX_CONSECUTIVE_OFF_DAYS = 2
+MIN_OFF_DAYS_IN_WINDOW = 0
+WINDOW_SIZE_FOR_MIN_OFF = 7
+
+DEFAULT_NUM_SOLVER_WORKERS = 8
+ROLLING_HORIZON_WINDOW_DAYS = 7
+ROLLING_HORIZON_OVERLAP_DAYS = 3
+CONFLICT_EXPLANATION_TIME_LIMIT = 10.0
+CONFLICT_MINIMIZATION_STEP_TIME_LIMIT = 1.0
+WARM_START_COMPLETION_TIME_LIMIT = 2.0
+
+# Daily shift list for each M/A/N bitmask (bit 0 = M, bit 1 = A, bit 2 = N), in the sorted order the API returns.
+SHIFT_BITS = np.array([1 << (s - 1) for s in SHIFTS], dtype=np.int8)
+SHIFT_LISTS_BY_MASK = tuple(tuple(s for s in SHIFTS if mask & (1 << (s - 1))) for mask in range(1 << len(SHIFTS)))
+# Opt-in wire format: one string per nurse with one character per day holding the day's SHIFT_BITS mask (0-7).
+COMPACT_SCHEDULE_FORMAT = 'compact-v1'
+COMPACT_SHIFTS_COUNT_COLUMNS = ['morning', 'afternoon', 'night', 'total', 'nightAfternoonDouble', 'daysOff']
+# First line CP-SAT logs after presolve: "#Model 0.69s var:1234/5678 constraints:910/1112".
+PRESOLVED_MODEL_PATTERN = re.compile(r"^#Model\s+([\d.]+)s\s+var:(\d+)/\d+\s+constraints:(\d+)/\d+")
+
+def get_days_array(start_str, end_str):
+    days = []
+    try:
+        start_date = datetime.date.fromisoformat(start_str)
+        end_date = datetime.date.fromisoformat(end_str)
+        if start_date > end_date:
+            raise ValueError("Start date cannot be after end date")
+        current_date = start_date
+        while current_date <= end_date:
+            days.append(current_date)
+            current_date += datetime.timedelta(days=1)
+    except Exception as e:
+        logger.warning("Date parsing error: Start='%s', End='%s'. Error: %s", start_str, end_str, e)
+        return None
+    return days
+
+def get_previous_month_state_shifts(nurse_id, previous_schedule_data, max_consecutive_limit):
+    state = {'last_day_shifts': [], 'consecutive_shifts': 0, 'was_off_last_day': True}
+    if not previous_schedule_data or 'nurseSchedules' not in previous_schedule_data or 'days' not in previous_schedule_data:
+        return state
+
+    nurse_schedules_prev = previous_schedule_data.get('nurseSchedules', {})
+    prev_days_iso = previous_schedule_data.get('days', [])
+    if not prev_days_iso or nurse_id not in nurse_schedules_prev:
+        return state
+
+    last_day_iso = prev_days_iso[-1]
+    nurse_schedule_prev = nurse_schedules_prev[nurse_id]
+    shifts_on_last_day = nurse_schedule_prev.get('shifts', {}).get(last_day_iso, [])
+    state['last_day_shifts'] = sorted(shifts_on_last_day)
+    state['was_off_last_day'] = not bool(shifts_on_last_day)
+
+    consecutive_shifts = 0
+    for day_iso in reversed(prev_days_iso):
+        shifts_on_day = nurse_schedule_prev.get('shifts', {}).get(day_iso, [])
+        num_shifts_this_day = len(shifts_on_day)
+
+        if num_shifts_this_day > 0:
+            consecutive_shifts += num_shifts_this_day
+        else:
+            break
+
+    state['consecutive_shifts'] = consecutive_shifts
+    logger.debug("[Prev Month State] Nurse %s: Last Day Shifts=%s, Consecutive Shifts=%s, Was Off Last=%s",
+                 nurse_id, state['last_day_shifts'], state['consecutive_shifts'], state['was_off_last_day'])
+    return state
+
+def get_previous_states(nurse_ids, previous_schedule_data, max_consecutive_limit):
+    return {
+        n_idx: get_previous_month_state_shifts(nurse_id, previous_schedule_data, max_consecutive_limit)
+        for n_idx, nurse_id in enumerate(nurse_ids)
+    }
+
+def get_hint_assignments(hint_schedule, nurse_id_to_index, days):
+    assignments = {}
+    hint_nurse_schedules = hint_schedule.get('nurseSchedules', {}) if hint_schedule else {}
+    if not hint_nurse_schedules:
+        return assignments
+
+    days_iso = [day.isoformat() for day in days]
+    hinted_days = set()
+    for nurse_schedule in hint_nurse_schedules.values():
+        hinted_days.update((nurse_schedule or {}).get('shifts', {}).keys())
+
+    if hinted_days.intersection(days_iso):
+        day_key_map = {d: day_iso for d, day_iso in enumerate(days_iso) if day_iso in hinted_days}
+    else:
+        # No overlapping dates (e.g. last month's roster): line the hint up with this period day by day.
+        hint_days_iso = hint_schedule.get('days') or sorted(hinted_days)
+        day_key_map = {d: hint_days_iso[d] for d in range(min(len(days_iso), len(hint_days_iso)))}
+        logger.info("Hint schedule has no dates in the requested period, aligning %d hint days by position.", len(day_key_map))
+
+    for nurse_id, nurse_schedule in hint_nurse_schedules.items():
+        n = nurse_id_to_index.get(nurse_id)
+        if n is None or not nurse_schedule:
+            continue
+        hint_shifts = nurse_schedule.get('shifts', {})
+        for d, day_key in day_key_map.items():
+            if day_key not in hint_shifts:
+                continue
+            assigned_shifts = hint_shifts[day_key] or []
+            for s in SHIFTS:
+                assignments[(n, d, s)] = 1 if s in assigned_shifts else 0
+    return assignments
+
+def get_boundary_previous_states(nurse_ids, previous_month_boundary):
+    # previousMonthBoundary is {nurseId: {"lastDayShifts": [...], "consecutiveShifts": k}}, the same state
+    # get_previous_states() derives from a whole previous-month schedule; nurses left out start fresh.
+    previous_states = {}
+    for n_idx, nurse_id in enumerate(nurse_ids):
+        boundary = previous_month_boundary.get(str(nurse_id)) or {}
+        last_day_shifts = sorted(int(s) for s in boundary.get('lastDayShifts', []) or [])
+        if any(s not in SHIFTS for s in last_day_shifts): raise ValueError(f"Invalid lastDayShifts for nurse {nurse_id} in 'previousMonthBoundary'")
+        consecutive_shifts = int(boundary.get('consecutiveShifts', 0))
+        if consecutive_shifts < 0: raise ValueError(f"consecutiveShifts for nurse {nurse_id} in 'previousMonthBoundary' cannot be negative")
+        previous_states[n_idx] = {'last_day_shifts': last_day_shifts, 'consecutive_shifts': consecutive_shifts,
+                                  'was_off_last_day': not last_day_shifts}
+    return previous_states
+
+def get_schedule_boundary(schedule):
+    # The previousMonthBoundary form of a roster's last day: what the next month's solve needs from it.
+    boundary = {}
+    for nurse_id in schedule.get('nurseSchedules', {}):
+        state = get_previous_month_state_shifts(nurse_id, schedule, 0)
+        boundary[str(nurse_id)] = {'lastDayShifts': state['last_day_shifts'], 'consecutiveShifts': state['consecutive_shifts']}
+    return boundary
+
+def compact_schedule_result(schedule_result):
+    # Packs a schedule result into COMPACT_SCHEDULE_FORMAT: "nurses" is the nurse index table, "shifts[n][d]" the
+    # shift bitmask of nurse n on day d and "shiftsCount" one row of COMPACT_SHIFTS_COUNT_COLUMNS per nurse.
+    # Error results, which have no schedule, are returned unchanged.
+    if 'nurseSchedules' not in schedule_result:
+        return schedule_result
+    days_iso = schedule_result['days']
+    compact = {key: value for key, value in schedule_result.items() if key not in ('nurseSchedules', 'shiftsCount')}
+    compact['format'] = COMPACT_SCHEDULE_FORMAT
+    compact['nurses'] = []
+    compact['shifts'] = []
+    compact['shiftsCountColumns'] = COMPACT_SHIFTS_COUNT_COLUMNS
+    compact['shiftsCount'] = []
+    for nurse_id, nurse_schedule in schedule_result['nurseSchedules'].items():
+        nurse_shifts = nurse_schedule['shifts']
+        compact['nurses'].append(nurse_schedule['nurse'])
+        compact['shifts'].append(''.join(str(sum(1 << (s - 1) for s in nurse_shifts.get(day_iso, []))) for day_iso in days_iso))
+        counts = schedule_result.get('shiftsCount', {}).get(nurse_id, {})
+        compact['shiftsCount'].append([counts.get(column) for column in COMPACT_SHIFTS_COUNT_COLUMNS])
+    return compact
+
+def expand_compact_schedule(compact):
+    # Inverse of compact_schedule_result(), so compact rosters can be sent back as previousMonthSchedule,
+    # hintSchedule or currentSchedule. A compact previous month may hold only its last few days.
+    days_iso = compact.get('days', [])
+    nurses = compact.get('nurses', [])
+    rows = compact.get('shifts', [])
+    if not isinstance(nurses, list) or not isinstance(rows, list) or len(nurses) != len(rows):
+        raise ValueError("Invalid compact schedule, 'nurses' and 'shifts' must be lists of the same length")
+    nurse_schedules = {}
+    for nurse, row in zip(nurses, rows):
+        if len(row) != len(days_iso):
+            raise ValueError(f"Invalid compact schedule row for nurse {nurse.get('id')}, expected {len(days_iso)} days")
+        nurse_schedules[nurse['id']] = {
+            'nurse': nurse,
+            'shifts': {day_iso: list(SHIFT_LISTS_BY_MASK[int(mask)]) for day_iso, mask in zip(days_iso, row)},
+        }
+    expanded = {key: value for key, value in compact.items() if key not in ('format', 'nurses', 'shifts', 'shiftsCountColumns', 'shiftsCount')}
+    expanded['nurseSchedules'] = nurse_schedules
+    return expanded
+
+def expand_schedule_input(schedule_input):
+    if isinstance(schedule_input, dict) and schedule_input.get('format') == COMPACT_SCHEDULE_FORMAT:
+        return expand_compact_schedule(schedule_input)
+    return schedule_input
+
+def normalize_schedule_request(schedule_request):
+    normalized_nurses = []
+    for nurse in sorted(schedule_request['nurses'], key=lambda item: str(item['id'])):
+        normalized_nurse = dict(nurse)
+        normalized_nurse['constraints'] = sorted(
+            nurse.get('constraints', []) or [],
+            key=lambda constraint: json.dumps(constraint, sort_keys=True, ensure_ascii=False)
+        )
+        normalized_nurses.append(normalized_nurse)
+
+    nurse_ids = schedule_request['nurse_ids']
+    boundary_states = {
+        str(nurse_ids[n]): {'lastDayShifts': state['last_day_shifts'], 'consecutiveShifts': state['consecutive_shifts']}
+        for n, state in schedule_request['previous_states'].items()
+        if state['last_day_shifts'] or state['consecutive_shifts']
+    }
+    rolling_horizon = schedule_request['rolling_horizon']
+    rolling_horizon_key = None
+    if rolling_horizon:
+        rolling_horizon_key = {'windowDays': rolling_horizon['window_days'], 'overlapDays': rolling_horizon['overlap_days']}
+
+    return {
+        'nurses': normalized_nurses,
+        'startDate': schedule_request['start_date'],
+        'endDate': schedule_request['end_date'],
+        'holidays': sorted(set(schedule_request['holidays'])),
+        'required': {str(s): schedule_request['required_nurses_by_shift'][s] for s in SHIFTS},
+        'targetOffDays': schedule_request['target_off_days'],
+        'maxConsecutiveShiftsWorked': schedule_request['max_consecutive_shifts_worked'],
+        'previousMonthBoundary': boundary_states,
+        'hintObjective': schedule_request['hint_objective'],
+        'objectiveWeights': schedule_request['objective_weights'],
+        'objectiveMode': schedule_request['objective_mode'],
+        # A rolling-horizon roster is usually worse than a full-model one, so the two never answer for each other.
+        'rollingHorizon': rolling_horizon_key,
+    }
+
+
+class SharedLiterals:
+    # Derived literals (e.g. N+A on the same day) are created once per model and shared by every constraint family that needs them.
+    # index_map ({sorted operand indices: and-literal index}) restores the literals of a copied model template.
+    def __init__(self, model, index_map=None):
+        self.model = model
+        self._and_literals = {key: model.GetBoolVarFromProtoIndex(index) for key, index in (index_map or {}).items()}
+
+    def index_map(self):
+        return {key: literal.Index() for key, literal in self._and_literals.items()}
+
+    def all_of(self, literals, name):
+        key = tuple(sorted(literal.Index() for literal in literals))
+        if key not in self._and_literals:
+            and_literal = self.model.NewBoolVar(name)
+            self.model.AddBoolAnd(literals).OnlyEnforceIf(and_literal)
+            self.model.AddBoolOr([literal.Not() for literal in literals] + [and_literal])
+            self._and_literals[key] = and_literal
+        return self._and_literals[key]
+
+
+def get_interchangeable_nurse_classes(schedule_request):
+    # Groups nurses the model cannot tell apart: same personal constraints, same previous-month boundary and
+    # same hinted assignments, and not the partner of anyone's paired_nurses constraint. Swapping two nurses of
+    # a class maps every solution to another one with the same penalty. Returns the classes of 2 or more nurses.
+    nurse_ids = schedule_request['nurse_ids']
+    referenced_ids = {
+        str(constraint.get('value'))
+        for nurse in schedule_request['nurses'] for constraint in nurse.get('constraints', []) or []
+        if constraint.get('type') == 'paired_nurses'
+    }
+    hinted_rows = {}
+    for (n, d, s), value in sorted(schedule_request['hint_assignments'].items()):
+        hinted_rows.setdefault(n, []).append((d, s, value))
+    classes = {}
+    for n, nurse in enumerate(schedule_request['nurses']):
+        if str(nurse_ids[n]) in referenced_ids:
+            continue
+        state = schedule_request['previous_states'].get(n) or {'last_day_shifts': [], 'consecutive_shifts': 0, 'was_off_last_day': True}
+        signature = (
+            json.dumps(sorted(json.dumps(constraint, sort_keys=True, default=str) for constraint in nurse.get('constraints', []) or [])),
+            tuple(state['last_day_shifts']), state['consecutive_shifts'], state['was_off_last_day'],
+            tuple(hinted_rows.get(n, [])),
+        )
+        classes.setdefault(signature, []).append(n)
+    return [members for members in classes.values() if len(members) > 1]
+
+
+def get_model_size(model):
+    model_proto = model.Proto()
+    return {"variables": len(model_proto.variables), "constraints": len(model_proto.constraints)}
+
+
+class ScheduleSolutionStreamer(cp_model.CpSolverSolutionCallback):
+    def __init__(self, collect_result, on_solution, has_objective=True, objective_stages=None):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self._collect_result = collect_result
+        self._on_solution = on_solution
+        self._has_objective = has_objective
+        self._objective_stages = objective_stages or []
+        # Name of the stage solve_lexicographic is minimizing, when it is.
+        self.stage = None
+        self.solution_count = 0
+
+    def on_solution_callback(self):
+        self.solution_count += 1
+        solution = self._collect_result(self.response_proto.solution)
+        solution["solutionIndex"] = self.solution_count
+        if self._objective_stages:
+            # The solver's objective is only the current stage; the penalty stays the weighted total of all stages,
+            # as in the final result. No bound on that total is known while a stage runs.
+            values = self.response_proto.solution
+            solution["penaltyValue"] = sum(values[index] for _, index in self._objective_stages)
+            solution["bestBound"] = None
+            solution["stage"] = self.stage
+            solution["stageObjective"] = self.ObjectiveValue()
+            solution["stageBestBound"] = self.BestObjectiveBound()
+        else:
+            solution["penaltyValue"] = self.ObjectiveValue() if self._has_objective else 0
+            solution["bestBound"] = self.BestObjectiveBound() if self._has_objective else 0
+        solution["elapsedSeconds"] = round(self.WallTime(), 3)
+        logger.info("[Solution #%d] Objective=%s, Bound=%s, Time=%ss", self.solution_count, solution['penaltyValue'], solution['bestBound'], solution['elapsedSeconds'])
+        try:
+            self._on_solution(solution)
+        except Exception as e:
+            logger.warning("Could not deliver intermediate solution #%d: %s", self.solution_count, e)
+
+
+class ScheduleInputError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def parse_schedule_request(data):
+    received_at = time.time()
+    stage_timer = StageTimer()
+    if not data:
+        raise ScheduleInputError("Invalid JSON payload")
+    try:
+        nurses_data = data['nurses']
+        schedule_info = data['schedule']
+        previous_month_schedule = expand_schedule_input(data.get('previousMonthSchedule'))
+        previous_month_boundary = data.get('previousMonthBoundary')
+
+        start_date_str = schedule_info['startDate'].split('T')[0]
+        end_date_str = schedule_info['endDate'].split('T')[0]
+
+        holidays_input = schedule_info.get('holidays', [])
+
+        REQ_MORNING = int(data.get('requiredNursesMorning', 2))
+        REQ_AFTERNOON = int(data.get('requiredNursesAfternoon', 3))
+        REQ_NIGHT = int(data.get('requiredNursesNight', 2))
+        required_nurses_by_shift = {
+            SHIFT_MORNING: REQ_MORNING, SHIFT_AFTERNOON: REQ_AFTERNOON, SHIFT_NIGHT: REQ_NIGHT
+        }
+
+        MAX_CONSECUTIVE_SHIFTS_WORKED = int(data.get('maxConsecutiveShiftsWorked', 6))
+
+        TARGET_OFF_DAYS = int(data.get('targetOffDays', 8))
+        SOLVER_TIME_LIMIT = float(data.get('solverTimeLimit', 60.0))
+        BYPASS_CACHE = bool(data.get('bypassCache', False))
+        WARD_ID = data.get('wardId')
+        SOLVE_ID = str(data['solveId']) if data.get('solveId') is not None else None
+        SESSION_ID = data.get('sessionId')
+        SUPERSEDE_PREVIOUS = bool(data.get('supersedePrevious', True))
+        hint_schedule = expand_schedule_input(data.get('hintSchedule'))
+        KEEP_CLOSE_TO_HINT = bool(data.get('keepCloseToHint', False))
+        HINT_DEVIATION_PENALTY = int(data.get('hintDeviationPenalty', PENALTY_HINT_DEVIATION))
+        SOLVE_PRIORITY = int(data.get('priority', 1))
+        SYMMETRY_BREAKING = bool(data.get('symmetryBreaking', True))
+        GREEDY_WARM_START = bool(data.get('greedyWarmStart', True))
+        MIN_SOLVER_WORKERS = int(data['minSolverWorkers']) if data.get('minSolverWorkers') is not None else None
+        MAX_SOLVER_WORKERS = int(data['maxSolverWorkers']) if data.get('maxSolverWorkers') is not None else None
+        objective_weights_input = data.get('objectiveWeights') or {}
+        if not isinstance(objective_weights_input, dict): raise ValueError("Invalid 'objectiveWeights' format, expected an object")
+        unknown_weights = sorted(set(objective_weights_input) - set(OBJECTIVE_WEIGHT_DEFAULTS))
+        if unknown_weights: raise ValueError(f"Unknown objectiveWeights: {', '.join(unknown_weights)} (expected: {', '.join(OBJECTIVE_WEIGHT_DEFAULTS)})")
+        OBJECTIVE_WEIGHTS = {key: int(objective_weights_input.get(key, default)) for key, default in OBJECTIVE_WEIGHT_DEFAULTS.items()}
+        OBJECTIVE_MODE = data.get('objectiveMode') or OBJECTIVE_MODE_WEIGHTED
+        rolling_horizon_input = data.get('rollingHorizon')
+        ROLLING_HORIZON = None
+        if rolling_horizon_input:
+            rolling_horizon_options = rolling_horizon_input if isinstance(rolling_horizon_input, dict) else {}
+            ROLLING_HORIZON = {
+                'window_days': int(rolling_horizon_options.get('windowDays', ROLLING_HORIZON_WINDOW_DAYS)),
+                'overlap_days': int(rolling_horizon_options.get('overlapDays', ROLLING_HORIZON_OVERLAP_DAYS)),
+            }
+
+        if not isinstance(nurses_data, list) or not nurses_data: raise ValueError("Invalid or empty 'nurses' data")
+        if not all('id' in n for n in nurses_data): raise ValueError("Missing 'id' in nurse data")
+        if not isinstance(holidays_input, list) or not all(isinstance(h, int) and h > 0 and h < 32 for h in holidays_input): raise ValueError("Invalid 'holidays' list format")
+        if REQ_MORNING < 0 or REQ_AFTERNOON < 0 or REQ_NIGHT < 0: raise ValueError("Required nurses cannot be negative")
+        if MAX_CONSECUTIVE_SHIFTS_WORKED < 1: raise ValueError(f"Max consecutive SHIFTS worked must be >= 1")
+        if TARGET_OFF_DAYS < 0: raise ValueError("Target off days cannot be negative")
+        if SOLVER_TIME_LIMIT < 5: logger.warning("Solver time limit < 5s is very short.")
+        if MAX_CONSECUTIVE_SAME_SHIFT < 1: raise ValueError("Internal Error: MAX_CONSECUTIVE_SAME_SHIFT must be >= 1")
+        if MAX_CONSECUTIVE_OFF_DAYS < 1: raise ValueError("Internal Error: MAX_CONSECUTIVE_OFF_DAYS must be >= 1")
+        if MIN_OFF_DAYS_IN_WINDOW < 0: raise ValueError("Internal Error: MIN_OFF_DAYS_IN_WINDOW cannot be negative")
+        if WINDOW_SIZE_FOR_MIN_OFF < 1: raise ValueError("Internal Error: WINDOW_SIZE_FOR_MIN_OFF must be >= 1")
+        if hint_schedule is not None and (not isinstance(hint_schedule, dict) or not isinstance(hint_schedule.get('nurseSchedules', {}), dict)): raise ValueError("Invalid 'hintSchedule' format, expected an object with 'nurseSchedules'")
+        if previous_month_boundary is not None and not isinstance(previous_month_boundary, dict): raise ValueError("Invalid 'previousMonthBoundary' format, expected an object keyed by nurse id")
+        if HINT_DEVIATION_PENALTY < 0: raise ValueError("Hint deviation penalty cannot be negative")
+        if SOLVE_PRIORITY < 1: raise ValueError("Priority must be >= 1")
+        if any(weight < 0 for weight in OBJECTIVE_WEIGHTS.values()): raise ValueError("objectiveWeights cannot be negative")
+        if OBJECTIVE_MODE not in OBJECTIVE_MODES: raise ValueError(f"objectiveMode must be one of: {', '.join(OBJECTIVE_MODES)}")
+        if MIN_SOLVER_WORKERS is not None and MIN_SOLVER_WORKERS < 1: raise ValueError("minSolverWorkers must be >= 1")
+        if MAX_SOLVER_WORKERS is not None and MAX_SOLVER_WORKERS < 1: raise ValueError("maxSolverWorkers must be >= 1")
+        if ROLLING_HORIZON and ROLLING_HORIZON['window_days'] < 1: raise ValueError("rollingHorizon.windowDays must be >= 1")
+        if ROLLING_HORIZON and ROLLING_HORIZON['overlap_days'] < 0: raise ValueError("rollingHorizon.overlapDays cannot be negative")
+        if SOLVE_ID is not None and not SOLVE_ID: raise ValueError("solveId cannot be empty")
+
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning("Data extraction/validation error: Data input error: %s", e, exc_info=True)
+        raise ScheduleInputError(f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}")
+    except Exception as e:
+        logger.exception("Unexpected error during data extraction: %s", e)
+        raise ScheduleInputError(f"เกิดข้อผิดพลาดในการประมวลผลข้อมูล Input: {e}")
+
+    days = get_days_array(start_date_str, end_date_str)
+    if days is None:
+        raise ScheduleInputError("รูปแบบวันที่เริ่มต้น/สิ้นสุดไม่ถูกต้อง หรือไม่สามารถแปลงค่าได้")
+    num_nurses = len(nurses_data)
+    num_days = len(days)
+    if num_days == 0:
+        raise ScheduleInputError("ช่วงวันที่ที่เลือกไม่ถูกต้อง ทำให้ไม่มีวันในตารางเวร")
+    nurse_indices = range(num_nurses)
+
+    logger.info("Processing schedule for %d nurses over %d days (%s to %s), previous month data: %s, time limit: %ss",
+                num_nurses, num_days, start_date_str, end_date_str,
+                'boundary' if previous_month_boundary is not None else 'yes' if previous_month_schedule else 'no', SOLVER_TIME_LIMIT)
+    logger.debug("Requirements per shift (M/A/N): %d/%d/%d", REQ_MORNING, REQ_AFTERNOON, REQ_NIGHT)
+    logger.debug("Max Consecutive SHIFTS Worked (before off): %d", MAX_CONSECUTIVE_SHIFTS_WORKED)
+    logger.debug("USER TARGET Off Days (Min): %d", TARGET_OFF_DAYS)
+    logger.debug("Holidays (day numbers): %s", holidays_input)
+    logger.debug("Other Hard Constraints: MaxConsecSameShift=%d, MaxConsecOff=%d, MinOffInWindow=%d/%d days",
+                 MAX_CONSECUTIVE_SAME_SHIFT, MAX_CONSECUTIVE_OFF_DAYS, MIN_OFF_DAYS_IN_WINDOW, WINDOW_SIZE_FOR_MIN_OFF)
+    logger.debug("Penalty Weights: OffDayUnderTarget=%d, OffDayImbalance=%d, TotalShiftImbalance=%d, ShiftTypeImbalance=%d, PerN+A=%d, SoftConstraintViolation=%d, N+A->M Transition=%d",
+                 OBJECTIVE_WEIGHTS['offDayUnderTarget'], OBJECTIVE_WEIGHTS['offDayImbalance'], OBJECTIVE_WEIGHTS['totalShiftImbalance'],
+                 OBJECTIVE_WEIGHTS['shiftTypeImbalance'], OBJECTIVE_WEIGHTS['nightAfternoonDouble'], OBJECTIVE_WEIGHTS['softConstraintViolation'],
+                 OBJECTIVE_WEIGHTS['nightToMorningTransition'])
+    logger.debug("Objective mode: %s", OBJECTIVE_MODE)
+
+    nurse_id_map = {n: nurses_data[n]['id'] for n in nurse_indices}
+    nurse_id_to_index = {v: k for k, v in nurse_id_map.items()}
+
+    stage_timer.lap('parse')
+    previous_states = {}
+    if previous_month_boundary is not None:
+        try:
+            previous_states = get_boundary_previous_states([nurse_id_map[n] for n in nurse_indices], previous_month_boundary)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ScheduleInputError(f"ข้อมูล Input ไม่ถูกต้อง หรือไม่ครบถ้วน: {e}")
+    elif previous_month_schedule:
+        previous_states = get_previous_states([nurse_id_map[n] for n in nurse_indices], previous_month_schedule, MAX_CONSECUTIVE_SHIFTS_WORKED)
+    stage_timer.lap('previous_states')
+
+    hint_assignments = get_hint_assignments(hint_schedule, nurse_id_to_index, days)
+    hint_objective = None
+    if hint_assignments and KEEP_CLOSE_TO_HINT and HINT_DEVIATION_PENALTY > 0:
+        hint_objective = {
+            'penalty': HINT_DEVIATION_PENALTY,
+            'assignments': sorted([str(nurse_id_map[n]), d, s, v] for (n, d, s), v in hint_assignments.items()),
+        }
+
+    stage_timer.lap('hint')
+
+    # A new solve for the same planner session, or else the same ward, cancels the one still running.
+    supersede_key = None
+    if SUPERSEDE_PREVIOUS:
+        if SESSION_ID is not None:
+            supersede_key = f"session:{SESSION_ID}"
+        elif WARD_ID is not None:
+            supersede_key = f"ward:{WARD_ID}"
+
+    return {
+        'received_at': received_at,
+        'stage_timer': stage_timer,
+        'nurses': nurses_data,
+        'nurse_ids': [nurse_id_map[n] for n in nurse_indices],
+        'start_date': start_date_str,
+        'end_date': end_date_str,
+        'days': days,
+        'holidays': holidays_input,
+        'required_nurses_by_shift': required_nurses_by_shift,
+        'max_consecutive_shifts_worked': MAX_CONSECUTIVE_SHIFTS_WORKED,
+        'target_off_days': TARGET_OFF_DAYS,
+        'solver_time_limit': SOLVER_TIME_LIMIT,
+        'bypass_cache': BYPASS_CACHE,
+        'ward_id': WARD_ID,
+        'symmetry_breaking': SYMMETRY_BREAKING,
+        'greedy_warm_start': GREEDY_WARM_START,
+        'previous_states': previous_states,
+        'hint_assignments': hint_assignments,
+        'keep_close_to_hint': KEEP_CLOSE_TO_HINT,
+        'hint_deviation_penalty': HINT_DEVIATION_PENALTY,
+        'hint_objective': hint_objective,
+        'objective_weights': OBJECTIVE_WEIGHTS,
+        'objective_mode': OBJECTIVE_MODE,
+        'priority': SOLVE_PRIORITY,
+        'min_solver_workers': MIN_SOLVER_WORKERS,
+        'max_solver_workers': MAX_SOLVER_WORKERS,
+        'rolling_horizon': ROLLING_HORIZON,
+        'num_workers': DEFAULT_NUM_SOLVER_WORKERS,
+        'solve_id': SOLVE_ID,
+        'supersede_key': supersede_key,
+        'solve_group': None,
+        'cancel_slot': None,
+    }
+
+
+WEEKDAY_CONSTRAINT_DAYS = {
+    'no_mondays': 0, 'no_tuesdays': 1, 'no_wednesdays': 2,
+    'no_thursdays': 3, 'no_fridays': 4, 'no_saturdays': 5, 'no_sundays': 6
+}
+SHIFT_CONSTRAINT_SHIFTS = {'no_morning_shifts': SHIFT_MORNING, 'no_afternoon_shifts': SHIFT_AFTERNOON, 'no_night_shifts': SHIFT_NIGHT}
+MAX_REPORTED_CONFLICTS = 20
+
+
+def get_day_calendar(days):
+    # Per-day indexes that personal constraint types select days with, built once per model or pre-check.
+    first_monday = days[0].toordinal() - days[0].weekday() if days else 0
+    return {
+        'num_days': len(days),
+        'weekday': np.array([day.weekday() for day in days], dtype=np.int8),
+        'day_of_month': np.array([day.day for day in days], dtype=np.int8),
+        'week': np.array([(day.toordinal() - first_monday) // 7 for day in days], dtype=np.int16),
+    }
+
+
+class PersonalConstraintContext:
+    # What build_model() hands to personal constraint types: the model, the per-nurse literals as object arrays
+    # (shift_vars (nurses, days, 3), off_vars and working_vars (nurses, days)) and the day calendar.
+    def __init__(self, model, shift_vars, off_vars, working_vars, calendar, nurse_id_to_index, na_double):
+        self.model = model
+        self.shift_vars = shift_vars
+        self.off_vars = off_vars
+        self.working_vars = working_vars
+        self.calendar = calendar
+        self.nurse_id_to_index = nurse_id_to_index
+        self.na_double = na_double
+
+
+class PersonalConstraintType:
+    # A personal constraint type ("type" in a nurse's constraints). Most types only rule out shifts on some days
+    # and just implement blocked_shifts(); the hard and soft versions and the pre-check are derived from it.
+    # Nurses with an identical constraint (same type, strength and value) are applied as one batch, so
+    # parse_value() and blocked_shifts() run once per distinct constraint, not once per nurse.
+    def parse_value(self, value):
+        # Raises ValueError or TypeError for a value the type cannot use; the constraint is then skipped.
+        return value
+
+    def blocked_shifts(self, calendar, value):
+        # (days, 3) mask of the shifts the hard version forbids, or None if the type does not work per shift.
+        return None
+
+    def add_hard(self, context, nurse_literals, value):
+        # nurse_literals: [(n, literal)]; every rule of nurse n must be enforced only if literal.
+        mask = self.blocked_shifts(context.calendar, value)
+        if not mask.any():
+            return
+        off_days = mask.all(axis=1)
+        partial_mask = mask & ~off_days[:, None]
+        for n, literal in nurse_literals:
+            forced_false = [var.Not() for var in context.shift_vars[n][partial_mask]]
+            context.model.AddBoolAnd(list(context.off_vars[n][off_days]) + forced_false).OnlyEnforceIf(literal)
+
+    def soft_terms(self, context, nurses, value):
+        # Literals (or linear terms) counting the violations of the soft version, each penalized once.
+        mask = self.blocked_shifts(context.calendar, value)
+        off_days = mask.all(axis=1)
+        partial_mask = mask & ~off_days[:, None]
+        terms = []
+        for n in nurses:
+            terms.extend(context.working_vars[n][off_days])
+            terms.extend(context.shift_vars[n][partial_mask])
+        return terms
+
+
+class DaysOffConstraint(PersonalConstraintType):
+    def __init__(self, select_days):
+        self.select_days = select_days
+
+    def blocked_shifts(self, calendar, value):
+        mask = np.zeros((calendar['num_days'], len(SHIFTS)), dtype=bool)
+        mask[self.select_days(calendar, value)] = True
+        return mask
+
+
+class NoShiftConstraint(PersonalConstraintType):
+    def __init__(self, shift):
+        self.shift = shift
+
+    def blocked_shifts(self, calendar, value):
+        mask = np.zeros((calendar['num_days'], len(SHIFTS)), dtype=bool)
+        mask[:, self.shift - 1] = True
+        return mask
+
+
+class SpecificDaysOffConstraint(DaysOffConstraint):
+    # value: list of day-of-month numbers.
+    def __init__(self):
+        super().__init__(lambda calendar, day_numbers: np.isin(calendar['day_of_month'], day_numbers))
+
+    def parse_value(self, value):
+        if not isinstance(value, list):
+            raise TypeError(f"expected a list of day numbers, got {type(value).__name__}")
+        return sorted({int(day_num) for day_num in value})
+
+
+class NoNightAfternoonDoubleConstraint(PersonalConstraintType):
+    def add_hard(self, context, nurse_literals, value):
+        night, afternoon = context.shift_vars[:, :, SHIFT_NIGHT - 1], context.shift_vars[:, :, SHIFT_AFTERNOON - 1]
+        for n, literal in nurse_literals:
+            for night_var, afternoon_var in zip(night[n], afternoon[n]):
+                context.model.AddBoolOr([night_var.Not(), afternoon_var.Not()]).OnlyEnforceIf(literal)
+
+    def soft_terms(self, context, nurses, value):
+        return [context.na_double(n, d) for n in nurses for d in range(context.calendar['num_days'])]
+
+
+class MaxNightsPerWeekConstraint(PersonalConstraintType):
+    # value: most night shifts in one calendar week (Monday to Sunday); partial weeks at the ends of the
+    # period count on their own. The soft version is penalized once per night above the limit.
+    def parse_value(self, value):
+        max_nights = int(value)
+        if max_nights < 0:
+            raise ValueError("max nights per week must be >= 0")
+        return max_nights
+
+    def blocked_shifts(self, calendar, value):
+        if value > 0:
+            return None
+        mask = np.zeros((calendar['num_days'], len(SHIFTS)), dtype=bool)
+        mask[:, SHIFT_NIGHT - 1] = True
+        return mask
+
+    def week_nights(self, context, n):
+        nights = context.shift_vars[n, :, SHIFT_NIGHT - 1]
+        week = context.calendar['week']
+        return [list(nights[week == week_number]) for week_number in np.unique(week)]
+
+    def add_hard(self, context, nurse_literals, value):
+        for n, literal in nurse_literals:
+            for nights in self.week_nights(context, n):
+                if len(nights) > value:
+                    context.model.Add(sum(nights) <= value).OnlyEnforceIf(literal)
+
+    def soft_terms(self, context, nurses, value):
+        terms = []
+        for n in nurses:
+            for week_number, nights in enumerate(self.week_nights(context, n)):
+                if len(nights) > value:
+                    excess = context.model.NewIntVar(0, len(nights) - value, f'extra_nights_n{n}_w{week_number}_max{value}')
+                    context.model.Add(sum(nights) - value <= excess)
+                    terms.append(excess)
+        return terms
+
+
+class PairedNursesConstraint(PersonalConstraintType):
+    # value: id of the nurse to work every shift with (e.g. a preceptor and a new nurse). The soft version is
+    # penalized once per shift only one of the two works.
+    def parse_value(self, value):
+        return str(value)
+
+    def partner_index(self, context, value):
+        if value not in context.nurse_id_to_index:
+            raise ValueError(f"unknown paired nurse '{value}'")
+        return context.nurse_id_to_index[value]
+
+    def add_hard(self, context, nurse_literals, value):
+        partner = self.partner_index(context, value)
+        for n, literal in nurse_literals:
+            for var, partner_var in zip(context.shift_vars[n].ravel(), context.shift_vars[partner].ravel()):
+                context.model.Add(var == partner_var).OnlyEnforceIf(literal)
+
+    def soft_terms(self, context, nurses, value):
+        partner = self.partner_index(context, value)
+        terms = []
+        for n in nurses:
+            for (d, s), var in np.ndenumerate(context.shift_vars[n]):
+                partner_var = context.shift_vars[partner, d, s]
+                apart = context.model.NewBoolVar(f'unpaired_n{n}_p{partner}_d{d}_s{s + 1}')
+                context.model.Add(var - partner_var <= apart)
+                context.model.Add(partner_var - var <= apart)
+                terms.append(apart)
+        return terms
+
+
+PERSONAL_CONSTRAINT_TYPES = {}
+
+
+def register_constraint_type(constraint_type, handler):
+    # New rule types are added here; build_model() and the pre-check look them up by "type".
+    PERSONAL_CONSTRAINT_TYPES[constraint_type] = handler
+
+
+for _constraint_type, _weekday in WEEKDAY_CONSTRAINT_DAYS.items():
+    register_constraint_type(_constraint_type, DaysOffConstraint(lambda calendar, value, weekday=_weekday: calendar['weekday'] == weekday))
+for _constraint_type, _shift in SHIFT_CONSTRAINT_SHIFTS.items():
+    register_constraint_type(_constraint_type, NoShiftConstraint(_shift))
+register_constraint_type('no_specific_days', SpecificDaysOffConstraint())
+register_constraint_type('no_night_afternoon_double', NoNightAfternoonDoubleConstraint())
+register_constraint_type('max_nights_per_week', MaxNightsPerWeekConstraint())
+register_constraint_type('paired_nurses', PairedNursesConstraint())
+
+
+def get_hard_constraint_mask(constraint, calendar):
+    # (days, 3) mask of the shifts a hard personal constraint rules out, or None if it is soft, invalid or
+    # does not rule out single shifts (N+A doubles, weekly limits, pairs).
+    handler = PERSONAL_CONSTRAINT_TYPES.get(constraint.get('type'))
+    if handler is None or constraint.get('strength', 'hard') != 'hard':
+        return None
+    try:
+        return handler.blocked_shifts(calendar, handler.parse_value(constraint.get('value')))
+    except (ValueError, TypeError):
+        return None
+
+
+def max_shifts_between_days_off(num_days, max_consecutive_shifts):
+    # Upper bound on one nurse's shifts in num_days: a run of working days holds at most max_consecutive_shifts
+    # shifts (and at most 2 a day), and runs are separated by at least one day off.
+    best_ratio = max(min(max_consecutive_shifts, 2 * run_days) / (run_days + 1) for run_days in range(1, max_consecutive_shifts + 1))
+    return int((num_days + 1) * best_ratio)
+
+
+def get_nurse_total_bounds(schedule_request):
+    # Bounds every nurse's period totals must satisfy under the ward-wide rules alone: total demand, the
+    # consecutive-shift, same-shift and off-day windows and at most 2 shifts a day. Hard personal constraints are
+    # left out on purpose; they hang off assumption literals that explain_infeasibility() frees again, and presolve
+    # already propagates them while those literals are fixed. Returns {'shift_type': {s: (lo, hi)}, 'total': (lo, hi),
+    # 'off_days': (lo, hi), 'demand': {s: shifts}}; lo may exceed hi only for requests the pre-check rejects.
+    num_days = len(schedule_request['days'])
+    max_consecutive_shifts = schedule_request['max_consecutive_shifts_worked']
+    demand = {s: schedule_request['required_nurses_by_shift'].get(s, 0) * num_days for s in SHIFTS}
+    same_shift_cap = num_days - num_days // (MAX_CONSECUTIVE_SAME_SHIFT + 1) if MAX_CONSECUTIVE_SAME_SHIFT > 0 else num_days
+    shift_type_bounds = {s: (0, min(same_shift_cap, demand[s])) for s in SHIFTS}
+    # Every working day has a shift, so a run of working days is at most max_consecutive_shifts days long.
+    max_working_days = num_days - num_days // (max_consecutive_shifts + 1)
+    min_working_days = num_days // (MAX_CONSECUTIVE_OFF_DAYS + 1) if MAX_CONSECUTIVE_OFF_DAYS > 0 else 0
+    max_total = min(max_shifts_between_days_off(num_days, max_consecutive_shifts), 2 * max_working_days,
+                    sum(hi for _, hi in shift_type_bounds.values()), sum(demand.values()))
+    return {
+        'shift_type': shift_type_bounds,
+        'total': (min_working_days, max_total),
+        'off_days': (num_days - max_working_days, num_days - min_working_days),
+        'demand': demand,
+    }
+
+
+def precheck_schedule_request(schedule_request):
+    # Necessary conditions that only need arithmetic, checked before the model is built. Every conflict returned
+    # proves the request infeasible; warnings flag soft targets that cannot be met. Returns (conflicts, warnings).
+    days = schedule_request['days']
+    nurse_ids = schedule_request['nurse_ids']
+    num_nurses = len(nurse_ids)
+    num_days = len(days)
+    days_iso = [day.isoformat() for day in days]
+    required = np.array([schedule_request['required_nurses_by_shift'].get(s, 0) for s in SHIFTS])
+    max_consecutive_shifts = schedule_request['max_consecutive_shifts_worked']
+    morning_col, afternoon_col, night_col = (s - 1 for s in SHIFTS)
+
+    calendar = get_day_calendar(days)
+    blockers = []
+    for n, nurse in enumerate(schedule_request['nurses']):
+        for constraint_index, constraint in enumerate(nurse.get('constraints', []) or []):
+            mask = get_hard_constraint_mask(constraint, calendar)
+            if mask is not None:
+                blockers.append((n, mask, {'nurseId': nurse_ids[n], 'constraintIndex': constraint_index, 'type': constraint['type']}))
+        prev_state = schedule_request['previous_states'].get(n)
+        if prev_state and SHIFT_AFTERNOON in prev_state['last_day_shifts']:
+            mask = np.zeros((num_days, len(SHIFTS)), dtype=bool)
+            mask[0, night_col] = True
+            blockers.append((n, mask, {'nurseId': nurse_ids[n], 'constraintIndex': None, 'type': 'previous_month_afternoon'}))
+        if prev_state and not prev_state['was_off_last_day'] and prev_state['consecutive_shifts'] >= max_consecutive_shifts:
+            mask = np.zeros((num_days, len(SHIFTS)), dtype=bool)
+            mask[0] = True
+            blockers.append((n, mask, {'nurseId': nurse_ids[n], 'constraintIndex': None, 'type': 'previous_month_consecutive_shifts'}))
+
+    blocked = np.zeros((num_nurses, num_days, len(SHIFTS)), dtype=bool)
+    for n, mask, _ in blockers:
+        blocked[n] |= mask
+    open_shifts = ~blocked
+    forced_off = blocked.all(axis=2)
+
+    def blocking_refs(day_slice, shift_indices, nurse=None):
+        return [ref for n, mask, ref in blockers
+                if (nurse is None or n == nurse) and mask[day_slice][..., shift_indices].any()]
+
+    conflicts = []
+    available = open_shifts.sum(axis=0)
+    for d, s in zip(*np.nonzero(available < required)):
+        conflicts.append({
+            'type': 'shift_coverage', 'date': days_iso[d], 'shift': SHIFTS[s],
+            'required': int(required[s]), 'available': int(available[d, s]),
+            'constraints': blocking_refs(slice(d, d + 1), [s]),
+        })
+
+    # A morning shift cannot be combined with another shift on the same day, so M+A and M+N need distinct nurses.
+    short_days = {conflict['date'] for conflict in conflicts}
+    for shift_pair in ([morning_col, afternoon_col], [morning_col, night_col]):
+        able_nurses = open_shifts[:, :, shift_pair].any(axis=2).sum(axis=0)
+        needed = int(required[shift_pair].sum())
+        for d in np.nonzero(able_nurses < needed)[0]:
+            if days_iso[d] in short_days:
+                continue
+            short_days.add(days_iso[d])
+            conflicts.append({
+                'type': 'day_coverage', 'date': days_iso[d], 'shifts': [SHIFTS[s] for s in shift_pair],
+                'required': needed, 'available': int(able_nurses[d]),
+                'constraints': blocking_refs(slice(d, d + 1), shift_pair),
+            })
+
+    if MAX_CONSECUTIVE_OFF_DAYS > 0 and num_days > MAX_CONSECUTIVE_OFF_DAYS:
+        window = MAX_CONSECUTIVE_OFF_DAYS + 1
+        off_counts = np.cumsum(np.pad(forced_off, ((0, 0), (1, 0))), axis=1)
+        window_off = off_counts[:, window:] - off_counts[:, :-window]
+        for n in np.nonzero((window_off == window).any(axis=1))[0]:
+            d_start = int(np.argmax(window_off[n] == window))
+            conflicts.append({
+                'type': 'consecutive_days_off', 'nurseId': nurse_ids[n], 'dates': days_iso[d_start:d_start + window],
+                'limit': MAX_CONSECUTIVE_OFF_DAYS,
+                'constraints': blocking_refs(slice(d_start, d_start + window), slice(None), nurse=n),
+            })
+
+    total_demand = int(required.sum()) * num_days
+    # Only N+A can be worked on the same day.
+    day_capacity = np.where(open_shifts[:, :, afternoon_col] & open_shifts[:, :, night_col], 2, open_shifts.any(axis=2).astype(int))
+    nurse_capacity = np.minimum(day_capacity.sum(axis=1), max_shifts_between_days_off(num_days, max_consecutive_shifts))
+    if nurse_capacity.sum() < total_demand:
+        conflicts.append({
+            'type': 'total_capacity', 'required': total_demand, 'available': int(nurse_capacity.sum()),
+            'constraints': [ref for _, _, ref in blockers],
+        })
+
+    min_working_days = num_days // (MAX_CONSECUTIVE_OFF_DAYS + 1) if MAX_CONSECUTIVE_OFF_DAYS > 0 else 0
+    if num_nurses * min_working_days > total_demand:
+        conflicts.append({
+            'type': 'minimum_work', 'required': num_nurses * min_working_days, 'available': total_demand,
+            'limit': MAX_CONSECUTIVE_OFF_DAYS, 'constraints': [],
+        })
+
+    warnings = []
+    target_off_days = schedule_request['target_off_days']
+    capacity_at_target = np.minimum(nurse_capacity, 2 * max(num_days - target_off_days, 0)).sum()
+    if not conflicts and capacity_at_target < total_demand:
+        warnings.append({
+            'type': 'target_off_days', 'targetOffDays': target_off_days,
+            'required': total_demand, 'available': int(capacity_at_target),
+        })
+    return conflicts[:MAX_REPORTED_CONFLICTS], warnings
+
+
+def describe_conflict(conflict):
+    conflict_type = conflict['type']
+    if conflict_type == 'shift_coverage':
+        return f"วันที่ {conflict['date']} เวร{SHIFT_NAMES_TH[conflict['shift']]} ต้องการ {conflict['required']} คน แต่มีพยาบาลที่เข้าเวรได้เพียง {conflict['available']} คน"
+    if conflict_type == 'day_coverage':
+        shift_names = '+'.join(SHIFT_NAMES_TH[s] for s in conflict['shifts'])
+        return f"วันที่ {conflict['date']} เวร {shift_names} ต้องใช้พยาบาลต่างคนกัน {conflict['required']} คน แต่มีพยาบาลที่เข้าเวรได้เพียง {conflict['available']} คน"
+    if conflict_type == 'consecutive_days_off':
+        return f"พยาบาล {conflict['nurseId']} ถูกบังคับให้หยุด {conflict['dates'][0]} ถึง {conflict['dates'][-1]} ซึ่งเกินวันหยุดติดต่อกันสูงสุด {conflict['limit']} วัน"
+    if conflict_type == 'total_capacity':
+        return f"ความต้องการรวม {conflict['required']} เวร มากกว่าจำนวนเวรสูงสุดที่พยาบาลทุกคนรับได้ ({conflict['available']} เวร)"
+    if conflict_type == 'minimum_work':
+        return f"พยาบาลต้องทำงานรวมอย่างน้อย {conflict['required']} เวร (หยุดติดต่อกันได้ไม่เกิน {conflict['limit']} วัน) แต่ความต้องการรวมมีเพียง {conflict['available']} เวร"
+    constraint_names = ', '.join(f"{ref['nurseId']}: {ref['type']}" for ref in conflict['constraints'])
+    return f"ข้อจำกัดแบบ Hard ที่ขัดแย้งกัน: {constraint_names or 'ข้อจำกัดของตารางเวร (ไม่ใช่ข้อจำกัดส่วนบุคคล)'}"
+
+
+def get_model_template_key(schedule_request):
+    # Everything build_model_template() depends on: the ward shape, the demand and the limits, not the calendar.
+    return (
+        len(schedule_request['nurse_ids']), len(schedule_request['days']),
+        tuple(schedule_request['required_nurses_by_shift'].get(s, 0) for s in SHIFTS),
+        schedule_request['max_consecutive_shifts_worked'],
+        schedule_request['objective_weights']['nightToMorningTransition'] > 0,
+    )
+
+
+def build_model_template(num_nurses, num_days, required_nurses_by_shift, MAX_CONSECUTIVE_SHIFTS_WORKED, with_nm_transitions, stage_timer):
+    # The part of the model every request of the same shape shares: shift and off-day literals, day structure,
+    # coverage, transitions, consecutive-shift counters (except the day-0 carry-over from the previous month)
+    # and the sliding windows. Returns the finished proto plus the indices build_model() needs to continue it.
+    nurse_indices = range(num_nurses)
+    day_indices = range(num_days)
+    model = cp_model.CpModel()
+
+    shifts = {}
+    for n in nurse_indices:
+        for d in day_indices:
+            for s_val in SHIFTS:
+                shifts[(n, d, s_val)] = model.NewBoolVar(f'shift_n{n}_d{d}_s{s_val}')
+
+    shared_literals = SharedLiterals(model)
+    stage_timer.lap('build.variables')
+
+    def na_double(n, d):
+        return shared_literals.all_of([shifts[(n, d, SHIFT_NIGHT)], shifts[(n, d, SHIFT_AFTERNOON)]], f'na_double_n{n}_d{d}')
+
+
+    is_off = {}
+    is_working = {}
+    num_shifts_on_day = {}
+    for n in nurse_indices:
+        for d in day_indices:
+            day_shifts = [shifts[(n, d, s)] for s in SHIFTS]
+            is_off[(n, d)] = model.NewBoolVar(f'is_off_n{n}_d{d}')
+            is_working[(n, d)] = is_off[(n, d)].Not()
+            num_shifts_on_day[n, d] = sum(day_shifts)
+            model.AddBoolOr(day_shifts + [is_off[(n, d)]])
+            model.AddBoolAnd([shift_var.Not() for shift_var in day_shifts]).OnlyEnforceIf(is_off[(n, d)])
+
+    for n in nurse_indices:
+         for d in day_indices:
+             model.Add(shifts[(n, d, SHIFT_MORNING)] + shifts[(n, d, SHIFT_AFTERNOON)] <= 1)
+             model.Add(shifts[(n, d, SHIFT_MORNING)] + shifts[(n, d, SHIFT_NIGHT)] <= 1)
+    stage_timer.lap('build.day_structure')
+
+    for d in day_indices:
+        for s in SHIFTS:
+            model.Add(sum(shifts[(n, d, s)] for n in nurse_indices) == required_nurses_by_shift.get(s, 0))
+    stage_timer.lap('build.coverage')
+
+    nm_transition_penalties = []
+
+    for n in nurse_indices:
+        if num_days > 1:
+            for d in range(num_days - 1):
+                # A(d)->N(d+1) being forbidden also covers N+A(d)->N(d+1).
+                model.Add(shifts[(n, d, SHIFT_AFTERNOON)] + shifts[(n, d + 1, SHIFT_NIGHT)] <= 1)
+
+                if with_nm_transitions:
+                    nm_transition_penalties.append(shared_literals.all_of(
+                        [na_double(n, d), shifts[(n, d + 1, SHIFT_MORNING)]], f'na_to_m_n{n}_d{d}'
+                    ))
+    stage_timer.lap('build.transitions')
+
+    consecutive_shift_count_ending_day = None
+    if MAX_CONSECUTIVE_SHIFTS_WORKED > 0:
+        logger.debug("Applying Max Consecutive SHIFTS Constraint: <= %d shifts", MAX_CONSECUTIVE_SHIFTS_WORKED)
+        consecutive_shift_count_ending_day = {}
+        for n in nurse_indices:
+             for d in day_indices:
+                  consecutive_shift_count_ending_day[n, d] = model.NewIntVar(0, MAX_CONSECUTIVE_SHIFTS_WORKED, f'consec_shifts_n{n}_d{d}')
+
+        for n in nurse_indices:
+            model.Add(consecutive_shift_count_ending_day[n, 0] == 0).OnlyEnforceIf(is_off[n, 0])
+
+            if num_days > 1:
+                for d in range(1, num_days):
+                    model.Add(consecutive_shift_count_ending_day[n, d] == 0).OnlyEnforceIf(is_off[n, d])
+
+                    model.Add(consecutive_shift_count_ending_day[n, d] == num_shifts_on_day[n, d]).OnlyEnforceIf(is_working[n, d]).OnlyEnforceIf(is_off[n, d-1])
+
+                    model.Add(consecutive_shift_count_ending_day[n, d] == consecutive_shift_count_ending_day[n, d-1] + num_shifts_on_day[n, d]).OnlyEnforceIf(is_working[n, d]).OnlyEnforceIf(is_working[n, d-1])
+
+
+    else:
+         logger.debug("Max Consecutive SHIFTS constraint disabled (limit <= 0).")
+    stage_timer.lap('build.consecutive_shifts')
+
+    if MAX_CONSECUTIVE_SAME_SHIFT > 0:
+        for n in nurse_indices:
+            for s in SHIFTS:
+                if num_days > MAX_CONSECUTIVE_SAME_SHIFT:
+                    for d_start in range(num_days - MAX_CONSECUTIVE_SAME_SHIFT):
+                         model.Add(sum(shifts[(n, d_start + k, s)] for k in range(MAX_CONSECUTIVE_SAME_SHIFT + 1)) <= MAX_CONSECUTIVE_SAME_SHIFT)
+    stage_timer.lap('build.consecutive_same_shift')
+
+    if MAX_CONSECUTIVE_OFF_DAYS > 0:
+        for n in nurse_indices:
+            if num_days > MAX_CONSECUTIVE_OFF_DAYS:
+                for d_start in range(num_days - MAX_CONSECUTIVE_OFF_DAYS):
+                    model.Add(sum(is_off[(n, d_start + k)] for k in range(MAX_CONSECUTIVE_OFF_DAYS + 1)) <= MAX_CONSECUTIVE_OFF_DAYS)
+    stage_timer.lap('build.consecutive_off_days')
+
+    if num_days >= WINDOW_SIZE_FOR_MIN_OFF and MIN_OFF_DAYS_IN_WINDOW > 0:
+        logger.debug("Applying Min Off Days Constraint: >= %d in every %d days", MIN_OFF_DAYS_IN_WINDOW, WINDOW_SIZE_FOR_MIN_OFF)
+        for n in nurse_indices:
+            for d_start in range(num_days - WINDOW_SIZE_FOR_MIN_OFF + 1):
+                window_off_days = [is_off[(n, d_start + k)] for k in range(WINDOW_SIZE_FOR_MIN_OFF)]
+                model.Add(sum(window_off_days) >= MIN_OFF_DAYS_IN_WINDOW)
+    stage_timer.lap('build.min_off_window')
+
+    return {
+        'proto': model.Proto(),
+        'shifts': np.array([[[shifts[(n, d, s)].Index() for s in SHIFTS] for d in day_indices] for n in nurse_indices],
+                           dtype=np.int64).reshape(num_nurses, num_days, len(SHIFTS)),
+        'is_off': np.array([[is_off[(n, d)].Index() for d in day_indices] for n in nurse_indices], dtype=np.int64).reshape(num_nurses, num_days),
+        'consecutive': None if consecutive_shift_count_ending_day is None else np.array(
+            [[consecutive_shift_count_ending_day[n, d].Index() for d in day_indices] for n in nurse_indices], dtype=np.int64).reshape(num_nurses, num_days),
+        'and_literals': shared_literals.index_map(),
+        'nm_transitions': [literal.Index() for literal in nm_transition_penalties],
+    }
+
+
+def instantiate_model_template(template):
+    # A fresh CpModel holding a copy of the template proto, with Python handles for the variables build_model() uses.
+    model = cp_model.CpModel()
+    model.Proto().CopyFrom(template['proto'])
+    bool_var = np.vectorize(model.GetBoolVarFromProtoIndex, otypes=[object])
+    shift_vars = bool_var(template['shifts'])
+    off_vars = bool_var(template['is_off'])
+    consecutive_vars = None
+    if template['consecutive'] is not None:
+        consecutive_vars = np.vectorize(model.GetIntVarFromProtoIndex, otypes=[object])(template['consecutive'])
+    shared_literals = SharedLiterals(model, template['and_literals'])
+    nm_transition_penalties = [model.GetBoolVarFromProtoIndex(index) for index in template['nm_transitions']]
+    return model, shift_vars, off_vars, consecutive_vars, shared_literals, nm_transition_penalties
+
+
+class ModelTemplateCache:
+    # LRU of built model templates per process, keyed by get_model_template_key(). Templates are never changed after
+    # they are built, so solves running at the same time can copy the same one.
+    def __init__(self, max_entries=MODEL_TEMPLATE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build_template):
+        # Returns (template, hit). Two misses for the same key may both build; the later one is kept.
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template, True
+        template = build_template()
+        if self.max_entries > 0:
+            with self._lock:
+                self._templates[key] = template
+                self._templates.move_to_end(key)
+                while len(self._templates) > self.max_entries:
+                    self._templates.popitem(last=False)
+        return template, False
+
+
+model_templates = ModelTemplateCache()
+
+
+def build_model(schedule_request):
+    nurses_data = schedule_request['nurses']
+    days = schedule_request['days']
+    required_nurses_by_shift = schedule_request['required_nurses_by_shift']
+    MAX_CONSECUTIVE_SHIFTS_WORKED = schedule_request['max_consecutive_shifts_worked']
+    TARGET_OFF_DAYS = schedule_request['target_off_days']
+    KEEP_CLOSE_TO_HINT = schedule_request['keep_close_to_hint']
+    HINT_DEVIATION_PENALTY = schedule_request['hint_deviation_penalty']
+    previous_states = schedule_request['previous_states']
+    hint_assignments = schedule_request['hint_assignments']
+    hint_objective = schedule_request['hint_objective']
+    weights = schedule_request['objective_weights']
+    stage_timer = schedule_request['stage_timer']
+    stage_timer.start_laps()
+
+    num_nurses = len(nurses_data)
+    num_days = len(days)
+    nurse_indices = range(num_nurses)
+    day_indices = range(num_days)
+    nurse_id_map = dict(enumerate(schedule_request['nurse_ids']))
+    nurse_constraints = {
+        nurses_data[n]['id']: nurses_data[n].get('constraints', []) for n in nurse_indices
+    }
+
+    template_key = get_model_template_key(schedule_request)
+    template, template_hit = model_templates.get_or_build(
+        template_key, lambda: build_model_template(num_nurses, num_days, required_nurses_by_shift, MAX_CONSECUTIVE_SHIFTS_WORKED,
+                                                   weights['nightToMorningTransition'] > 0, stage_timer))
+    model, shift_vars, off_vars, consecutive_vars, shared_literals, nm_transition_penalties = instantiate_model_template(template)
+    working_vars = np.vectorize(lambda off_var: off_var.Not(), otypes=[object])(off_vars)
+    shifts = {(n, d, s_val): shift_vars[n, d, s_val - 1] for n in nurse_indices for d in day_indices for s_val in SHIFTS}
+    is_off = {(n, d): off_vars[n, d] for n in nurse_indices for d in day_indices}
+    logger.debug("Model template %s (%d nurses, %d days)", 'reused' if template_hit else 'built', num_nurses, num_days)
+    stage_timer.lap('build.template')
+
+    if hint_assignments:
+        for key, hinted_value in hint_assignments.items():
+            model.AddHint(shifts[key], hinted_value)
+        hinted_nurse_count = len({n for (n, d, s) in hint_assignments})
+        logger.info("Warm-starting from hint schedule: %d shift assignments for %d nurses (Keep close: %s)", len(hint_assignments), hinted_nurse_count, KEEP_CLOSE_TO_HINT)
+
+    def na_double(n, d):
+        return shared_literals.all_of([shifts[(n, d, SHIFT_NIGHT)], shifts[(n, d, SHIFT_AFTERNOON)]], f'na_double_n{n}_d{d}')
+
+    # The previous month only touches day 0; everything after it comes from the template.
+    for n in nurse_indices:
+        prev_state = previous_states.get(n, {'last_day_shifts': [], 'consecutive_shifts': 0, 'was_off_last_day': True})
+        last_day_prev_shifts = prev_state['last_day_shifts']
+
+        # A(-1)->N(0) being forbidden also covers N+A(-1)->N(0).
+        if SHIFT_AFTERNOON in last_day_prev_shifts:
+             logger.debug("Applying A(-1)->N(0) forbidden for nurse %s", nurse_id_map[n])
+             model.Add(shifts[(n, 0, SHIFT_NIGHT)] == 0)
+
+        if SHIFT_NIGHT in last_day_prev_shifts and SHIFT_AFTERNOON in last_day_prev_shifts and weights['nightToMorningTransition'] > 0:
+             logger.debug("Adding potential N+A(-1)->M(0) penalty for nurse %s", nurse_id_map[n])
+             nm_transition_penalties.append(shifts[(n, 0, SHIFT_MORNING)])
+
+        if consecutive_vars is not None:
+            prev_consecutive_shifts = 0 if prev_state['was_off_last_day'] else prev_state['consecutive_shifts']
+            model.Add(consecutive_vars[n, 0] == prev_consecutive_shifts + sum(shift_vars[n, 0])).OnlyEnforceIf(working_vars[n, 0])
+    stage_timer.lap('build.previous_month')
+
+    # Every hard personal constraint is enforced through its own literal so an infeasible model can be
+    # re-solved with those literals as assumptions to find out which of them conflict.
+    hard_constraint_assumptions = []
+
+    def hard_constraint_literal(n, constraint_index, constraint_type):
+        literal = model.NewBoolVar(f'hard_n{n}_c{constraint_index}_{constraint_type}')
+        hard_constraint_assumptions.append((literal, {'nurseId': nurse_id_map[n], 'constraintIndex': constraint_index, 'type': constraint_type}))
+        return literal
+
+    context = PersonalConstraintContext(model, shift_vars, off_vars, working_vars, get_day_calendar(days),
+                                        {str(nurse_id): n for n, nurse_id in nurse_id_map.items()}, na_double)
+
+    # Identical constraints (type, strength, value) of different nurses are applied as one batch.
+    constraint_batches = {}
+    for n in nurse_indices:
+        nurse_id = nurse_id_map[n]
+        for constraint_index, constraint in enumerate(nurse_constraints.get(nurse_id, []) or []):
+            constraint_type = constraint.get('type')
+            if not constraint_type:
+                logger.warning("Skipping constraint %d for nurse %s due to missing type.", constraint_index, nurse_id)
+                continue
+            value_key = json.dumps(constraint.get('value'), sort_keys=True, default=str)
+            batch_key = (constraint_type, constraint.get('strength', 'hard'), value_key)
+            if batch_key not in constraint_batches:
+                constraint_batches[batch_key] = (constraint.get('value'), [])
+            constraint_batches[batch_key][1].append((n, constraint_index))
+
+    applied_hard_constraints_count = 0
+    applied_soft_constraints_count = 0
+    soft_constraint_violation_terms = []
+
+    for (constraint_type, constraint_strength, _), (constraint_value, members) in constraint_batches.items():
+        handler = PERSONAL_CONSTRAINT_TYPES.get(constraint_type)
+        if handler is None:
+            for n, constraint_index in members:
+                logger.warning("Unknown constraint type '%s' encountered for nurse %s (Constraint Index: %d). Skipping.", constraint_type, nurse_id_map[n], constraint_index)
+            continue
+        if constraint_strength not in ('hard', 'soft'):
+            logger.warning("Unknown strength '%s' for %s", constraint_strength, constraint_type)
+            continue
+        try:
+            value = handler.parse_value(constraint_value)
+            if constraint_strength == 'hard':
+                handler.add_hard(context, [(n, hard_constraint_literal(n, constraint_index, constraint_type)) for n, constraint_index in members], value)
+                applied_hard_constraints_count += len(members)
+            else:
+                soft_constraint_violation_terms.extend(handler.soft_terms(context, [n for n, _ in members], value))
+                applied_soft_constraints_count += len(members)
+        except (ValueError, TypeError) as value_err:
+            for n, constraint_index in members:
+                logger.warning("Invalid '%s' value '%s' for nurse %s. Skipping constraint %d. Error: %s", constraint_type, constraint_value, nurse_id_map[n], constraint_index, value_err)
+        except Exception as constraint_err:
+            logger.exception("Error applying constraint type %s (Strength: %s) for %d nurses: %s", constraint_type, constraint_strength, len(members), constraint_err)
+
+    logger.debug("Applied %d hard & %d soft individual constraints.", applied_hard_constraints_count, applied_soft_constraints_count)
+    # Fixed to true for the real solve so presolve removes them again; explain_infeasibility() frees them.
+    for literal, _ in hard_constraint_assumptions:
+        model.Proto().variables[literal.Index()].domain[:] = [1, 1]
+    stage_timer.lap('build.personal_constraints')
+
+    objective_terms = []
+    # The same terms grouped by OBJECTIVE_STAGES, for lexicographic solves.
+    stage_terms = {stage: [] for stage in OBJECTIVE_STAGES}
+
+    def add_objective_term(stage, term):
+        objective_terms.append(term)
+        stage_terms[stage].append(term)
+
+    if soft_constraint_violation_terms and weights['softConstraintViolation'] > 0:
+          add_objective_term('softConstraints', weights['softConstraintViolation'] * sum(soft_constraint_violation_terms))
+          logger.debug("Added penalty for %d potential soft constraint violations (Weight per violation: %d)", len(soft_constraint_violation_terms), weights['softConstraintViolation'])
+
+    total_bounds = get_nurse_total_bounds(schedule_request)
+    # The bounds are used as variable domains only. Redundant sums on top of them (per-type and overall totals
+    # equal to demand, working days linked to total shifts, floor/ceil-of-average bounds on the fairness ranges)
+    # were tried and rejected: with a single search worker they stalled the first-solution search, and three of
+    # four 30-nurse, 31-day wards ended UNKNOWN at 15s. Do not add them back without re-measuring that case.
+    # lo > hi only happens for requests the pre-check rejects; the clamp keeps such a model valid (and infeasible).
+    def bounded_domain(bounds):
+        return min(bounds[0], bounds[1]), bounds[1]
+    off_days_domain = bounded_domain(total_bounds['off_days'])
+    total_shifts_domain = bounded_domain(total_bounds['total'])
+    shift_type_domains = {s: bounded_domain(total_bounds['shift_type'][s]) for s in SHIFTS}
+    logger.debug("Per-nurse total bounds: off days %s, shifts %s, M/A/N %s", off_days_domain, total_shifts_domain, shift_type_domains)
+
+    total_off_days_per_nurse = [model.NewIntVar(*off_days_domain, f'total_off_n{n}') for n in nurse_indices]
+    total_shifts_per_nurse = [model.NewIntVar(*total_shifts_domain, f'total_shifts_n{n}') for n in nurse_indices]
+    total_morning_shifts = [model.NewIntVar(*shift_type_domains[SHIFT_MORNING], f'total_M_n{n}') for n in nurse_indices]
+    total_afternoon_shifts = [model.NewIntVar(*shift_type_domains[SHIFT_AFTERNOON], f'total_A_n{n}') for n in nurse_indices]
+    total_night_shifts = [model.NewIntVar(*shift_type_domains[SHIFT_NIGHT], f'total_N_n{n}') for n in nurse_indices]
+
+    for n in nurse_indices:
+        model.Add(total_off_days_per_nurse[n] == sum(is_off[(n, d)] for d in day_indices))
+        model.Add(total_morning_shifts[n] == sum(shifts[(n, d, SHIFT_MORNING)] for d in day_indices))
+        model.Add(total_afternoon_shifts[n] == sum(shifts[(n, d, SHIFT_AFTERNOON)] for d in day_indices))
+        model.Add(total_night_shifts[n] == sum(shifts[(n, d, SHIFT_NIGHT)] for d in day_indices))
+        model.Add(total_shifts_per_nurse[n] == total_morning_shifts[n] + total_afternoon_shifts[n] + total_night_shifts[n])
+
+    def add_range_vars(name, totals, domain):
+        # min/max of the per-nurse totals.
+        min_var = model.NewIntVar(*domain, f'min_{name}')
+        max_var = model.NewIntVar(*domain, f'max_{name}')
+        model.AddMinEquality(min_var, totals)
+        model.AddMaxEquality(max_var, totals)
+        return min_var, max_var
+
+    symmetry_classes = get_interchangeable_nurse_classes(schedule_request) if schedule_request['symmetry_breaking'] else []
+    if symmetry_classes:
+        # Within a class, total shifts are non-increasing and ties are ordered by the first days' shifts read as a
+        # binary number. Any solution can be permuted into this order, so no penalty value is lost.
+        prefix_vars = shift_vars[:, :min(SYMMETRY_PREFIX_DAYS, num_days)].reshape(num_nurses, -1)
+        prefix_weights = [1 << bit for bit in reversed(range(prefix_vars.shape[1]))]
+        for members in symmetry_classes:
+            for a, b in zip(members, members[1:]):
+                same_total = model.NewBoolVar(f'same_total_n{a}_n{b}')
+                model.Add(total_shifts_per_nurse[a] == total_shifts_per_nurse[b]).OnlyEnforceIf(same_total)
+                model.Add(total_shifts_per_nurse[a] > total_shifts_per_nurse[b]).OnlyEnforceIf(same_total.Not())
+                model.Add(sum(w * v for w, v in zip(prefix_weights, prefix_vars[a])) >= sum(w * v for w, v in zip(prefix_weights, prefix_vars[b]))).OnlyEnforceIf(same_total)
+        logger.info("Symmetry breaking: %d classes of interchangeable nurses (sizes %s)", len(symmetry_classes), [len(members) for members in symmetry_classes])
+    stage_timer.lap('build.symmetry_breaking')
+
+
+    if TARGET_OFF_DAYS >= 0 and weights['offDayUnderTarget'] > 0:
+        off_days_under_target_vars = []
+        for n in nurse_indices:
+            under_var = model.NewIntVar(0, num_days, f'off_under_target_n{n}')
+            model.Add(under_var >= TARGET_OFF_DAYS - total_off_days_per_nurse[n])
+            off_days_under_target_vars.append(under_var)
+        add_objective_term('offDayShortfall', weights['offDayUnderTarget'] * sum(off_days_under_target_vars))
+        logger.debug("Added penalty for total days UNDER user target %d (Weight: %d)", TARGET_OFF_DAYS, weights['offDayUnderTarget'])
+
+    if num_nurses > 1 and weights['offDayImbalance'] > 0:
+        min_off_days, max_off_days = add_range_vars('off_days', total_off_days_per_nurse, off_days_domain)
+        add_objective_term('fairness', weights['offDayImbalance'] * (max_off_days - min_off_days))
+        logger.debug("Added penalty for Off-Day imbalance (Range) (Weight: %d)", weights['offDayImbalance'])
+
+    if num_nurses > 1 and weights['shiftTypeImbalance'] > 0:
+        min_M_shifts, max_M_shifts = add_range_vars('M_shifts', total_morning_shifts, shift_type_domains[SHIFT_MORNING])
+        add_objective_term('fairness', weights['shiftTypeImbalance'] * (max_M_shifts - min_M_shifts))
+
+        min_A_shifts, max_A_shifts = add_range_vars('A_shifts', total_afternoon_shifts, shift_type_domains[SHIFT_AFTERNOON])
+        add_objective_term('fairness', weights['shiftTypeImbalance'] * (max_A_shifts - min_A_shifts))
+
+        min_N_shifts, max_N_shifts = add_range_vars('N_shifts', total_night_shifts, shift_type_domains[SHIFT_NIGHT])
+        add_objective_term('fairness', weights['shiftTypeImbalance'] * (max_N_shifts - min_N_shifts))
+        logger.debug("Added penalty for M/A/N Shift Type imbalance (Weight per type: %d)", weights['shiftTypeImbalance'])
+
+    if num_nurses > 1 and weights['totalShiftImbalance'] > 0:
+        min_total_shifts, max_total_shifts = add_range_vars('total_shifts', total_shifts_per_nurse, total_shifts_domain)
+        add_objective_term('fairness', weights['totalShiftImbalance'] * (max_total_shifts - min_total_shifts))
+        logger.debug("Added penalty for Total Shift imbalance (Range) (Weight: %d)", weights['totalShiftImbalance'])
+
+    if weights['nightAfternoonDouble'] > 0:
+        all_na_double_terms = [na_double(n, d) for n in nurse_indices for d in day_indices]
+        if all_na_double_terms:
+            add_objective_term('fairness', weights['nightAfternoonDouble'] * sum(all_na_double_terms))
+            logger.debug("Added penalty for each N+A (ดึกควบบ่าย) double shift occurrence (Weight: %d)", weights['nightAfternoonDouble'])
+
+    if nm_transition_penalties and weights['nightToMorningTransition'] > 0:
+        add_objective_term('fairness', weights['nightToMorningTransition'] * sum(nm_transition_penalties))
+        logger.debug("Added penalty for each N+A(d) -> M(d+1) transition (Weight: %d, Count: %d)", weights['nightToMorningTransition'], len(nm_transition_penalties))
+
+
+    if hint_objective is not None:
+        hint_deviation_terms = [
+            (1 - shifts[key]) if hinted_value else shifts[key]
+            for key, hinted_value in hint_assignments.items()
+        ]
+        add_objective_term('fairness', HINT_DEVIATION_PENALTY * sum(hint_deviation_terms))
+        logger.debug("Added penalty for each assignment changed from the hint schedule (Weight: %d, Hinted: %d)", HINT_DEVIATION_PENALTY, len(hint_deviation_terms))
+
+    if objective_terms:
+        model.Minimize(sum(objective_terms))
+        logger.debug("Objective function set to minimize penalties.")
+    else:
+        logger.debug("No penalties defined, seeking any feasible solution.")
+
+    # One variable per non-empty stage; the weighted objective above stays on the model for solve() callers.
+    objective_stages = []
+    if schedule_request['objective_mode'] == OBJECTIVE_MODE_LEXICOGRAPHIC:
+        for stage in OBJECTIVE_STAGES:
+            if stage_terms[stage]:
+                stage_var = model.NewIntVar(0, OBJECTIVE_STAGE_UPPER_BOUND, f'objective_{stage}')
+                model.Add(stage_var == sum(stage_terms[stage]))
+                objective_stages.append((stage, stage_var.Index()))
+        logger.debug("Lexicographic objective stages: %s", [stage for stage, _ in objective_stages])
+
+    var_index = {
+        'shifts': np.array(
+            [[[shifts[(n, d, s)].Index() for s in SHIFTS] for d in day_indices] for n in nurse_indices],
+            dtype=np.int64
+        ).reshape(num_nurses, num_days, len(SHIFTS)),
+        'has_objective': bool(objective_terms),
+        'objective_stages': objective_stages,
+        'symmetry_classes': [len(members) for members in symmetry_classes],
+        'assumptions': {literal.Index(): constraint_ref for literal, constraint_ref in hard_constraint_assumptions},
+    }
+    stage_timer.lap('build.objective')
+    return model, var_index
+
+
+def extract_shift_assignments(var_index, solution):
+    # Reads every shift literal at once from the solver's solution vector: array of shape (nurses, days, 3).
+    return np.asarray(solution, dtype=np.int64)[var_index['shifts']].astype(np.int8)
+
+
+def fix_shift_assignments(model, var_index, assignments, fixed_mask):
+    # Pins the shift literals where fixed_mask (nurses, days, 3) is set to assignments and frees all the others,
+    # by rewriting their domains; the same model can be re-fixed for another neighbourhood.
+    proto_variables = model.Proto().variables
+    for index, value, fixed in zip(var_index['shifts'].ravel().tolist(), np.asarray(assignments).ravel().tolist(), np.asarray(fixed_mask).ravel().tolist()):
+        proto_variables[index].domain[:] = [value, value] if fixed else [0, 1]
+
+
+def set_solution_hint(model, var_index, assignments):
+    # Replaces the model's hint with a complete shift assignment (nurses, days, 3), e.g. a schedule found earlier.
+    model.ClearHints()
+    model.Proto().solution_hint.vars.extend(var_index['shifts'].ravel().tolist())
+    model.Proto().solution_hint.values.extend(np.asarray(assignments, dtype=np.int64).ravel().tolist())
+
+
+def set_complete_solution_hint(model, var_index, assignments, num_workers=DEFAULT_NUM_SOLVER_WORKERS, should_stop=None,
+                               time_limit=WARM_START_COMPLETION_TIME_LIMIT):
+    # A hint of the shift literals alone leaves the counters, ranges and symmetry literals open, and on a large
+    # ward CP-SAT often cannot complete it and searches from scratch. Solving once with every shift pinned fills
+    # in the rest in a fraction of a second; that full solution vector becomes the hint. If the pinned model has
+    # no solution, only the shift literals are hinted. Returns True if the hint is complete.
+    fix_shift_assignments(model, var_index, assignments, np.ones(var_index['shifts'].shape, dtype=bool))
+    outcome = solve(model, var_index, time_limit, num_workers=num_workers, log_search_progress=False, should_stop=should_stop)
+    fix_shift_assignments(model, var_index, assignments, np.zeros(var_index['shifts'].shape, dtype=bool))
+    if outcome['status'] not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        logger.info("Warm start could not be completed (%s), hinting the shifts only", outcome['status_name'])
+        set_solution_hint(model, var_index, assignments)
+        return False
+    model.ClearHints()
+    model.Proto().solution_hint.vars.extend(range(len(outcome['solution'])))
+    model.Proto().solution_hint.values.extend(outcome['solution'].tolist())
+    logger.info("Warm start completed to a full hint (penalty %s)", outcome['objective_value'])
+    return True
+
+
+def build_schedule_result(schedule_request, var_index, solution):
+    # solution is the full CP-SAT solution vector (values indexed by variable proto index).
+    return build_assignments_result(schedule_request, extract_shift_assignments(var_index, solution))
+
+
+def build_assignments_result(schedule_request, assignments):
+    # The schedule result of a shift assignment (nurses, days, 3), however it was found.
+    nurses_data = schedule_request['nurses']
+    nurse_ids = schedule_request['nurse_ids']
+    days_iso = [day.isoformat() for day in schedule_request['days']]
+
+    shift_totals = assignments.sum(axis=1)
+    morning_counts = shift_totals[:, SHIFT_MORNING - 1]
+    afternoon_counts = shift_totals[:, SHIFT_AFTERNOON - 1]
+    night_counts = shift_totals[:, SHIFT_NIGHT - 1]
+    total_shift_counts = shift_totals.sum(axis=1)
+    day_masks = assignments @ SHIFT_BITS
+    off_day_counts = (day_masks == 0).sum(axis=1)
+    na_double_counts = (assignments[:, :, SHIFT_NIGHT - 1] & assignments[:, :, SHIFT_AFTERNOON - 1]).sum(axis=1)
+
+    nurse_schedules = {}
+    shifts_count = {}
+    for n, (nurse_id, nurse_masks) in enumerate(zip(nurse_ids, day_masks.tolist())):
+        nurse_schedules[nurse_id] = {
+            "nurse": nurses_data[n],
+            "shifts": dict(zip(days_iso, [SHIFT_LISTS_BY_MASK[mask] for mask in nurse_masks]))
+        }
+
+    for nurse_id, m_count, a_count, n_count, total_count, na_count, off_count in zip(
+            nurse_ids, morning_counts.tolist(), afternoon_counts.tolist(), night_counts.tolist(),
+            total_shift_counts.tolist(), na_double_counts.tolist(), off_day_counts.tolist()):
+        shifts_count[nurse_id] = {
+             "morning": m_count,
+             "afternoon": a_count,
+             "night": n_count,
+             "total": total_count,
+             "nightAfternoonDouble": na_count,
+             "daysOff": off_count
+        }
+
+    fairness_report = {
+        "offDaysMin": int(off_day_counts.min()),
+        "offDaysMax": int(off_day_counts.max()),
+        "totalShiftsMin": int(total_shift_counts.min()),
+        "totalShiftsMax": int(total_shift_counts.max()),
+        "morningMin": int(morning_counts.min()),
+        "morningMax": int(morning_counts.max()),
+        "afternoonMin": int(afternoon_counts.min()),
+        "afternoonMax": int(afternoon_counts.max()),
+        "nightMin": int(night_counts.min()),
+        "nightMax": int(night_counts.max()),
+        "totalNADoubles": int(na_double_counts.sum())
+    }
+
+    return {
+        "nurseSchedules": nurse_schedules,
+        "shiftsCount": shifts_count,
+        "days": days_iso,
+        "startDate": schedule_request['start_date'],
+        "endDate": schedule_request['end_date'],
+        "holidays": schedule_request['holidays'],
+        "fairnessReport": fairness_report
+    }
+
+
+def load_model_proto(model_proto_bytes):
+    model = cp_model.CpModel()
+    model.Proto().ParseFromString(model_proto_bytes)
+    return model
+
+
+class SolverLogReader:
+    # Receives the CP-SAT search log instead of stdout. The first "#Model" line is the presolved model, which
+    # marks the end of presolve; the log itself is only forwarded when the solver logger is at DEBUG.
+    def __init__(self):
+        self.presolve = None
+        self.forward = solver_logger.isEnabledFor(logging.DEBUG)
+
+    def __call__(self, line):
+        if self.presolve is None:
+            match = PRESOLVED_MODEL_PATTERN.match(line)
+            if match:
+                self.presolve = {
+                    'seconds': float(match.group(1)),
+                    'variables': int(match.group(2)),
+                    'constraints': int(match.group(3)),
+                }
+        if self.forward:
+            solver_logger.debug(line)
+
+
+def solve(model, var_index, time_limit, num_workers=DEFAULT_NUM_SOLVER_WORKERS, solution_callback=None, log_search_progress=True,
+          should_stop=None):
+    # model may be a CpModel or a serialized CpModelProto, so the solve can run in another process.
+    # should_stop() is polled during the search, which is stopped with the best solution so far once it returns True.
+    if isinstance(model, bytes):
+        model = load_model_proto(model)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.log_search_progress = log_search_progress
+    solver.parameters.num_workers = num_workers
+    log_reader = None
+    if log_search_progress:
+        log_reader = SolverLogReader()
+        solver.parameters.log_to_stdout = False
+        solver.log_callback = log_reader
+
+    logger.info("Starting solver (Time Limit: %ss, Workers: %d)", time_limit, num_workers)
+    solve_start_time = time.time()
+    with SearchStopper(solver, should_stop):
+        if solution_callback is not None:
+            status = solver.Solve(model, solution_callback)
+        else:
+            status = solver.Solve(model)
+    solve_end_time = time.time()
+    logger.info("Solver finished. Status: %s, Time: %.2fs", solver.StatusName(status), solve_end_time - solve_start_time)
+
+    outcome = {
+        'status': status,
+        'status_name': solver.StatusName(status),
+        'objective_value': 0,
+        'solution': [],
+        'solve_start_time': solve_start_time,
+        'solve_end_time': solve_end_time,
+        'presolve': log_reader.presolve if log_reader else None,
+    }
+    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+        outcome['objective_value'] = solver.ObjectiveValue() if var_index['has_objective'] else 0
+        outcome['solution'] = np.array(solver.ResponseProto().solution, dtype=np.int64)
+    return outcome
+
+
+def solve_lexicographic(model, var_index, time_limit, num_workers=DEFAULT_NUM_SOLVER_WORKERS, solution_callback=None, log_search_progress=True,
+                        should_stop=None):
+    # Minimizes var_index['objective_stages'] one after another on the same model, splitting what is left of
+    # time_limit evenly between the remaining stages. The value each stage reaches becomes an upper bound for the
+    # later ones and its full solution their hint. A later stage that finds nothing keeps the earlier solution.
+    # Returns the same outcome dict as solve(), with objective_value being the weighted total and a 'stages' list.
+    if isinstance(model, bytes):
+        model = load_model_proto(model)
+    stages = var_index['objective_stages']
+    if not stages:
+        return solve(model, var_index, time_limit, num_workers=num_workers, solution_callback=solution_callback,
+                     log_search_progress=log_search_progress, should_stop=should_stop)
+
+    started_at = time.time()
+    outcome = None
+    stage_reports = []
+    for stage_position, (stage, stage_var_index) in enumerate(stages):
+        remaining_seconds = time_limit - (time.time() - started_at)
+        if outcome is not None and remaining_seconds <= 0:
+            logger.info("Lexicographic solve: no time left for stage '%s', keeping the previous solution", stage)
+            break
+        if outcome is not None and should_stop is not None and should_stop():
+            logger.info("Lexicographic solve: cancelled before stage '%s', keeping the previous solution", stage)
+            break
+        model.ClearObjective()
+        model.Proto().objective.vars.append(stage_var_index)
+        model.Proto().objective.coeffs.append(1)
+        logger.info("Lexicographic solve: stage %d/%d '%s'", stage_position + 1, len(stages), stage)
+        if isinstance(solution_callback, ScheduleSolutionStreamer):
+            solution_callback.stage = stage
+        stage_outcome = solve(model, var_index, max(remaining_seconds / (len(stages) - stage_position), 0.1), num_workers=num_workers,
+                              solution_callback=solution_callback, log_search_progress=log_search_progress, should_stop=should_stop)
+        stage_reports.append({
+            'stage': stage,
+            'status': stage_outcome['status_name'],
+            'objective': stage_outcome['objective_value'],
+            'seconds': round(stage_outcome['solve_end_time'] - stage_outcome['solve_start_time'], 3),
+        })
+        if stage_outcome['status'] not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            if outcome is None:
+                outcome = stage_outcome
+            break
+        stage_value = int(round(stage_outcome['objective_value']))
+        model.Proto().variables[stage_var_index].domain[:] = [0, stage_value]
+        model.ClearHints()
+        model.Proto().solution_hint.vars.extend(range(len(stage_outcome['solution'])))
+        model.Proto().solution_hint.values.extend(stage_outcome['solution'].tolist())
+        if outcome is None:
+            stage_outcome['first_stage_start_time'] = stage_outcome['solve_start_time']
+        else:
+            stage_outcome['first_stage_start_time'] = outcome['first_stage_start_time']
+            stage_outcome['presolve'] = outcome['presolve']
+        outcome = stage_outcome
+
+    outcome['solve_start_time'] = outcome.pop('first_stage_start_time', outcome['solve_start_time'])
+    outcome['stages'] = stage_reports
+    if len(outcome['solution']):
+        outcome['objective_value'] = int(sum(outcome['solution'][index] for _, index in stages))
+        if not all(report['status'] == 'OPTIMAL' for report in stage_reports) or len(stage_reports) < len(stages):
+            outcome['status'] = cp_model.FEASIBLE
+            outcome['status_name'] = 'FEASIBLE'
+    return outcome
+
+
+def explain_infeasibility(model, var_index, time_limit=CONFLICT_EXPLANATION_TIME_LIMIT, num_workers=DEFAULT_NUM_SOLVER_WORKERS, should_stop=None):
+    # Re-solves an infeasible model as a pure feasibility problem with the hard personal constraints as assumptions,
+    # then drops constraints from the reported core while it stays infeasible. Returns the constraint refs of the
+    # smallest core found within time_limit; an empty list means the ward-wide rules conflict on their own.
+    assumption_refs = var_index['assumptions']
+    if not assumption_refs:
+        return []
+    explain_start_time = time.time()
+    conflict_model = load_model_proto(model.Proto().SerializeToString() if isinstance(model, cp_model.CpModel) else model)
+    conflict_model.ClearObjective()
+    conflict_model.ClearHints()
+    for index in assumption_refs:
+        conflict_model.Proto().variables[index].domain[:] = [0, 1]
+
+    def find_core(assumption_indices, step_time_limit=None):
+        remaining_time = time_limit - (time.time() - explain_start_time)
+        if remaining_time <= 0 or (should_stop is not None and should_stop()):
+            return None
+        conflict_model.ClearAssumptions()
+        conflict_model.Proto().assumptions.extend(assumption_indices)
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = min(remaining_time, step_time_limit or remaining_time)
+        solver.parameters.num_workers = num_workers
+        with SearchStopper(solver, should_stop):
+            status = solver.Solve(conflict_model)
+        if status != cp_model.INFEASIBLE:
+            return None
+        return list(solver.SufficientAssumptionsForInfeasibility())
+
+    core = find_core(list(assumption_refs))
+    logger.debug("Infeasibility explanation: first core has %d personal constraints (%.2fs)", len(core or []), time.time() - explain_start_time)
+    if not core:
+        logger.info("Infeasibility explanation: no conflicting personal constraints found (%.2fs)", time.time() - explain_start_time)
+        return []
+    for index in list(core):
+        if index not in core:
+            continue
+        # A constraint whose removal cannot be proven infeasible quickly is kept in the core.
+        smaller_core = find_core([other for other in core if other != index], CONFLICT_MINIMIZATION_STEP_TIME_LIMIT)
+        if smaller_core is not None:
+            core = smaller_core
+    logger.info("Infeasibility explanation: %d conflicting personal constraints (%.2fs)", len(core), time.time() - explain_start_time)
+    return [assumption_refs[index] for index in sorted(core)]
+
+
+def run_schedule_solve(schedule_request, on_solution=None, warm_start=None):
+    # Builds, solves and formats one schedule request; used in-process and as the process pool task.
+    # warm_start is an optional complete shift assignment (nurses, days, 3) used as the solution hint.
+    try:
+        start_time = schedule_request['received_at']
+        stage_timer = schedule_request['stage_timer']
+        cancel_slot = schedule_request['cancel_slot']
+        should_stop = get_stop_check(cancel_slot)
+        cancel_reason = get_cancel_reason(cancel_slot)
+        if cancel_reason:
+            logger.info("Solve was cancelled (%s) before it started", cancel_reason)
+            return build_cancelled_result(cancel_reason)
+        precheck_start_time = time.time()
+        conflicts, precheck_warnings = precheck_schedule_request(schedule_request)
+        precheck_seconds = round(time.time() - precheck_start_time, 4)
+        stage_timer.add('precheck', precheck_seconds)
+        if conflicts:
+            logger.info("Pre-check found %d conflicts, skipping the solver (%ss)", len(conflicts), precheck_seconds)
+            error_message = "ไม่สามารถสร้างตารางเวรได้ เนื่องจากข้อจำกัดขัดแย้งกัน (ตรวจพบก่อนเริ่มคำนวณ): " + "; ".join(describe_conflict(conflict) for conflict in conflicts[:3])
+            return {"error": error_message, "solverStatus": "INFEASIBLE", "conflicts": conflicts,
+                    "timings": {"precheckSeconds": precheck_seconds, "totalSeconds": round(time.time() - start_time, 3),
+                                "stages": stage_timer.as_dict()}}, 500
+        for warning in precheck_warnings:
+            logger.info("Pre-check warning: %s", warning)
+
+        model_build_start_time = time.time()
+        model, var_index = build_model(schedule_request)
+        # The warm start completion counts against the request's time limit; it may take at most half of it.
+        solver_time_limit = schedule_request['solver_time_limit']
+        warm_start_seconds = 0.0
+        if warm_start is not None:
+            warm_start_start_time = time.time()
+            with stage_timer.span('warm_start'):
+                set_complete_solution_hint(model, var_index, warm_start, num_workers=schedule_request['num_workers'], should_stop=should_stop,
+                                           time_limit=min(WARM_START_COMPLETION_TIME_LIMIT, solver_time_limit / 2))
+            warm_start_seconds = time.time() - warm_start_start_time
+            solver_time_limit = max(solver_time_limit - warm_start_seconds, 0.1)
+
+        model_stats = get_model_size(model)
+        if var_index['symmetry_classes']:
+            model_stats['interchangeableNurseClasses'] = var_index['symmetry_classes']
+        logger.info("Model size: %d variables, %d constraints", model_stats['variables'], model_stats['constraints'])
+
+        solution_streamer = None
+        if on_solution is not None:
+            solution_streamer = ScheduleSolutionStreamer(
+                lambda solution: build_schedule_result(schedule_request, var_index, solution),
+                on_solution, has_objective=var_index['has_objective'], objective_stages=var_index['objective_stages'],
+            )
+        solve_fn = solve_lexicographic if var_index['objective_stages'] else solve
+        outcome = solve_fn(model, var_index, solver_time_limit, num_workers=schedule_request['num_workers'],
+                           solution_callback=solution_streamer, should_stop=should_stop)
+        status = outcome['status']
+        cancel_reason = get_cancel_reason(cancel_slot) if status != cp_model.OPTIMAL else None
+        presolve = outcome['presolve']
+        solve_seconds = outcome['solve_end_time'] - outcome['solve_start_time']
+        if presolve:
+            stage_timer.add('presolve', presolve['seconds'])
+            stage_timer.add('search', max(solve_seconds - presolve['seconds'], 0.0))
+            model_stats['presolvedVariables'] = presolve['variables']
+            model_stats['presolvedConstraints'] = presolve['constraints']
+        else:
+            stage_timer.add('search', solve_seconds)
+        timings = {
+            "precheckSeconds": precheck_seconds,
+            # The warm start completion is a solve of its own; it is reported apart so build times stay comparable.
+            "modelBuildSeconds": round(outcome['solve_start_time'] - model_build_start_time - warm_start_seconds, 3),
+            "solveSeconds": round(solve_seconds, 3),
+            "totalSeconds": round(outcome['solve_end_time'] - start_time, 3),
+        }
+        if warm_start is not None:
+            timings["warmStartSeconds"] = round(warm_start_seconds, 3)
+
+        if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+            objective_value = outcome['objective_value']
+            logger.info("Solution found (Status: %s). Objective Value: %.2f", outcome['status_name'], objective_value)
+
+            try:
+                with stage_timer.span('extract'):
+                    schedule_result = build_schedule_result(schedule_request, var_index, outcome['solution'])
+                fairness = schedule_result["fairnessReport"]
+
+                logger.debug("Actual Off Days Range: %d-%d, Total Shifts Range: %d-%d, M/A/N Ranges: %d-%d/%d-%d/%d-%d, N+A (ดึกควบบ่าย) doubles: %d",
+                             fairness['offDaysMin'], fairness['offDaysMax'], fairness['totalShiftsMin'], fairness['totalShiftsMax'],
+                             fairness['morningMin'], fairness['morningMax'], fairness['afternoonMin'], fairness['afternoonMax'],
+                             fairness['nightMin'], fairness['nightMax'], fairness['totalNADoubles'])
+                logger.info("Schedule generation successful. Total time: %.2fs", time.time() - start_time)
+
+                timings["stages"] = stage_timer.as_dict()
+                schedule_result["solverStatus"] = outcome['status_name']
+                schedule_result["penaltyValue"] = objective_value
+                schedule_result["modelStats"] = model_stats
+                schedule_result["timings"] = timings
+                if 'stages' in outcome:
+                    schedule_result["objectiveStages"] = outcome['stages']
+                if precheck_warnings:
+                    schedule_result["precheckWarnings"] = precheck_warnings
+                if cancel_reason:
+                    # The best schedule found before the search was stopped; it is not cached.
+                    logger.info("Solve was cancelled (%s), returning the best schedule found so far", cancel_reason)
+                    schedule_result["cancelReason"] = cancel_reason
+                hint_assignments = schedule_request['hint_assignments']
+                if hint_assignments:
+                    assignments = extract_shift_assignments(var_index, outcome['solution'])
+                    schedule_result["hint"] = {
+                        "hintedAssignments": len(hint_assignments),
+                        "changedAssignments": sum(1 for (n, d, s), hinted_value in hint_assignments.items() if assignments[n, d, s - 1] != hinted_value),
+                        "keepCloseToHint": schedule_request['hint_objective'] is not None,
+                    }
+                return schedule_result, 200
+            except Exception as result_error:
+                 logger.exception("Error during result processing")
+                 return {"error": f"เกิดข้อผิดพลาดในการประมวลผลผลลัพธ์: {result_error}"}, 500
+
+        elif cancel_reason:
+            logger.info("Solve was cancelled (%s) before a schedule was found", cancel_reason)
+            timings["stages"] = stage_timer.as_dict()
+            cancelled_result, status_code = build_cancelled_result(cancel_reason)
+            cancelled_result.update({"modelStats": model_stats, "timings": timings})
+            return cancelled_result, status_code
+
+        else:
+            error_message = f"ไม่สามารถสร้างตารางเวรได้ (Solver Status: {outcome['status_name']}). "
+            conflicts = []
+            if status == cp_model.INFEASIBLE:
+                error_message += "ข้อจำกัดที่ตั้งไว้แบบ 'ต้องเป็นแบบนี้เท่านั้น' (Hard Constraints) ขัดแย้งกันเอง หรืออาจเกิดจากข้อจำกัดส่วนบุคคล หรือข้อจำกัดที่ต่อเนื่องมาจากเดือนก่อนหน้า (เช่น เวรติดต่อกันเกินกำหนด) ลองตรวจสอบและผ่อนปรนข้อจำกัดแบบ Hard หรือเปลี่ยนบางข้อจำกัดส่วนบุคคลเป็นแบบ 'ถ้าเป็นไปได้' (Soft)"
+                explain_start_time = time.time()
+                with stage_timer.span('conflict_explanation'):
+                    conflicting_constraints = explain_infeasibility(model, var_index, min(CONFLICT_EXPLANATION_TIME_LIMIT, schedule_request['solver_time_limit']),
+                                                                    num_workers=schedule_request['num_workers'], should_stop=should_stop)
+                timings["conflictExplanationSeconds"] = round(time.time() - explain_start_time, 3)
+                conflicts = [{'type': 'hard_constraints', 'constraints': conflicting_constraints}]
+                error_message += " (" + describe_conflict(conflicts[0]) + ")"
+            elif status == cp_model.UNKNOWN: error_message += f"อาจหมดเวลา ({schedule_request['solver_time_limit']}s) ก่อนหาคำตอบที่ดีที่สุดได้ ลองเพิ่มเวลาคำนวณ หรือลดความซับซ้อนของข้อจำกัด"
+            elif status == cp_model.MODEL_INVALID: error_message += "Model ไม่ถูกต้อง กรุณาตรวจสอบ Backend Log"
+            else: error_message += "เกิดข้อผิดพลาดที่ไม่ทราบสาเหตุ"
+            logger.info("Schedule generation failed. Status: %s", outcome['status_name'])
+            timings["stages"] = stage_timer.as_dict()
+            error_result = {"error": error_message, "solverStatus": outcome['status_name'], "modelStats": model_stats, "timings": timings}
+            if conflicts:
+                error_result["conflicts"] = conflicts
+            return error_result, 500
+
+    except Exception as e:
+        logger.exception("Unexpected error in run_schedule_solve")
+        return {"error": f"เกิดข้อผิดพลาดที่ไม่คาดคิดใน Server: {e}"}, 500
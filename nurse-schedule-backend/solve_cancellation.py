@@ -0,0 +1,208 @@
+# solve_cancellation.py
+
+from contextlib import contextmanager
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+
+from telemetry import configure_logging
+
+CANCEL_REASON_CANCELLED = 'cancelled'
+CANCEL_REASON_SUPERSEDED = 'superseded'
+CANCEL_REASON_CLIENT_DISCONNECTED = 'client_disconnected'
+# A cancel flag holds 0 while the solve is wanted, or the 1-based position of its reason in this list.
+CANCEL_REASONS = [CANCEL_REASON_CANCELLED, CANCEL_REASON_SUPERSEDED, CANCEL_REASON_CLIENT_DISCONNECTED]
+CANCEL_MESSAGES = {
+    CANCEL_REASON_CANCELLED: "การคำนวณตารางเวรถูกยกเลิก",
+    CANCEL_REASON_SUPERSEDED: "การคำนวณตารางเวรถูกยกเลิก เนื่องจากมีคำขอใหม่จากวอร์ดหรือผู้ใช้เดียวกัน",
+    CANCEL_REASON_CLIENT_DISCONNECTED: "การคำนวณตารางเวรถูกยกเลิก เนื่องจากการเชื่อมต่อกับผู้ใช้ถูกตัดขาด",
+}
+# nginx's "client closed request"; the solve stopped before it found a schedule.
+CANCELLED_HTTP_STATUS = 499
+CANCEL_POLL_SECONDS = 0.1
+# How long a cancel for a group whose solves have not all registered yet is kept, if its owner never forgets it.
+PENDING_CANCEL_TTL_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+# Shared with the solver processes; set by set_cancel_flags() in the server and by init_solver_process() in the pool.
+_cancel_flags = None
+
+
+def set_cancel_flags(cancel_flags):
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+
+
+def init_solver_process(cancel_flags):
+    # Process pool initializer: the flag array can only reach a spawned process as a start-up argument.
+    set_cancel_flags(cancel_flags)
+    configure_logging()
+
+
+def get_cancel_reason(cancel_slot):
+    if cancel_slot is None or _cancel_flags is None or _cancel_flags[cancel_slot] <= 0:
+        return None
+    return CANCEL_REASONS[_cancel_flags[cancel_slot] - 1]
+
+
+def is_solve_cancelled(cancel_slot):
+    return get_cancel_reason(cancel_slot) is not None
+
+
+def get_stop_check(cancel_slot):
+    # should_stop callable for solve() and friends; None for solves that cannot be cancelled.
+    if cancel_slot is None:
+        return None
+    return lambda: is_solve_cancelled(cancel_slot)
+
+
+def build_cancelled_result(reason):
+    return {"error": CANCEL_MESSAGES[reason], "solverStatus": "CANCELLED", "cancelReason": reason}, CANCELLED_HTTP_STATUS
+
+
+class SearchStopper:
+    # Polls should_stop() on a helper thread while a CP-SAT solve runs and stops the search once it returns True;
+    # the solver then returns the best solution found so far. StopSearch() before Solve() has started does
+    # nothing, so it is repeated on every poll until the solve ends.
+    def __init__(self, solver, should_stop, poll_seconds=CANCEL_POLL_SECONDS):
+        self.solver = solver
+        self.should_stop = should_stop
+        self.poll_seconds = poll_seconds
+        self.stopped = False
+        self._done = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.should_stop is not None:
+            self._thread = threading.Thread(target=self._poll, name='search-stopper', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _poll(self):
+        while not self._done.wait(self.poll_seconds):
+            if self.should_stop():
+                if not self.stopped:
+                    logger.info("Stopping the solver search, the solve was cancelled")
+                self.stopped = True
+                self.solver.StopSearch()
+
+
+class SolveRegistry:
+    # Solves that can still be cancelled. Each holds one slot of a flag array shared with the solver processes,
+    # which their solves poll. A solve registered with the supersede key of a running solve (same ward or planner
+    # session) or with the same solve id cancels that one. A group (batch, sweep, job or stream id) cancels all its
+    # solves at once, including the ones that register after the cancel, until the group's owner forgets it.
+    # Groups are server-generated; a client's own id for one is an alias that only lasts until the group is forgotten.
+    def __init__(self, max_active_solves):
+        if max_active_solves < 1: raise ValueError("max_active_solves must be >= 1")
+        self.cancel_flags = multiprocessing.get_context('spawn').RawArray('b', max_active_solves)
+        self._lock = threading.Lock()
+        self._free_slots = list(range(max_active_solves - 1, -1, -1))
+        self._active = {}
+        self._pending_cancels = {}
+        self._group_aliases = {}
+        self._tokens = itertools.count(1)
+
+    def register(self, solve_id, supersede_key=None, group=None):
+        with self._lock:
+            for entry in self._active.values():
+                if entry['solveId'] == solve_id or (supersede_key is not None and entry['supersedeKey'] == supersede_key):
+                    self._cancel_locked(entry, CANCEL_REASON_SUPERSEDED)
+            slot = self._free_slots.pop() if self._free_slots else None
+            entry = {
+                'token': next(self._tokens),
+                'solveId': solve_id,
+                'supersedeKey': supersede_key,
+                'group': group,
+                'slot': slot,
+                'startedAt': time.time(),
+                'cancelReason': None,
+            }
+            self._active[entry['token']] = entry
+            if slot is not None:
+                self.cancel_flags[slot] = 0
+            self._evict_pending_cancels_locked()
+            # Only groups carry a cancel forward: a solve id may come from the client and be reused by a retry.
+            pending_cancel = self._pending_cancels.get(group) if group is not None else None
+            if pending_cancel is not None:
+                self._cancel_locked(entry, pending_cancel[0])
+        if slot is None:
+            logger.warning("No cancel slot free for solve %s, it will run to its time limit", solve_id)
+        return entry
+
+    def release(self, entry):
+        with self._lock:
+            if self._active.pop(entry['token'], None) is not None and entry['slot'] is not None:
+                self._free_slots.append(entry['slot'])
+
+    @contextmanager
+    def track(self, solve_id, supersede_key=None, group=None):
+        entry = self.register(solve_id, supersede_key, group)
+        try:
+            yield entry
+        finally:
+            self.release(entry)
+
+    def add_alias(self, alias, group):
+        # Lets cancel(alias) reach the group's solves until forget(group).
+        with self._lock:
+            self._group_aliases.setdefault(alias, set()).add(group)
+
+    def cancel(self, solve_id, reason=CANCEL_REASON_CANCELLED, remember=False):
+        # Cancels the solve with this id, or every solve of the group with this id or alias. Returns how many were
+        # cancelled. Group members that have not started yet are cancelled when they register. remember=True does
+        # the same for a group none of whose solves has registered yet, for callers that may get here before it starts.
+        with self._lock:
+            aliased_groups = self._group_aliases.get(solve_id, set())
+            matching = [entry for entry in self._active.values()
+                        if solve_id in (entry['solveId'], entry['group']) or entry['group'] in aliased_groups]
+            for entry in matching:
+                self._cancel_locked(entry, reason)
+            if remember or any(entry['group'] == solve_id for entry in matching):
+                self._pending_cancels[solve_id] = (reason, time.time())
+            # Pending cancels go under the server's group, never under the alias a retry may reuse.
+            for group in aliased_groups:
+                self._pending_cancels[group] = (reason, time.time())
+        return len(matching)
+
+    def forget(self, group):
+        # Called by the owner of a group once all its solves are done, so a later group with the same id starts clean.
+        with self._lock:
+            self._pending_cancels.pop(group, None)
+            for alias, groups in list(self._group_aliases.items()):
+                groups.discard(group)
+                if not groups:
+                    del self._group_aliases[alias]
+
+    def active(self):
+        now = time.time()
+        with self._lock:
+            return [{
+                'solveId': entry['solveId'],
+                'supersedeKey': entry['supersedeKey'],
+                'group': entry['group'],
+                'runningSeconds': round(now - entry['startedAt'], 3),
+                'cancelReason': entry['cancelReason'],
+            } for entry in self._active.values()]
+
+    def _cancel_locked(self, entry, reason):
+        if entry['cancelReason'] is not None:
+            return
+        entry['cancelReason'] = reason
+        if entry['slot'] is not None:
+            self.cancel_flags[entry['slot']] = CANCEL_REASONS.index(reason) + 1
+        logger.info("Cancelling solve %s (%s)", entry['solveId'], reason)
+
+    def _evict_pending_cancels_locked(self):
+        now = time.time()
+        expired = [solve_id for solve_id, (_, cancelled_at) in self._pending_cancels.items() if now - cancelled_at > PENDING_CANCEL_TTL_SECONDS]
+        for solve_id in expired:
+            del self._pending_cancels[solve_id]
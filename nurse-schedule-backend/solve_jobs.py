@@ -0,0 +1,136 @@
+# solve_jobs.py
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import uuid
+
+from solve_cancellation import CANCEL_REASON_CANCELLED, build_cancelled_result
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_JOB_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class SolveJobQueue:
+    # Runs schedule solves on a bounded worker pool. solve_fn(payload, job_id) must return (result_dict, http_status).
+    # cancel_running(job_id), if given, stops a job that is being solved; its solve then returns early.
+    def __init__(self, solve_fn, max_workers=2, max_queued=20, result_ttl_seconds=3600, cancel_running=None):
+        if max_workers < 1: raise ValueError("max_workers must be >= 1")
+        if max_queued < 0: raise ValueError("max_queued cannot be negative")
+        self.solve_fn = solve_fn
+        self.cancel_running = cancel_running
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.result_ttl_seconds = result_ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='solve-job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._queue_order = []
+
+    def submit(self, payload):
+        with self._lock:
+            self._evict_expired_locked()
+            if len(self._queue_order) >= self.max_queued:
+                raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'jobId': job_id,
+                'status': JOB_QUEUED,
+                'createdAt': time.time(),
+                'startedAt': None,
+                'finishedAt': None,
+                'httpStatus': None,
+                'result': None,
+            }
+            self._queue_order.append(job_id)
+            snapshot = self._snapshot_locked(job_id)
+        self._executor.submit(self._run_job, job_id, payload)
+        return snapshot
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict_expired_locked()
+            if job_id not in self._jobs:
+                return None
+            return self._snapshot_locked(job_id)
+
+    def cancel(self, job_id):
+        # A queued job is dropped before it reaches a worker; a running one is handed to cancel_running and ends as
+        # 'cancelled' once its solve returns. Returns the job snapshot, or None for an unknown job.
+        with self._lock:
+            self._evict_expired_locked()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == JOB_QUEUED:
+                self._queue_order.remove(job_id)
+                job['status'] = JOB_CANCELLED
+                job['finishedAt'] = time.time()
+                job['result'], job['httpStatus'] = build_cancelled_result(CANCEL_REASON_CANCELLED)
+            running = job['status'] == JOB_RUNNING
+            snapshot = self._snapshot_locked(job_id)
+        if running and self.cancel_running is not None:
+            self.cancel_running(job_id)
+        return snapshot
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job['status'] == JOB_RUNNING)
+            return {
+                'maxWorkers': self.max_workers,
+                'maxQueued': self.max_queued,
+                'queued': len(self._queue_order),
+                'running': running,
+            }
+
+    def _run_job(self, job_id, payload):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != JOB_QUEUED:
+                return
+            self._queue_order.remove(job_id)
+            job['status'] = JOB_RUNNING
+            job['startedAt'] = time.time()
+
+        try:
+            result, http_status = self.solve_fn(payload, job_id)
+            if result.get('cancelReason'):
+                final_status = JOB_CANCELLED
+            else:
+                final_status = JOB_SUCCEEDED if http_status < 400 else JOB_FAILED
+        except Exception as e:
+            logger.exception("Error in solve job %s", job_id)
+            result, http_status = {"error": f"เกิดข้อผิดพลาดที่ไม่คาดคิดใน Server: {e}"}, 500
+            final_status = JOB_FAILED
+
+        with self._lock:
+            job['status'] = final_status
+            job['finishedAt'] = time.time()
+            job['httpStatus'] = http_status
+            job['result'] = result
+
+    def _snapshot_locked(self, job_id):
+        job = dict(self._jobs[job_id])
+        if job['status'] == JOB_QUEUED:
+            job['queuePosition'] = self._queue_order.index(job_id) + 1
+        if job['status'] not in FINISHED_JOB_STATES:
+            del job['result']
+        return job
+
+    def _evict_expired_locked(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] in FINISHED_JOB_STATES and now - job['finishedAt'] > self.result_ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
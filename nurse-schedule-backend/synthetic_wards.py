@@ -0,0 +1,97 @@
+# synthetic_wards.py
+
+import calendar
+import datetime
+import random
+
+from schedule_model import SHIFT_MORNING, SHIFT_AFTERNOON, SHIFT_NIGHT
+
+WEEKDAY_CONSTRAINT_TYPES = ['no_mondays', 'no_tuesdays', 'no_wednesdays', 'no_thursdays', 'no_fridays', 'no_saturdays', 'no_sundays']
+SHIFT_CONSTRAINT_TYPES = ['no_morning_shifts', 'no_afternoon_shifts', 'no_night_shifts', 'no_night_afternoon_double']
+
+# Repeating pattern for the synthetic previous month; it never puts N after A, so the boundary stays feasible.
+PREVIOUS_MONTH_PATTERN = [[SHIFT_MORNING], [SHIFT_MORNING], [SHIFT_AFTERNOON], [], [SHIFT_NIGHT], [SHIFT_NIGHT, SHIFT_AFTERNOON], []]
+
+
+def month_period(year, month, num_days=None):
+    days_in_month = calendar.monthrange(year, month)[1]
+    num_days = min(num_days or days_in_month, days_in_month)
+    start_date = datetime.date(year, month, 1)
+    return start_date, start_date + datetime.timedelta(days=num_days - 1)
+
+
+def required_nurses_for_ward(num_nurses, num_days, target_off_days):
+    # Size daily M/A/N demand so the ward can cover it while giving everyone roughly the target off days.
+    working_days = max(num_days - target_off_days - 1, 1)
+    shifts_per_day = max(3, int(num_nurses * working_days / num_days * 1.1))
+    morning = max(1, round(shifts_per_day * 0.3))
+    night = max(1, round(shifts_per_day * 0.3))
+    afternoon = max(1, shifts_per_day - morning - night)
+    return morning, afternoon, night
+
+
+def random_personal_constraints(rng, num_days, hard_ratio=0.3):
+    constraints = []
+    for _ in range(rng.choice([0, 0, 1, 1, 2])):
+        strength = 'hard' if rng.random() < hard_ratio else 'soft'
+        kind = rng.random()
+        if kind < 0.4:
+            constraints.append({'type': rng.choice(WEEKDAY_CONSTRAINT_TYPES), 'strength': strength})
+        elif kind < 0.7:
+            constraints.append({'type': rng.choice(SHIFT_CONSTRAINT_TYPES), 'strength': strength})
+        else:
+            day_numbers = sorted(rng.sample(range(1, num_days + 1), rng.randint(1, 3)))
+            constraints.append({'type': 'no_specific_days', 'value': day_numbers, 'strength': strength})
+    return constraints
+
+
+def previous_month_schedule(nurses, start_date, num_days=7):
+    days = [start_date - datetime.timedelta(days=offset) for offset in range(num_days, 0, -1)]
+    days_iso = [day.isoformat() for day in days]
+    nurse_schedules = {}
+    for index, nurse in enumerate(nurses):
+        nurse_schedules[nurse['id']] = {
+            'nurse': {key: value for key, value in nurse.items() if key != 'constraints'},
+            'shifts': {
+                day_iso: PREVIOUS_MONTH_PATTERN[(index + d) % len(PREVIOUS_MONTH_PATTERN)]
+                for d, day_iso in enumerate(days_iso)
+            },
+        }
+    return {'nurseSchedules': nurse_schedules, 'days': days_iso}
+
+
+def generate_ward_payload(num_nurses, num_days=31, year=2026, month=1, seed=0, target_off_days=8,
+                          max_consecutive_shifts_worked=6, solver_time_limit=60.0,
+                          with_previous_month=True, constraint_hard_ratio=0.3):
+    rng = random.Random(seed)
+    start_date, end_date = month_period(year, month, num_days)
+    num_days = (end_date - start_date).days + 1
+
+    nurses = []
+    for index in range(num_nurses):
+        nurses.append({
+            'id': f'synthetic-nurse-{index:03d}',
+            'prefix': 'นางสาว',
+            'firstName': f'พยาบาล{index + 1}',
+            'lastName': 'ทดสอบ',
+            'position': 'พยาบาลวิชาชีพ',
+            'constraints': random_personal_constraints(rng, num_days, constraint_hard_ratio),
+        })
+
+    required_morning, required_afternoon, required_night = required_nurses_for_ward(num_nurses, num_days, target_off_days)
+    payload = {
+        'nurses': nurses,
+        'schedule': {
+            'startDate': start_date.isoformat(),
+            'endDate': end_date.isoformat(),
+            'holidays': sorted(rng.sample(range(1, num_days + 1), 2)),
+        },
+        'requiredNursesMorning': required_morning,
+        'requiredNursesAfternoon': required_afternoon,
+        'requiredNursesNight': required_night,
+        'maxConsecutiveShiftsWorked': max_consecutive_shifts_worked,
+        'targetOffDays': target_off_days,
+        'solverTimeLimit': solver_time_limit,
+        'previousMonthSchedule': previous_month_schedule(nurses, start_date) if with_previous_month else None,
+    }
+    return payload
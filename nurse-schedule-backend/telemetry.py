@@ -0,0 +1,99 @@
+# telemetry.py
+
+from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(processName)s] %(name)s: %(message)s'
+
+
+def configure_logging(level=None):
+    # LOG_LEVEL=DEBUG brings back the per-nurse and per-constraint detail; the default INFO keeps one line per stage.
+    logging.basicConfig(level=(level or os.environ.get('LOG_LEVEL', 'INFO')).upper(), format=LOG_FORMAT)
+
+
+class StageTimer:
+    # Wall-clock seconds per stage of one schedule request. It is a plain object so it can travel with the
+    # request to a solver process; the totals come back in the result as timings['stages'].
+    def __init__(self):
+        self.stages = {}
+        self._lap_start = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def start_laps(self):
+        self._lap_start = time.perf_counter()
+
+    def lap(self, stage):
+        # Charges the time since the previous lap (or start_laps()) to stage; for long straight-line code.
+        now = time.perf_counter()
+        self.add(stage, now - self._lap_start)
+        self._lap_start = now
+
+    def as_dict(self):
+        return {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+
+class MetricsRegistry:
+    # Counters, summaries (sum and count only) and callback gauges in the Prometheus text exposition format.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._counters = defaultdict(float)
+        self._summaries = defaultdict(lambda: [0.0, 0])
+        self._gauges = {}
+
+    def describe(self, name, metric_type, help_text):
+        self._descriptions[name] = (metric_type, help_text)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            summary = self._summaries[name, tuple(sorted(labels.items()))]
+            summary[0] += value
+            summary[1] += 1
+
+    def gauge(self, name, help_text, read_value):
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = read_value
+
+    def render(self):
+        with self._lock:
+            samples = defaultdict(list)
+            for (name, labels), value in self._counters.items():
+                samples[name].append(f'{name}{format_labels(labels)} {value:g}')
+            for (name, labels), (total, count) in self._summaries.items():
+                samples[name].append(f'{name}_sum{format_labels(labels)} {total:.6f}')
+                samples[name].append(f'{name}_count{format_labels(labels)} {count}')
+        for name, read_value in self._gauges.items():
+            samples[name].append(f'{name} {read_value():g}')
+
+        lines = []
+        for name in sorted(samples):
+            if name in self._descriptions:
+                metric_type, help_text = self._descriptions[name]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(sorted(samples[name]))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,89 @@
+# template_check.py
+#
+# Regression check for the model template cache: for each synthetic ward, a request built on a template reused from
+# another request of the same shape must give the same model and the same optimum as a build from scratch, and
+# build_model() must leave the cached template untouched. Exits with 1 on any mismatch.
+#
+#   python template_check.py --nurses 6,8 --days 7,10 --seeds 1,2 --deterministic-time 5
+
+import argparse
+import sys
+
+from ortools.sat.python import cp_model
+
+import schedule_model
+from benchmark import parse_int_list
+from schedule_model import ModelTemplateCache, build_model, get_model_template_key, parse_schedule_request
+from synthetic_wards import generate_ward_payload
+
+
+def build_and_solve(schedule_request, deterministic_time):
+    # One worker and a deterministic time limit, so the same model always stops at the same solution and two
+    # objectives can be compared even when neither is proven optimal.
+    model, _ = build_model(schedule_request)
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = 1
+    solver.parameters.max_deterministic_time = deterministic_time
+    status = solver.Solve(model)
+    objective = solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None
+    return model.Proto().SerializeToString(), solver.StatusName(status), objective
+
+
+def check_case(num_nurses, num_days, seed, deterministic_time, year, month):
+    # The first request fills the cache, the second (another seed, so other personal constraints) reuses the template.
+    def parse(request_seed):
+        return parse_schedule_request(generate_ward_payload(num_nurses, num_days=num_days, year=year, month=month, seed=request_seed))
+
+    case_id = f'n{num_nurses}-d{num_days}-s{seed}'
+    problems = []
+
+    schedule_model.model_templates = ModelTemplateCache(max_entries=0)
+    fresh_proto, fresh_status, fresh_objective = build_and_solve(parse(seed), deterministic_time)
+
+    def template_not_cached():
+        raise RuntimeError(f"{case_id}: build_model() did not cache its template")
+
+    schedule_model.model_templates = ModelTemplateCache()
+    first_request = parse(seed + 1000)
+    build_model(first_request)
+    template, _ = schedule_model.model_templates.get_or_build(get_model_template_key(first_request), template_not_cached)
+    template_bytes = template['proto'].SerializeToString()
+    second_request = parse(seed)
+    if get_model_template_key(second_request) != get_model_template_key(first_request):
+        return [f"{case_id}: the two requests do not share a template, nothing was checked"]
+    reused_proto, reused_status, reused_objective = build_and_solve(second_request, deterministic_time)
+
+    if template['proto'].SerializeToString() != template_bytes:
+        problems.append(f"{case_id}: build_model() changed the cached template")
+    if reused_proto != fresh_proto:
+        problems.append(f"{case_id}: the model built on a reused template differs from a fresh build")
+    if (fresh_status, fresh_objective) != (reused_status, reused_objective):
+        problems.append(f"{case_id}: {fresh_status} {fresh_objective} fresh, {reused_status} {reused_objective} with a reused template")
+
+    print(f"{case_id}: {fresh_status} {fresh_objective} fresh, {reused_status} {reused_objective} reused", flush=True)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that reused model templates build the same model as a fresh build.")
+    parser.add_argument('--nurses', default='6,8', help="Comma separated nurse counts (default: 6,8)")
+    parser.add_argument('--days', default='7,10', help="Comma separated horizon lengths in days (default: 7,10)")
+    parser.add_argument('--seeds', default='1', help="Comma separated random seeds (default: 1)")
+    parser.add_argument('--deterministic-time', type=float, default=2.0, help="CP-SAT deterministic time limit per solve (default: 2)")
+    parser.add_argument('--year', type=int, default=2026)
+    parser.add_argument('--month', type=int, default=1, help="Month to schedule; must have at least max(--days) days")
+    args = parser.parse_args()
+
+    problems = []
+    for num_nurses in parse_int_list(args.nurses):
+        for num_days in parse_int_list(args.days):
+            for seed in parse_int_list(args.seeds):
+                problems.extend(check_case(num_nurses, num_days, seed, args.deterministic_time, args.year, args.month))
+
+    for problem in problems:
+        print(f"MISMATCH {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
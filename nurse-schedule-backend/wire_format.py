@@ -0,0 +1,86 @@
+# wire_format.py
+
+import gzip
+import logging
+
+from schedule_model import COMPACT_SCHEDULE_FORMAT, compact_schedule_result
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_FORMAT_FULL = 'full'
+RESPONSE_FORMAT_COMPACT = 'compact'
+RESPONSE_FORMATS = (RESPONSE_FORMAT_FULL, RESPONSE_FORMAT_COMPACT)
+COMPACT_DELTA_FORMAT = COMPACT_SCHEDULE_FORMAT + '-delta'
+# Bodies smaller than this are sent as they are; compressing them saves less than the header costs.
+COMPRESS_MIN_BYTES = 1024
+GZIP_COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def get_response_format(data):
+    # "responseFormat": "compact" in the request payload opts into COMPACT_SCHEDULE_FORMAT; anything else is full.
+    response_format = (data or {}).get('responseFormat') if isinstance(data, dict) else None
+    return response_format if response_format in RESPONSE_FORMATS else RESPONSE_FORMAT_FULL
+
+
+def format_schedule_result(schedule_result, response_format):
+    if response_format == RESPONSE_FORMAT_COMPACT:
+        return compact_schedule_result(schedule_result)
+    return schedule_result
+
+
+def choose_content_encoding(accept_encoding):
+    # Picks br (when the brotli package is installed) or gzip from an Accept-Encoding header, honouring q=0.
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    candidates = [coding for coding in candidates if accepted.get(coding, accepted.get('*', 0.0)) > 0]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda coding: accepted.get(coding, accepted.get('*', 0.0)))
+
+
+def compress_body(body, content_encoding):
+    if content_encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL)
+
+
+class CompactSolutionEncoder:
+    # Encodes the improving solutions of one streamed solve: the first as a full compact schedule, every later one
+    # as COMPACT_DELTA_FORMAT with only the nurse-days that changed, as [nurseIndex, dayIndex, shiftMask] triples.
+    def __init__(self):
+        self._previous_rows = None
+
+    def encode(self, solution):
+        compact = compact_schedule_result(solution)
+        rows = compact.get('shifts')
+        if rows is None:
+            return compact
+        if self._previous_rows is None or len(rows) != len(self._previous_rows):
+            self._previous_rows = rows
+            return compact
+        changes = [
+            [n, d, int(mask)]
+            for n, (previous_row, row) in enumerate(zip(self._previous_rows, rows)) if previous_row != row
+            for d, (previous_mask, mask) in enumerate(zip(previous_row, row)) if previous_mask != mask
+        ]
+        self._previous_rows = rows
+        delta = {key: value for key, value in compact.items() if key not in ('nurses', 'shifts', 'days', 'shiftsCountColumns')}
+        delta['format'] = COMPACT_DELTA_FORMAT
+        delta['changes'] = changes
+        return delta